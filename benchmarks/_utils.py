@@ -0,0 +1,88 @@
+"""
+Shared setup for the scripts in this directory.  Each benchmark runs against a
+throwaway test database created from the example project's settings, so it
+never touches ``notorhot_example/db.sqlite3``.
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notorhot_example.app.settings')
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+
+@contextmanager
+def benchmark_database(test_name=None):
+    """
+    Creates a test database for the duration of the ``with`` block, and 
+    configures a local-memory cache large enough to hold big candidate 
+    indexes without culling.
+    
+    :param test_name: file name for the test database; by default SQLite 
+        test databases are in memory, and so can't be shared between threads
+    """
+    if test_name is not None:
+        connection.settings_dict['TEST_NAME'] = test_name
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': { 'MAX_ENTRIES': 1000000, },
+        },
+    }
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def populate_candidates(category, count, chunk_size=10000, **values):
+    """
+    Inserts ``count`` enabled candidates into ``category`` with raw SQL, 
+    bypassing slug generation and signals so that very large categories can 
+    be created quickly.  ``values`` may override the counter columns.
+    """
+    from notorhot.models import Candidate
+    from notorhot.ratings import INITIAL_RATING
+    
+    table = Candidate._meta.db_table
+    sql = ('INSERT INTO %s (name, slug, pic, is_enabled, category_id, '
+        'challenges, votes, wins, added, rating, win_pct, strength) VALUES '
+        '(%%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s)' % table)
+    now = timezone.now()
+    prefix = 'c%s-' % category.pk
+    
+    cursor = connection.cursor()
+    with transaction.atomic():
+        for start in xrange(0, count, chunk_size):
+            rows = [(prefix + str(i), prefix + str(i), 'candidates/bench.jpg', 
+                True, category.pk, values.get('challenges', 0), 
+                values.get('votes', 0), values.get('wins', 0), now, 
+                INITIAL_RATING, Candidate.calculate_win_pct(
+                values.get('wins', 0), values.get('votes', 0)), 0.0) 
+                for i in xrange(start, min(start + chunk_size, count))]
+            cursor.executemany(sql, rows)
+
+
+def time_calls(func, repeat):
+    """
+    Calls ``func`` ``repeat`` times.
+    
+    :returns: median wall-clock time per call, in milliseconds
+    """
+    timings = []
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
@@ -0,0 +1,104 @@
+"""
+Measures ``Candidate.objects.fit_strengths()`` as a category grows: the time
+to stream and summarize its votes, to fit Bradley-Terry strengths, and to
+write them back, and how closely the fit recovers the strengths the votes
+were simulated from.  Requires NumPy.
+
+Usage::
+
+    python benchmarks/bradley_terry.py [--sizes 100 1000 ...] [--votes-per-candidate 20]
+"""
+import argparse
+import math
+import random
+import time
+
+from _utils import benchmark_database, populate_candidates
+
+
+def populate_votes(category, candidate_ids, num_votes, chunk_size=10000):
+    """
+    Inserts ``num_votes`` voted competitions into ``category`` with raw SQL,
+    won according to randomly drawn true strengths.
+
+    :returns: dictionary mapping candidate IDs to their true log-strengths
+    """
+    from django.db import connection, transaction
+    from django.utils import timezone
+    from notorhot.models import Competition
+
+    rand = random.Random(0)
+    true = dict((pk, rand.gauss(0, 1)) for pk in candidate_ids)
+
+    sql = ('INSERT INTO %s (date_presented, date_voted, is_pooled, left_id, '
+        'right_id, category_id, winner_id, winning_side) VALUES (%%s, %%s, '
+        '%%s, %%s, %%s, %%s, %%s, %%s)' % Competition._meta.db_table)
+    now = timezone.now()
+
+    cursor = connection.cursor()
+    with transaction.atomic():
+        for start in xrange(0, num_votes, chunk_size):
+            rows = []
+            for i in xrange(start, min(start + chunk_size, num_votes)):
+                (left, right) = rand.sample(candidate_ids, 2)
+                if rand.random() < 1.0 / (1.0 + math.exp(true[right] -
+                        true[left])):
+                    (winner, side) = (left, Competition.SIDES.LEFT)
+                else:
+                    (winner, side) = (right, Competition.SIDES.RIGHT)
+                rows.append((now, now, False, left, right, category.pk,
+                    winner, side))
+            cursor.executemany(sql, rows)
+    return true
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--sizes', nargs='+', type=int,
+        default=[100, 1000, 10000, 100000])
+    parser.add_argument('--votes-per-candidate', type=int, default=20)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    args = parser.parse_args()
+
+    with benchmark_database():
+        import numpy
+        from notorhot.models import CandidateCategory, Candidate
+        from notorhot.strength import PairwiseCounts, fit_bradley_terry
+
+        print '%10s %10s %9s %9s %6s %9s %9s' % ('candidates', 'votes',
+            'read (s)', 'fit (s)', 'iters', 'write (s)', 'rms error')
+        for size in args.sizes:
+            category = CandidateCategory.objects.create(name='Size %d' % size)
+            populate_candidates(category, size)
+            ids = list(category.candidates.values_list('id', flat=True))
+            true = populate_votes(category, ids,
+                size * args.votes_per_candidate)
+
+            # the steps of fit_strengths(), timed separately
+            start = time.time()
+            counts = PairwiseCounts(ids)
+            for (winner_ids, loser_ids) in \
+                    Candidate.objects.stream_decisive_votes(category,
+                    args.chunk_size):
+                counts.add(winner_ids, loser_ids)
+            read = time.time() - start
+
+            start = time.time()
+            (strengths, iterations) = fit_bradley_terry(counts)
+            fit = time.time() - start
+
+            start = time.time()
+            Candidate.objects.set_strengths(dict(zip(counts.ids.tolist(),
+                strengths.tolist())))
+            write = time.time() - start
+
+            expected = numpy.array([true[pk] for pk in counts.ids.tolist()])
+            expected -= expected.mean()
+            error = math.sqrt(((strengths - expected) ** 2).mean())
+
+            print '%10d %10d %9.2f %9.2f %6d %9.2f %9.3f' % (size,
+                counts.num_votes, read, fit, iterations, write, error)
+
+
+if __name__ == '__main__':
+    main()
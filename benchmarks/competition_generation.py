@@ -0,0 +1,49 @@
+"""
+Compares competition generation latency as a category grows, between the
+``ORDER BY RANDOM()`` selection of 
+``Competition.objects.generate_from_queryset()`` and the cached candidate 
+index used by ``Competition.objects.generate_for_category()``.
+
+Usage::
+
+    python benchmarks/competition_generation.py [--sizes 100 1000 ...]
+"""
+import argparse
+
+from _utils import benchmark_database, populate_candidates, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--sizes', nargs='+', type=int, 
+        default=[100, 1000, 10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    
+    with benchmark_database():
+        from notorhot.caching import get_notorhot_cache
+        from notorhot.models import CandidateCategory, Competition
+        
+        print '%10s %15s %15s' % ('candidates', 'order_by (ms)', 'index (ms)')
+        for size in args.sizes:
+            category = CandidateCategory.objects.create(name='Size %d' % size)
+            populate_candidates(category, size)
+            queryset = category.candidates.enabled()
+            
+            # warm the index so only steady-state generation is measured
+            get_notorhot_cache().clear()
+            Competition.objects.generate_for_category(category)
+            
+            # order_by('?') is slow enough at large sizes to need fewer runs
+            random_order = time_calls(
+                lambda: Competition.objects.generate_from_queryset(queryset), 
+                max(3, args.repeat * 1000 // size))
+            indexed = time_calls(
+                lambda: Competition.objects.generate_for_category(category), 
+                args.repeat)
+            
+            print '%10d %15.2f %15.2f' % (size, random_order, indexed)
+            
+
+if __name__ == '__main__':
+    main()
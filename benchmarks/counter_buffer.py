@@ -0,0 +1,94 @@
+"""
+Compares the throughput of votes recorded against a single hot candidate, 
+between writing counters straight to the database and buffering them with
+each kind of ``NOTORHOT_SETTINGS['COUNTER_BUFFER']``.
+
+SQLite locks the whole database for writes, so sharding can't reduce 
+contention there; run against PostgreSQL or MySQL to see its effect.
+
+Usage::
+
+    python benchmarks/counter_buffer.py [--votes 2000] [--threads 1 4 16]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from _utils import benchmark_database, populate_candidates
+
+
+def run_votes(num_votes, num_threads, candidate_ids):
+    """
+    Records ``num_votes`` votes won by the first of ``candidate_ids``, split 
+    between ``num_threads`` threads.
+    
+    :returns: votes per second
+    """
+    from django.db import connection
+    from notorhot.models import Candidate
+    
+    (hot_id, other_ids) = (candidate_ids[0], candidate_ids[1:])
+    
+    def vote(count):
+        try:
+            for i in xrange(count):
+                Candidate.objects.record_vote(hot_id, 
+                    [other_ids[i % len(other_ids)],])
+        finally:
+            connection.close()
+    
+    threads = [threading.Thread(target=vote, args=(num_votes // num_threads,))
+        for i in xrange(num_threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return num_votes / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--votes', type=int, default=2000)
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 4, 16])
+    args = parser.parse_args()
+    
+    # threads need a database file they can all open
+    test_dir = tempfile.mkdtemp()
+    
+    with benchmark_database(os.path.join(test_dir, 'benchmark.sqlite3')):
+        from django.conf import settings
+        from django.test.utils import override_settings
+        from notorhot.counters import get_counter_buffer
+        from notorhot.models import CandidateCategory, Candidate
+        
+        settings.DATABASES['default'].setdefault('OPTIONS', {})['timeout'] = 60
+        category = CandidateCategory.objects.create(name='Hot')
+        populate_candidates(category, 100)
+        candidate_ids = list(category.candidates.values_list('id', flat=True))
+        
+        print '%8s %18s %18s %18s %18s' % ('threads', 'direct (votes/s)', 
+            'local (votes/s)', 'cache (votes/s)', 'shards (votes/s)')
+        for num_threads in args.threads:
+            rates = [run_votes(args.votes, num_threads, candidate_ids)]
+            for kind in ('local', 'cache', 'shards'):
+                with override_settings(NOTORHOT_SETTINGS={ 
+                        'COUNTER_BUFFER': kind, 'COUNTER_FLUSH_INTERVAL': 1, }):
+                    rates.append(run_votes(args.votes, num_threads, 
+                        candidate_ids))
+                    # include the cost of writing the buffer out
+                    get_counter_buffer().flush()
+            print '%8d %18.0f %18.0f %18.0f %18.0f' % tuple([num_threads] + rates)
+            
+        # the local-memory cache used here doesn't incr() atomically, so the
+        # cache buffer can drop increments under threads; memcached won't
+        hot = Candidate.objects.get(pk=candidate_ids[0])
+        print 'hot candidate: %d of %d votes recorded' % (hot.votes, 
+            4 * args.votes * len(args.threads))
+    os.rmdir(test_dir)
+            
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Compares how quickly votes recover a category's ranking when pairs are drawn
+uniformly at random and when they are chosen by
+:class:`~notorhot.pairing.AdaptivePairing`.  Votes are simulated in memory
+from randomly drawn true strengths; at each checkpoint, Bradley-Terry
+strengths are fitted to the votes so far and compared with the true ranking
+by Spearman rank correlation.  Requires NumPy.
+
+Usage::
+
+    python benchmarks/pairing.py [--sizes 100 1000 ...] [--targets 0.9 0.95] [--max-votes-per-candidate 50]
+"""
+import argparse
+import math
+import random
+
+import _utils
+
+
+class SimulatedCategory(object):
+    def __init__(self, pk):
+        self.pk = pk
+
+
+def random_pairs(ids, rand):
+    while True:
+        yield tuple(rand.sample(ids, 2))
+
+
+def adaptive_pairs(ids, neighbours, exploration):
+    from notorhot.pairing import AdaptivePairing, CategoryQueue
+    from notorhot.ratings import INITIAL_RATING
+
+    strategy = AdaptivePairing(neighbours=neighbours, exploration=exploration,
+        refresh=float('inf'))
+    category = SimulatedCategory(1)
+    strategy.queues[category.pk] = CategoryQueue((pk, 0, INITIAL_RATING)
+        for pk in ids)
+    while True:
+        result = yield strategy.choose(category)
+        if result is not None:
+            strategy.record_votes(category.pk, [result])
+
+
+def rank_correlation(estimated, expected):
+    import numpy
+    estimated_ranks = numpy.argsort(numpy.argsort(estimated))
+    expected_ranks = numpy.argsort(numpy.argsort(expected))
+    return numpy.corrcoef(estimated_ranks, expected_ranks)[0, 1]
+
+
+def simulate(ids, true, pairs, targets, max_votes, checkpoint):
+    """
+    Feeds votes between the pairs yielded by ``pairs``, won according to
+    ``true`` strengths, until every target rank correlation has been reached
+    or ``max_votes`` have been cast.
+
+    :returns: dictionary mapping each target to the number of votes at the
+        first checkpoint where it was reached, or ``None``
+    """
+    import numpy
+    from notorhot.strength import PairwiseCounts, fit_bradley_terry
+
+    counts = PairwiseCounts(ids)
+    expected = numpy.array([true[pk] for pk in counts.ids.tolist()])
+    reached = dict((target, None) for target in targets)
+    (winners, losers) = ([], [])
+
+    pair = next(pairs)
+    for num_votes in xrange(1, max_votes + 1):
+        (left, right) = pair
+        if random.random() < 1.0 / (1.0 + math.exp(true[right] -
+                true[left])):
+            (winner, loser) = (left, right)
+        else:
+            (winner, loser) = (right, left)
+        winners.append(winner)
+        losers.append(loser)
+        pair = pairs.send((winner, loser))
+
+        if num_votes % checkpoint == 0:
+            counts.add(winners, losers)
+            (winners, losers) = ([], [])
+            (strengths, iterations) = fit_bradley_terry(counts)
+            correlation = rank_correlation(strengths, expected)
+            for target in targets:
+                if reached[target] is None and correlation >= target:
+                    reached[target] = num_votes
+            if None not in reached.values():
+                break
+    return reached
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--sizes', nargs='+', type=int,
+        default=[100, 1000, 5000])
+    parser.add_argument('--targets', nargs='+', type=float,
+        default=[0.9, 0.95])
+    parser.add_argument('--max-votes-per-candidate', type=int, default=50)
+    parser.add_argument('--neighbours', type=int, default=10)
+    parser.add_argument('--exploration', type=float, default=0.1)
+    args = parser.parse_args()
+
+    print '%10s %10s %s' % ('candidates', 'pairing', ' '.join(
+        '%12s' % ('votes @ %.2f' % target) for target in args.targets))
+    for size in args.sizes:
+        rand = random.Random(size)
+        ids = range(1, size + 1)
+        true = dict((pk, rand.gauss(0, 1)) for pk in ids)
+        # fit after every half vote per candidate
+        checkpoint = max(size // 2, 1)
+
+        for (name, pairs) in (
+                ('random', random_pairs(ids, random.Random(0))),
+                ('adaptive', adaptive_pairs(ids, args.neighbours,
+                    args.exploration))):
+            random.seed(0)
+            reached = simulate(ids, true, pairs, args.targets,
+                size * args.max_votes_per_candidate, checkpoint)
+            print '%10d %10s %s' % (size, name, ' '.join('%12s' %
+                (reached[target] or '-') for target in args.targets))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
+import re
 from copy import copy
 
+from django.db import connection
 from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from notorhot._tests.factories import mixer
 
 # courtesy of http://tech.novapost.fr/django-unit-test-your-views-en.html
@@ -14,6 +17,29 @@ def setup_view(view, request, *args, **kwargs):
     return view
     
 
+class QueryCountMixin(object):
+    """
+    Counts SQL statements issued, ignoring transaction control statements 
+    (``BEGIN``, ``SAVEPOINT`` etc.), which vary with how deeply the code under
+    test is nested in transactions -- e.g. inside a test case's own.
+    """
+    TRANSACTION_STATEMENTS = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 
+        'ROLLBACK', 'COMMIT')
+    
+    def assertNumDataQueries(self, num, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+            
+        # Some backends log statements as "QUERY = u'...' - PARAMS = (...)"
+        queries = [re.sub(r"^QUERY = u?'", '', query['sql']) 
+            for query in context.captured_queries]
+        queries = [query for query in queries 
+            if not query.upper().startswith(self.TRANSACTION_STATEMENTS)]
+        self.assertEqual(len(queries), num, u"%d queries executed, %d "
+            u"expected:\n%s" % (len(queries), num, u"\n".join(queries)))
+        return result
+        
+
 class ViewTestMixin(object):
     view_class = None
     
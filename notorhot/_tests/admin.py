@@ -0,0 +1,155 @@
+import datetime
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from mock import Mock, patch
+
+from notorhot._tests.factories import mixer
+from notorhot.admin import CompetitionAdmin, EstimatedCountPaginator, \
+    VoteDateListFilter, estimate_count, CategoryAdmin, CandidateAdmin
+from notorhot.models import Competition, DailyVoteCount, Candidate, \
+    CandidateCategory
+
+
+class CompetitionAdminTestCase(TestCase):
+    def setUp(self):
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = [mixer.blend('notorhot.Candidate', category=self.cat, 
+            name=name) for name in ('Apple', 'Apricot', 'Banana')]
+        self.comps = [Competition.objects.generate_from_candidates(left, right)
+            for (left, right) in [(self.cands[0], self.cands[2]), 
+                (self.cands[2], self.cands[1]), (self.cands[1], self.cands[0])]]
+        self.model_admin = CompetitionAdmin(Competition, admin.site)
+        self.request = RequestFactory().get('/')
+        self.request.user = User.objects.create_superuser('admin', 
+            'admin@example.com', 'password')
+        
+    def test_estimate_count(self):
+        # SQLite keeps no row estimates, so counts are exact
+        self.assertEqual(estimate_count(Competition.objects.all()), 3)
+        self.assertEqual(estimate_count(Competition.objects.filter(
+            left=self.cands[0])), 1)
+        self.assertEqual(EstimatedCountPaginator(Competition.objects.all(), 
+            2).num_pages, 2)
+            
+    def test_search(self):
+        (queryset, use_distinct) = self.model_admin.get_search_results(
+            self.request, Competition.objects.all(), u' Ap ')
+        self.assertFalse(use_distinct)
+        self.assertEqual(set(queryset), set(self.comps))
+        
+        (queryset, use_distinct) = self.model_admin.get_search_results(
+            self.request, Competition.objects.all(), u'Apr')
+        self.assertEqual(set(queryset), set(self.comps[1:]))
+        
+        # prefixes only
+        (queryset, use_distinct) = self.model_admin.get_search_results(
+            self.request, Competition.objects.all(), u'nana')
+        self.assertFalse(queryset.exists())
+        
+    def get_filter(self, value):
+        params = { 'voted': value, } if value else {}
+        return VoteDateListFilter(self.request, params, Competition, 
+            self.model_admin)
+        
+    def test_vote_date_filter(self):
+        for (day, votes) in ((datetime.date(2013, 12, 31), 1), 
+                (datetime.date(2014, 2, 3), 2), (datetime.date(2014, 2, 9), 3),
+                (datetime.date(2014, 5, 1), 4)):
+            DailyVoteCount.objects.create(day=day, category=self.cat, 
+                votes=votes)
+                
+        lookups = lambda value: [key for (key, label) in 
+            self.get_filter(value).lookups(self.request, self.model_admin)]
+        self.assertEqual(lookups(None), ['2013', '2014'])
+        self.assertEqual(lookups('2014'), ['2014', '2014-02', '2014-05'])
+        self.assertEqual(lookups('2014-02'), ['2014', '2014-02', 
+            '2014-02-03', '2014-02-09'])
+        self.assertEqual(lookups('2014-02-09'), lookups('2014-02'))
+        self.assertEqual(lookups('bogus'), lookups(None))
+        self.assertEqual(self.get_filter(None).lookups(self.request, 
+            self.model_admin), [('2013', u'2013 (1)'), ('2014', u'2014 (9)')])
+            
+        (start, end) = DailyVoteCount.objects.get_day_bounds(
+            datetime.date(2014, 2, 9))
+        Competition.objects.filter(pk=self.comps[0].pk).update(
+            date_voted=start + datetime.timedelta(hours=12))
+        Competition.objects.filter(pk=self.comps[1].pk).update(date_voted=end)
+        for (value, expected) in (('2014', 2), ('2014-02', 2), 
+                ('2014-02-09', 1), ('2014-02-10', 1), ('2014-13', 3)):
+            self.assertEqual(self.get_filter(value).queryset(self.request, 
+                Competition.objects.all()).count(), expected)
+                
+    def test_changelist(self):
+        request = RequestFactory().get('/', { 'q': 'Ban', })
+        request.user = self.request.user
+        
+        # matching candidates, date choices, count, total, results (with 
+        # candidates, winner and category joined), category choices
+        with self.assertNumQueries(6):
+            response = self.model_admin.changelist_view(request)
+            response.render()
+        self.assertEqual(response.context_data['cl'].result_count, 2)
+        self.assertEqual(response.context_data['cl'].full_result_count, 3)
+
+            
+class CategoryAdminTestCase(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.user = User.objects.create_superuser('admin', 
+            'admin@example.com', 'password')
+        self.model_admin = CategoryAdmin(CandidateCategory, admin.site)
+        
+    def test_changelist(self):
+        cats = mixer.cycle(3).blend('notorhot.CandidateCategory')
+        for cat in cats:
+            mixer.cycle(2).blend('notorhot.Candidate', category=cat)
+        comp = Competition.objects.generate_from_candidates(
+            *Candidate.objects.filter(category=cats[0]))
+        comp.record_vote(Competition.SIDES.LEFT)
+        
+        # count, results with their counts
+        with self.assertNumQueries(2):
+            response = self.model_admin.changelist_view(self.request)
+            response.render()
+        self.assertContains(response, 
+            u'<a href="/admin/notorhot/candidate/?category__id__exact=%d">2'
+            u'</a>' % cats[0].pk)
+            
+    def test_change_form(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        mixer.cycle(20).blend('notorhot.Candidate', category=cat)
+        response = self.model_admin.change_view(self.request, str(cat.pk))
+        response.render()
+        self.assertContains(response, 
+            u'/admin/notorhot/candidate/add/?category=%d' % cat.pk)
+        self.assertNotContains(response, 'candidates-0-name')
+        
+        
+class CandidateAdminTestCase(TestCase):
+    def test_thumbnail(self):
+        model_admin = CandidateAdmin(Candidate, admin.site)
+        cand = mixer.blend('notorhot.Candidate', pic='candidates/pic.jpg')
+        
+        with patch('notorhot.admin.get_cached_thumbnail', 
+                return_value=None) as mock_get:
+            self.assertEqual(model_admin.thumbnail(cand), u'candidates/pic.jpg')
+        mock_get.assert_called_once_with(cand.pic, '60x60', crop='center')
+        
+        thumb = Mock(url='/media/cache/ab/cd.jpg', width=60, height=40)
+        with patch('notorhot.admin.get_cached_thumbnail', return_value=thumb):
+            self.assertEqual(model_admin.thumbnail(cand), u'<img '
+                u'src="/media/cache/ab/cd.jpg" width="60" height="40" alt="" />')
+                
+        cand.pic = ''
+        self.assertEqual(model_admin.thumbnail(cand), u'')
+        
+    def test_uncached_thumbnail(self):
+        # nothing is generated for a missing source file
+        cand = mixer.blend('notorhot.Candidate', pic='candidates/missing.jpg')
+        self.assertEqual(CandidateAdmin(Candidate, admin.site).thumbnail(cand),
+            u'candidates/missing.jpg')
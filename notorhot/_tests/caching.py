@@ -0,0 +1,315 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mock import patch
+
+import time
+
+from notorhot._tests.factories import mixer
+from notorhot.caching import CandidateIndex, LeaderboardCache, \
+    get_notorhot_cache, get_instance_cache, get_related_instance
+from notorhot.models import Competition, Candidate, CandidateCategory
+
+
+class CandidateIndexTestCase(TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        
+    def test_unbuilt(self):
+        index = CandidateIndex(1)
+        self.assertIsNone(index.sample(2))
+        
+    def test_build_and_sample(self):
+        index = CandidateIndex(1)
+        self.assertEqual(index.build(iter([])), 0)
+        self.assertEqual(index.sample(2), [])
+        
+        self.assertEqual(index.build(iter([7])), 1)
+        self.assertEqual(index.sample(2), [7])
+        
+        ids = range(100, 2600)
+        self.assertEqual(index.build(iter(ids)), 2500)
+        for i in range(50):
+            sample = index.sample(2)
+            self.assertEqual(len(sample), 2)
+            self.assertNotEqual(sample[0], sample[1])
+            self.assertIn(sample[0], ids)
+            self.assertIn(sample[1], ids)
+            
+    def test_sample_while_building(self):
+        index = CandidateIndex(1)
+        self.assertEqual(index.build_and_sample(iter([]), 2), [])
+        self.assertEqual(index.build_and_sample(iter([7]), 2), [7])
+        
+        seen = set()
+        for i in range(200):
+            sample = index.build_and_sample(iter(range(10)), 2)
+            self.assertEqual(len(set(sample)), 2)
+            seen.update(sample)
+        self.assertEqual(seen, set(range(10)))
+        # the index is stored as well
+        self.assertEqual(len(index.sample(2)), 2)
+        
+    def test_buckets_cover_all_ids(self):
+        index = CandidateIndex(1)
+        index.bucket_size = 3
+        index.build(range(10))
+        
+        seen = set()
+        for i in range(200):
+            seen.update(index.sample(2))
+        self.assertEqual(seen, set(range(10)))
+        
+    def test_categories_are_separate(self):
+        index1 = CandidateIndex(1)
+        index2 = CandidateIndex(2)
+        index1.build([1, 2])
+        self.assertIsNone(index2.sample(2))
+        
+        index2.build([3, 4])
+        self.assertEqual(set(index1.sample(2)), set([1, 2]))
+        self.assertEqual(set(index2.sample(2)), set([3, 4]))
+        
+    def test_invalidate(self):
+        index = CandidateIndex(1)
+        index.build([1, 2, 3])
+        index.invalidate()
+        self.assertIsNone(index.sample(2))
+        
+    def test_evicted_bucket(self):
+        index = CandidateIndex(1)
+        index.bucket_size = 2
+        index.build([1, 2, 3, 4])
+        (token, count) = index.cache.get(index.pointer_key)
+        index.cache.delete(index.get_bucket_key(token, 1))
+        
+        # sampling every position must hit the missing bucket
+        self.assertIsNone(index.sample(4))
+        
+
+@override_settings(NOTORHOT_SETTINGS={ 'LEADERBOARD_CACHE_TIMEOUT': 60, 
+    'LEADERBOARD_MIN_REFRESH': 0, })
+class LeaderboardCacheTestCase(TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.computed = 0
+        
+    def compute(self):
+        self.computed += 1
+        return ['leaders', self.computed]
+        
+    def test_disabled(self):
+        with override_settings(NOTORHOT_SETTINGS={}):
+            cache = LeaderboardCache(1)
+            self.assertIsNone(cache.bump())
+            self.assertIsNone(cache.get_version())
+            cache.get('wins', self.compute)
+            cache.get('wins', self.compute)
+        self.assertEqual(self.computed, 2)
+        
+    def test_get_and_bump(self):
+        cache = LeaderboardCache(1)
+        self.assertEqual(cache.get('wins', self.compute), ['leaders', 1])
+        self.assertEqual(cache.get('wins', self.compute), ['leaders', 1])
+        # variants and categories are cached separately
+        self.assertEqual(cache.get('rating', self.compute), ['leaders', 2])
+        self.assertEqual(LeaderboardCache(2).get('wins', self.compute), 
+            ['leaders', 3])
+        
+        cache.bump()
+        self.assertEqual(cache.get('wins', self.compute), ['leaders', 4])
+        self.assertEqual(LeaderboardCache(2).get('wins', self.compute), 
+            ['leaders', 3])
+        
+    def test_min_refresh(self):
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'LEADERBOARD_CACHE_TIMEOUT': 60, 
+                'LEADERBOARD_MIN_REFRESH': 10, }):
+            cache = LeaderboardCache(1)
+        
+        with patch('notorhot.caching.time.time', return_value=1000.0):
+            cache.get('wins', self.compute)
+            for i in range(5):
+                cache.bump()
+                self.assertEqual(cache.get('wins', self.compute), 
+                    ['leaders', 1])
+        
+        with patch('notorhot.caching.time.time', return_value=1010.0):
+            self.assertEqual(cache.get('wins', self.compute), ['leaders', 2])
+            self.assertEqual(cache.get('wins', self.compute), ['leaders', 2])
+            
+    def test_locked(self):
+        cache = LeaderboardCache(1)
+        cache.get('wins', self.compute)
+        cache.bump()
+        
+        # while another worker holds the lock, the stale entry is served
+        cache.cache.add(cache.get_lock_key('wins'), True)
+        self.assertEqual(cache.get('wins', self.compute), ['leaders', 1])
+        # with nothing to serve, the leaderboard is computed but not stored
+        self.assertEqual(cache.get('rating', self.compute), ['leaders', 2])
+        
+        cache.cache.delete(cache.get_lock_key('wins'))
+        self.assertEqual(cache.get('wins', self.compute), ['leaders', 3])
+        self.assertEqual(cache.get('wins', self.compute), ['leaders', 3])
+        
+    def test_model_changes_bump(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        other_cat = mixer.blend('notorhot.CandidateCategory')
+        (cand1, cand2) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=cat, is_enabled=True)
+        cache = LeaderboardCache(cat.pk)
+        other_cache = LeaderboardCache(other_cat.pk)
+        
+        def assert_bumps(func, caches=(cache,)):
+            versions = [c.get_version() for c in caches]
+            func()
+            for (c, version) in zip(caches, versions):
+                self.assertNotEqual(c.get_version(), version)
+                
+        comp = Competition.objects.generate_from_candidates(cand1, cand2)
+        assert_bumps(lambda: comp.record_vote(Competition.SIDES.LEFT))
+        
+        comp = Competition.objects.generate_from_candidates(cand1, cand2)
+        assert_bumps(lambda: Competition.objects.record_votes_bulk(
+            [(comp.pk, Competition.SIDES.RIGHT)]))
+        
+        cand1.is_enabled = False
+        assert_bumps(cand1.save)
+        
+        cand2.category = other_cat
+        assert_bumps(cand2.save, (cache, other_cache))
+        
+        assert_bumps(cand1.delete)
+
+
+@override_settings(NOTORHOT_SETTINGS={ 'INSTANCE_CACHE_TIMEOUT': 60, })
+class InstanceCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = get_instance_cache(CandidateCategory)
+        self.cat = mixer.blend('notorhot.CandidateCategory', name='Fruit',
+            slug='fruit')
+        # as though saving the category was long ago
+        get_notorhot_cache().clear()
+        self.cache.clear_local()
+        self.cache.reset_stats()
+        
+    def test_disabled(self):
+        with override_settings(NOTORHOT_SETTINGS={}):
+            with self.assertNumQueries(2):
+                self.assertEqual(self.cache.get(self.cat.pk), self.cat)
+                self.assertEqual(self.cache.get_by_slug('fruit'), self.cat)
+        self.assertEqual(self.cache.stats, 
+            { 'local': 0, 'shared': 0, 'misses': 0, })
+        
+    def test_read_through(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get_by_slug('fruit'), self.cat)
+        with self.assertNumQueries(0):
+            cat = self.cache.get_by_slug('fruit')
+            self.assertEqual(self.cache.get(self.cat.pk), self.cat)
+        self.assertEqual((cat.name, cat.is_public), ('Fruit', True))
+        self.assertFalse(cat._state.adding)
+        self.assertEqual(self.cache.stats, 
+            { 'local': 2, 'shared': 0, 'misses': 1, })
+            
+        # other processes are served from the shared cache
+        self.cache.clear_local()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(self.cat.pk), self.cat)
+        self.assertEqual(self.cache.stats['shared'], 1)
+        
+        with self.assertRaises(CandidateCategory.DoesNotExist):
+            self.cache.get_by_slug('vegetables')
+            
+    def test_lru(self):
+        other = mixer.blend('notorhot.CandidateCategory', slug='other')
+        get_notorhot_cache().clear()
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'INSTANCE_CACHE_TIMEOUT': 60, 'INSTANCE_CACHE_SIZE': 2, }):
+            self.cache.get(self.cat.pk)
+            self.cache.get(other.pk)
+        # the category's entries were the least recently used
+        self.assertEqual(len(self.cache.local), 2)
+        self.assertIsNone(self.cache.get_local(
+            self.cache.get_key('pk', self.cat.pk)))
+        self.assertEqual(self.cache.get_local(
+            self.cache.get_key('slug', 'other')), other.pk)
+        
+    def test_local_timeout(self):
+        self.cache.get(self.cat.pk)
+        key = self.cache.get_key('pk', self.cat.pk)
+        with patch('notorhot.caching.time.time', return_value=time.time() + 6):
+            self.assertIsNone(self.cache.get_local(key))
+            
+    def test_invalidation(self):
+        self.cache.get_by_slug('fruit')
+        
+        self.cat.name = 'Vegetables'
+        self.cat.slug = 'vegetables'
+        self.cat.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get(self.cat.pk).name, 'Vegetables')
+        with self.assertRaises(CandidateCategory.DoesNotExist):
+            self.cache.get_by_slug('fruit')
+        
+        cat_pk = self.cat.pk
+        self.cat.delete()
+        with self.assertRaises(CandidateCategory.DoesNotExist):
+            self.cache.get(cat_pk)
+            
+    def test_fill_after_invalidation(self):
+        # a lookup reads the row, then the category is saved...
+        old = CandidateCategory.objects.get(pk=self.cat.pk)
+        self.cat.name = 'Vegetables'
+        self.cat.save()
+        # ...and the lookup's fill must not bring back the old row
+        self.cache.store(old)
+        self.cache.clear_local()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get(self.cat.pk).name, 'Vegetables')
+            
+        # once the invalidation expires, lookups fill the cache again
+        self.cache.cache.delete(self.cache.get_key('pk', self.cat.pk))
+        self.cache.get(self.cat.pk)
+        self.cache.clear_local()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(self.cat.pk).name, 'Vegetables')
+        
+    def test_fill_by_slug_after_invalidation(self):
+        self.cache.get_by_slug('fruit')
+        old = CandidateCategory.objects.get(pk=self.cat.pk)
+        self.cat.name = 'Vegetables'
+        self.cat.save()
+        # the slug's entry is back (say its marker was evicted), but the 
+        # row's marker remains and mustn't be overwritten by the fill
+        self.cache.cache.set(self.cache.get_key('slug', 'fruit'), self.cat.pk)
+        self.cache.clear_local()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get_by_slug('fruit').name, 
+                'Vegetables')
+                
+        # so a lookup that read the row before the save can't restore it
+        self.cache.store(old)
+        self.cache.clear_local()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get(self.cat.pk).name, 'Vegetables')
+            
+    def test_stale_slug(self):
+        self.cache.get_by_slug('fruit')
+        # a slug changed without a signal no longer matches the cached pk
+        self.cache.cache.set(self.cache.get_key('pk', self.cat.pk), 
+            dict(self.cache.get_row(self.cat), slug='renamed'))
+        self.cache.clear_local()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get_by_slug('fruit'), self.cat)
+        
+    def test_related_instance(self):
+        cand = mixer.blend('notorhot.Candidate', category=self.cat)
+        cand = Candidate.objects.get(pk=cand.pk)
+        self.cache.get(self.cat.pk)
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(get_related_instance(cand, 'category'), self.cat)
+            self.assertEqual(cand.category, self.cat)
+            self.assertIn('/fruit/', cand.get_absolute_url())
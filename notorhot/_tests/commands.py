@@ -0,0 +1,371 @@
+import datetime
+import gzip
+import os
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mock import patch
+from unittest import skipIf
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from notorhot._tests.factories import mixer
+from notorhot.models import Candidate, Competition, ArchivedCompetition, \
+    DailyVoteCount, QueuedVote
+
+
+class FillCompetitionPoolsTestCase(TestCase):
+    def setUp(self):
+        self.cat1 = mixer.blend('notorhot.CandidateCategory', slug='cat1')
+        self.cat2 = mixer.blend('notorhot.CandidateCategory', slug='cat2')
+        self.private = mixer.blend('notorhot.CandidateCategory', 
+            is_public=False)
+        for cat in (self.cat1, self.cat2, self.private):
+            mixer.cycle(3).blend('notorhot.Candidate', category=cat)
+    
+    def test_fill_all(self):
+        call_command('fill_competition_pools', depth=4)
+        
+        pool = Competition.objects.pooled()
+        self.assertEqual(pool.filter(category=self.cat1).count(), 4)
+        self.assertEqual(pool.filter(category=self.cat2).count(), 4)
+        self.assertEqual(pool.filter(category=self.private).count(), 0)
+        
+    def test_fill_selected(self):
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'COMPETITION_POOL_DEPTH': 2, }):
+            call_command('fill_competition_pools', 'cat2')
+            
+        pool = Competition.objects.pooled()
+        self.assertEqual(pool.filter(category=self.cat1).count(), 0)
+        self.assertEqual(pool.filter(category=self.cat2).count(), 2)
+        
+    def test_no_depth(self):
+        with self.assertRaises(CommandError):
+            call_command('fill_competition_pools')
+
+
+class ReplayVotesTestCase(TestCase):
+    def setUp(self):
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=self.cat, votes=0, wins=0)
+        self.comps = mixer.cycle(2).blend('notorhot.Competition', 
+            left=self.cands[0], right=self.cands[1], category=self.cat)
+            
+    def write_votes(self, content):
+        (handle, filename) = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as vote_file:
+            vote_file.write(content)
+        self.addCleanup(os.remove, filename)
+        return filename
+    
+    def test_replay(self):
+        filename = self.write_votes(u"%d,1,2014-03-01T12:30:00\n%d,2\n%d,2\n" % (
+            self.comps[0].pk, self.comps[1].pk, self.comps[0].pk))
+        out = StringIO()
+        call_command('replay_votes', filename, batch_size=2, stdout=out)
+        
+        self.assertEqual(out.getvalue().strip(), u"already_voted: 1, ok: 2")
+        comp = Competition.objects.get(pk=self.comps[0].pk)
+        self.assertEqual(comp.winner, self.cands[0])
+        self.assertEqual((comp.date_voted.year, comp.date_voted.month), 
+            (2014, 3))
+        self.assertEqual(Candidate.objects.get(pk=self.cands[1].pk).wins, 1)
+        
+    def test_invalid(self):
+        filename = self.write_votes(u"%d,left\n" % self.comps[0].pk)
+        with self.assertRaises(CommandError):
+            call_command('replay_votes', filename)
+        with self.assertRaises(CommandError):
+            call_command('replay_votes')
+
+
+class RebuildRatingsTestCase(TestCase):
+    def test_rebuild(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat')
+        other = mixer.blend('notorhot.CandidateCategory', slug='other')
+        cands = mixer.cycle(3).blend('notorhot.Candidate', category=cat)
+        bystander = mixer.blend('notorhot.Candidate', category=other, 
+            rating=1234)
+            
+        pairs = [(cands[0], cands[1]), (cands[1], cands[2]), 
+            (cands[0], cands[2]), (cands[2], cands[0]), (cands[0], cands[1])]
+        for (left, right) in pairs:
+            Competition.objects.generate_from_candidates(left, right
+                ).record_vote(Competition.SIDES.LEFT)
+        expected = dict((cand.pk, Candidate.objects.get(pk=cand.pk).rating)
+            for cand in cands)
+            
+        Candidate.objects.filter(category=cat).update(rating=1000)
+        call_command('rebuild_ratings', 'cat', chunk_size=2)
+        
+        for cand in cands:
+            self.assertAlmostEqual(Candidate.objects.get(pk=cand.pk).rating, 
+                expected[cand.pk])
+        self.assertEqual(Candidate.objects.get(pk=bystander.pk).rating, 1234)
+        
+    def test_archived_votes(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat')
+        cands = mixer.cycle(3).blend('notorhot.Candidate', category=cat)
+        pairs = [(cands[0], cands[1]), (cands[1], cands[2]), 
+            (cands[0], cands[2]), (cands[2], cands[0]), (cands[0], cands[1])]
+        comps = [Competition.objects.generate_from_candidates(left, right)
+            for (left, right) in pairs]
+        for comp in comps:
+            comp.record_vote(Competition.SIDES.LEFT)
+        expected = dict((cand.pk, Candidate.objects.get(pk=cand.pk).rating)
+            for cand in cands)
+            
+        # the first two votes move to the archive
+        start = timezone.now() - datetime.timedelta(days=1)
+        for (i, comp) in enumerate(comps):
+            Competition.objects.filter(pk=comp.pk).update(
+                date_voted=start + datetime.timedelta(minutes=i))
+        Competition.objects.archive_voted_batch(start + 
+            datetime.timedelta(seconds=90))
+        self.assertEqual(ArchivedCompetition.objects.count(), 2)
+        
+        Candidate.objects.filter(category=cat).update(rating=1000)
+        call_command('rebuild_ratings', 'cat', chunk_size=2)
+        
+        for cand in cands:
+            self.assertAlmostEqual(Candidate.objects.get(pk=cand.pk).rating, 
+                expected[cand.pk])
+
+
+@skipIf(numpy is None, "NumPy is not installed")
+class FitStrengthsCommandTestCase(TestCase):
+    def test_fit(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat')
+        other = mixer.blend('notorhot.CandidateCategory', slug='other')
+        cands = mixer.cycle(3).blend('notorhot.Candidate', category=cat)
+        bystanders = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=other)
+            
+        for (left, right) in ((cands[0], cands[1]), (cands[1], cands[2]),
+                (cands[0], cands[2])):
+            Competition.objects.generate_from_candidates(left, right
+                ).record_vote(Competition.SIDES.LEFT)
+        Competition.objects.generate_from_candidates(*bystanders
+            ).record_vote(Competition.SIDES.LEFT)
+                
+        stdout = StringIO()
+        call_command('fit_strengths', 'cat', chunk_size=2, verbosity=2, 
+            stdout=stdout)
+        
+        self.assertIn(u"fitted 3 candidates to 3 votes", stdout.getvalue())
+        strengths = [Candidate.objects.get(pk=cand.pk).strength 
+            for cand in cands]
+        self.assertEqual(strengths, sorted(strengths, reverse=True))
+        self.assertNotEqual(strengths[0], 0.0)
+        self.assertEqual([Candidate.objects.get(pk=cand.pk).strength 
+            for cand in bystanders], [0.0, 0.0])
+
+
+class PurgeCompetitionsTestCase(TestCase):
+    def setUp(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        (cand1, cand2) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=cat)
+        comps = [Competition.objects.generate_from_candidates(cand1, cand2)
+            for i in range(6)]
+        for comp in comps[4:]:
+            comp.record_vote(Competition.SIDES.LEFT)
+        Competition.objects.filter(pk__in=[comp.pk for comp in comps[1:]]
+            ).update(date_presented=timezone.now() - datetime.timedelta(
+            days=3), date_voted=None)
+        Competition.objects.filter(pk__in=[comp.pk for comp in comps[4:]]
+            ).update(date_voted=timezone.now() - datetime.timedelta(days=2))
+        self.comps = comps
+            
+    def test_purge(self):
+        stdout = StringIO()
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'COMPETITION_TTL': 60 * 60 * 24, 
+                'COMPETITION_ARCHIVE_AFTER': 60 * 60, }):
+            call_command('purge_competitions', batch_size=2, stdout=stdout)
+            
+        self.assertEqual(list(Competition.objects.values_list('pk', 
+            flat=True)), [self.comps[0].pk])
+        self.assertEqual(set(ArchivedCompetition.objects.values_list('pk', 
+            flat=True)), set([self.comps[4].pk, self.comps[5].pk]))
+        self.assertIn(u"Deleted 3 expired", stdout.getvalue())
+        self.assertIn(u"Archived 2 voted", stdout.getvalue())
+        
+    def test_archive_not_before_tokens_expire(self):
+        Competition.objects.filter(date_voted__isnull=False).update(
+            date_voted=timezone.now() - datetime.timedelta(hours=2))
+        call_command('purge_competitions', archive_after=60, 
+            stdout=StringIO())
+        self.assertEqual(Competition.objects.count(), 6)
+        self.assertFalse(ArchivedCompetition.objects.exists())
+        
+    def test_nothing_to_do(self):
+        with self.assertRaises(CommandError):
+            call_command('purge_competitions')
+
+
+class RefreshVoteCountsTestCase(TestCase):
+    def test_refresh(self):
+        cats = mixer.cycle(2).blend('notorhot.CandidateCategory')
+        comps = []
+        for cat in cats:
+            (cand1, cand2) = mixer.cycle(2).blend('notorhot.Candidate', 
+                category=cat)
+            comps.extend(Competition.objects.generate_from_candidates(cand1, 
+                cand2) for i in range(3))
+        for comp in comps[:5]:
+            comp.record_vote(Competition.SIDES.LEFT)
+            
+        today = timezone.localtime(timezone.now()).date()
+        earlier = today - datetime.timedelta(days=2)
+        Competition.objects.filter(pk__in=(comps[0].pk, comps[3].pk)).update(
+            date_voted=DailyVoteCount.objects.get_day_bounds(earlier)[0] + 
+            datetime.timedelta(hours=12))
+        # archived votes still count
+        Competition.objects.archive_voted_batch(
+            DailyVoteCount.objects.get_day_bounds(today)[0])
+        self.assertEqual(ArchivedCompetition.objects.count(), 2)
+            
+        call_command('refresh_vote_counts')
+        counts = dict(((count.day, count.category_id), count.votes) 
+            for count in DailyVoteCount.objects.all())
+        self.assertEqual(counts, {
+            (earlier, cats[0].pk): 1,
+            (earlier, cats[1].pk): 1,
+            (today, cats[0].pk): 2,
+            (today, cats[1].pk): 1,
+        })
+        
+        # later runs recount from the last day counted
+        comps[5].record_vote(Competition.SIDES.RIGHT)
+        DailyVoteCount.objects.filter(day=earlier).delete()
+        call_command('refresh_vote_counts')
+        self.assertEqual(DailyVoteCount.objects.get(day=today, 
+            category=cats[1]).votes, 2)
+        self.assertFalse(DailyVoteCount.objects.filter(day=earlier).exists())
+        
+        call_command('refresh_vote_counts', since=str(earlier))
+        self.assertEqual(DailyVoteCount.objects.filter(day=earlier).count(), 2)
+
+
+class PrewarmThumbnailsTestCase(TestCase):
+    def setUp(self):
+        self.cands = [mixer.blend('notorhot.Candidate', 
+            pic='candidates/%d.jpg' % i) for i in range(5)]
+        mixer.blend('notorhot.Candidate', pic='')
+        
+    def call(self, **options):
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command('prewarm_thumbnails', processes=1, stdout=stdout, 
+            stderr=stderr, **options)
+        return (stdout.getvalue(), stderr.getvalue())
+    
+    @patch('notorhot.management.commands.prewarm_thumbnails.'
+        'generate_thumbnails')
+    def test_prewarm(self, mock_generate):
+        (stdout, stderr) = self.call(chunk_size=2)
+        
+        self.assertEqual([call[0][0].name for call in 
+            mock_generate.call_args_list], 
+            ['candidates/%d.jpg' % i for i in range(5)])
+        self.assertIn(u"... 2 of up to 5", stdout)
+        self.assertIn(u"... 4 of up to 5", stdout)
+        self.assertIn(u"Generated thumbnails for 5 candidates (0 failed)", 
+            stdout)
+        self.assertEqual(stderr, u'')
+        
+    @patch('notorhot.management.commands.prewarm_thumbnails.'
+        'generate_thumbnails')
+    def test_errors(self, mock_generate):
+        mock_generate.side_effect = [3, IOError('broken'), 3, 3, 3]
+        (stdout, stderr) = self.call()
+        
+        self.assertIn(u"Candidate %s: broken" % self.cands[1].pk, stderr)
+        self.assertIn(u"Generated thumbnails for 4 candidates (1 failed)", 
+            stdout)
+    
+    @patch('notorhot.management.commands.prewarm_thumbnails.has_thumbnails')
+    @patch('notorhot.management.commands.prewarm_thumbnails.'
+        'generate_thumbnails')
+    def test_resume(self, mock_generate, mock_has):
+        mock_has.side_effect = lambda image: image.name in (
+            'candidates/0.jpg', 'candidates/1.jpg')
+        (stdout, stderr) = self.call(resume=True)
+        
+        self.assertEqual([call[0][0].name for call in 
+            mock_generate.call_args_list], 
+            ['candidates/2.jpg', 'candidates/3.jpg', 'candidates/4.jpg'])
+        self.assertIn(u"Generated thumbnails for 3 candidates", stdout)
+        
+    def test_bad_options(self):
+        with self.assertRaises(CommandError):
+            self.call(chunk_size=0)
+
+
+class ExportCommandTestCase(TestCase):
+    def setUp(self):
+        self.cat = mixer.blend('notorhot.CandidateCategory', slug='cat')
+        (a, b) = mixer.cycle(2).blend('notorhot.Candidate', category=self.cat)
+        self.comp = Competition.objects.generate_from_candidates(a, b)
+        self.comp.record_vote(Competition.SIDES.RIGHT)
+        
+    def test_stdout(self):
+        stdout = StringIO()
+        call_command('export_notorhot', 'competitions', format='jsonl', 
+            categories=['cat'], stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn('"id": %d' % self.comp.pk, lines[0])
+        
+    def test_file(self):
+        (handle, filename) = tempfile.mkstemp(suffix='.csv.gz')
+        os.close(handle)
+        try:
+            call_command('export_notorhot', 'candidates', gzip=True, 
+                output=filename, chunk_size=1)
+            with gzip.open(filename) as export:
+                lines = export.read().splitlines()
+        finally:
+            os.remove(filename)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('id,category_id,name'))
+        
+    def test_bad_arguments(self):
+        for (args, options) in ((('votes',), {}), 
+                (('competitions',), { 'since': '2014-13-01', }), 
+                (('competitions',), { 'categories': ['nope'], })):
+            with self.assertRaises(CommandError):
+                call_command('export_notorhot', *args, **options)
+                
+                
+class DrainVoteQueueTestCase(TestCase):
+    def test_drain(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        (cand1, cand2) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=cat)
+        comps = [Competition.objects.generate_from_candidates(cand1, cand2)
+            for i in range(3)]
+        for comp in comps:
+            QueuedVote.objects.enqueue(comp, Competition.SIDES.LEFT)
+        QueuedVote.objects.enqueue(comps[0], Competition.SIDES.RIGHT)
+        
+        stdout = StringIO()
+        call_command('drain_vote_queue', batch_size=2, stdout=stdout)
+        
+        self.assertEqual(QueuedVote.objects.count(), 0)
+        self.assertEqual(Competition.votable.count(), 0)
+        self.assertEqual(Candidate.objects.get(pk=cand1.pk).wins, 3)
+        self.assertIn(u"Processed 4 queued votes; already_voted: 1; ok: 3", 
+            stdout.getvalue())
@@ -0,0 +1,222 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mock import patch
+
+from notorhot._tests.factories import mixer
+from notorhot.caching import get_notorhot_cache
+from notorhot.counters import CacheCounterBuffer, LocalCounterBuffer, \
+    ShardedCounterBuffer
+from notorhot.models import Candidate, CandidateCounterShard, Competition
+
+
+class CounterBufferTestMixin(object):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(3).blend('notorhot.Candidate',
+            category=self.cat, is_enabled=True, challenges=0, votes=0, wins=0)
+
+    def get_counts(self, cand):
+        cand = Candidate.objects.get(pk=cand.pk)
+        return (cand.challenges, cand.votes, cand.wins)
+
+    def test_add_and_flush(self):
+        buffer = self.get_buffer()
+        buffer.add(self.cands[0].pk, challenges=1)
+        buffer.add(self.cands[0].pk, votes=1, wins=1)
+        buffer.add_many({
+            self.cands[0].pk: { 'challenges': 2, },
+            self.cands[1].pk: { 'votes': 1, },
+        })
+
+        self.assertEqual(buffer.get_pending([self.cands[0].pk,
+            self.cands[1].pk, self.cands[2].pk]), {
+                self.cands[0].pk: { 'challenges': 3, 'votes': 1, 'wins': 1, },
+                self.cands[1].pk: { 'votes': 1, },
+            })
+        self.assertEqual(self.get_counts(self.cands[0]), (0, 0, 0))
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.get_counts(self.cands[0]), (3, 1, 1))
+        self.assertEqual(self.get_counts(self.cands[1]), (0, 1, 0))
+        self.assertEqual(self.get_counts(self.cands[2]), (0, 0, 0))
+        self.assertEqual(buffer.get_pending([self.cands[0].pk]), {})
+
+        # nothing left to write
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(self.get_counts(self.cands[0]), (3, 1, 1))
+
+        # candidates are tracked again after a flush
+        buffer.add(self.cands[0].pk, votes=1)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.get_counts(self.cands[0]), (3, 2, 1))
+
+    def test_apply_pending(self):
+        buffer = self.get_buffer()
+        cand = Candidate.objects.get(pk=self.cands[0].pk)
+        buffer.add(cand.pk, votes=4, wins=1)
+
+        self.assertEqual(cand.win_percentage, 'No votes')
+        (applied,) = buffer.apply_pending([cand,])
+        self.assertEqual((applied.votes, applied.wins), (4, 1))
+        self.assertEqual(applied.win_percentage, 25.0)
+
+
+class LocalCounterBufferTestCase(CounterBufferTestMixin, TestCase):
+    def get_buffer(self):
+        with override_settings(NOTORHOT_SETTINGS={
+                'COUNTER_FLUSH_INTERVAL': 0, }):
+            return LocalCounterBuffer()
+
+
+class CacheCounterBufferTestCase(CounterBufferTestMixin, TestCase):
+    def get_buffer(self):
+        return CacheCounterBuffer()
+
+    def test_shared(self):
+        CacheCounterBuffer().add(self.cands[0].pk, votes=2)
+        self.assertEqual(CacheCounterBuffer().get_pending([self.cands[0].pk]),
+            { self.cands[0].pk: { 'votes': 2, }, })
+
+        CacheCounterBuffer().flush()
+        self.assertEqual(self.get_counts(self.cands[0]), (0, 2, 0))
+
+    def test_unwritten_slot(self):
+        buffer = self.get_buffer()
+        buffer.add(self.cands[0].pk, votes=1)
+        # a slot number taken by an add() that hasn't yet stored its ID
+        buffer.incr(buffer.slot_count_key, 1, None)
+        buffer.add(self.cands[1].pk, votes=1)
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.get_counts(self.cands[1]), (0, 1, 0))
+
+        # the late ID is picked up by the next flush
+        buffer.cache.set(buffer.get_slot_key(2), self.cands[2].pk)
+        buffer.incr(buffer.get_counter_key(self.cands[2].pk, 'votes'), 1,
+            None)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.get_counts(self.cands[2]), (0, 1, 0))
+
+    def test_failed_flush(self):
+        buffer = self.get_buffer()
+        buffer.add(self.cands[0].pk, votes=1, wins=1)
+        buffer.add(self.cands[1].pk, votes=2)
+        
+        with patch('notorhot.counters.write_counter_deltas', 
+                side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, buffer.flush)
+        # everything taken out is put back, and the lock released
+        self.assertEqual(buffer.get_pending([self.cands[0].pk, 
+            self.cands[1].pk]), {
+                self.cands[0].pk: { 'votes': 1, 'wins': 1, },
+                self.cands[1].pk: { 'votes': 2, },
+            })
+        self.assertIsNone(buffer.cache.get(buffer.lock_key))
+        
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.get_counts(self.cands[0]), (0, 1, 1))
+        self.assertEqual(self.get_counts(self.cands[1]), (0, 2, 0))
+        
+    def test_evicted_counter(self):
+        buffer = self.get_buffer()
+        buffer.add(self.cands[0].pk, votes=1)
+        buffer.add(self.cands[1].pk, votes=1)
+        
+        get_pending = buffer.get_pending
+        def evicting_get_pending(candidate_ids):
+            pending = get_pending(candidate_ids)
+            buffer.cache.delete(buffer.get_counter_key(self.cands[0].pk, 
+                'votes'))
+            return pending
+            
+        with patch.object(buffer, 'get_pending', evicting_get_pending):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.get_counts(self.cands[0]), (0, 1, 0))
+        self.assertEqual(self.get_counts(self.cands[1]), (0, 1, 0))
+        
+    def test_lock_timeout(self):
+        buffer = self.get_buffer()
+        buffer.add(self.cands[0].pk, votes=1)
+        with patch.object(buffer.cache, 'add', 
+                wraps=buffer.cache.add) as add:
+            buffer.flush()
+        add.assert_any_call(buffer.lock_key, 1, buffer.lock_timeout)
+        self.assertTrue(buffer.lock_timeout < buffer.timeout)
+
+    def test_buffered_models(self):
+        with override_settings(NOTORHOT_SETTINGS={ 'COUNTER_BUFFER': 'cache', }):
+            comp = Competition.objects.generate_from_candidates(self.cands[0],
+                self.cands[1])
+            comp.record_vote(Competition.SIDES.RIGHT)
+            self.cands[2].increment_challenges()
+
+            self.assertEqual(self.get_counts(self.cands[0]), (0, 0, 0))
+            self.assertEqual((self.cands[1].challenges, self.cands[1].votes,
+                self.cands[1].wins), (1, 1, 1))
+
+            call_command('flush_candidate_counters')
+
+        self.assertEqual(self.get_counts(self.cands[0]), (1, 1, 0))
+        self.assertEqual(self.get_counts(self.cands[1]), (1, 1, 1))
+        self.assertEqual(self.get_counts(self.cands[2]), (1, 0, 0))
+
+    def test_command_requires_cache_buffer(self):
+        with self.assertRaises(CommandError):
+            call_command('flush_candidate_counters')
+
+
+class ShardedCounterBufferTestCase(CounterBufferTestMixin, TestCase):
+    def get_buffer(self):
+        with override_settings(NOTORHOT_SETTINGS={ 'COUNTER_SHARDS': 4, 
+                'COUNTER_SHARD_CACHE_TIMEOUT': 0, }):
+            return ShardedCounterBuffer()
+            
+    def test_shards(self):
+        buffer = self.get_buffer()
+        for i in range(40):
+            buffer.add(self.cands[0].pk, votes=1, wins=i % 2)
+            
+        shards = CandidateCounterShard.objects.filter(candidate=self.cands[0])
+        self.assertGreater(shards.count(), 1)
+        self.assertLessEqual(shards.count(), 4)
+        self.assertEqual(buffer.get_pending([self.cands[0].pk]), 
+            { self.cands[0].pk: { 'votes': 40, 'wins': 20, }, })
+            
+        buffer.flush()
+        self.assertEqual(self.get_counts(self.cands[0]), (0, 40, 20))
+        self.assertFalse(CandidateCounterShard.objects.exists())
+        
+    def test_cached_totals(self):
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'COUNTER_SHARD_CACHE_TIMEOUT': 60, }):
+            buffer = ShardedCounterBuffer()
+        buffer.add(self.cands[0].pk, votes=1)
+        
+        self.assertEqual(buffer.get_pending([self.cands[0].pk]), 
+            { self.cands[0].pk: { 'votes': 1, }, })
+        buffer.add(self.cands[0].pk, votes=1)
+        with self.assertNumQueries(0):
+            self.assertEqual(buffer.get_pending([self.cands[0].pk]), 
+                { self.cands[0].pk: { 'votes': 1, }, })
+                
+        # compaction discards the cached totals
+        buffer.flush()
+        self.assertEqual(buffer.get_pending([self.cands[0].pk]), {})
+        self.assertEqual(self.get_counts(self.cands[0]), (0, 2, 0))
+        
+    def test_buffered_models(self):
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'COUNTER_BUFFER': 'shards', }):
+            comp = Competition.objects.generate_from_candidates(self.cands[0],
+                self.cands[1])
+            comp.record_vote(Competition.SIDES.LEFT)
+            self.assertEqual(self.get_counts(self.cands[0]), (0, 0, 0))
+            
+            call_command('flush_candidate_counters')
+            
+        self.assertEqual(self.get_counts(self.cands[0]), (1, 1, 1))
+        self.assertEqual(self.get_counts(self.cands[1]), (1, 1, 0))
@@ -0,0 +1,98 @@
+import csv
+import datetime
+import gzip
+import json
+from StringIO import StringIO
+
+from django.test import TestCase
+from django.utils import timezone
+
+from notorhot._tests.factories import mixer
+from notorhot._tests._utils import QueryCountMixin
+from notorhot.export import COMPETITION_FIELDS, get_querysets, iter_rows, \
+    iter_export, iter_buffered
+from notorhot.models import Competition
+
+
+class ExportTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.other = mixer.blend('notorhot.CandidateCategory')
+        (self.a, self.b) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=self.cat, name=u'Caf\xe9')
+        (self.c, self.d) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=self.other)
+            
+        self.comps = []
+        for (left, right) in ((self.a, self.b),) * 4 + ((self.c, self.d),):
+            comp = Competition.objects.generate_from_candidates(left, right)
+            comp.record_vote(Competition.SIDES.LEFT)
+            self.comps.append(comp)
+        # unvoted
+        Competition.objects.generate_from_candidates(self.a, self.b)
+        
+        # the first vote was a week ago, and has been archived
+        Competition.objects.filter(pk=self.comps[0].pk).update(
+            date_voted=timezone.now() - datetime.timedelta(days=7))
+        Competition.objects.archive_voted_batch(timezone.now() - 
+            datetime.timedelta(days=1))
+            
+    def test_rows(self):
+        (querysets, fields) = get_querysets('competitions')
+        # 3 chunks of live competitions, then 1 of archived ones
+        rows = self.assertNumDataQueries(4, list, iter_rows(querysets, 
+            fields, chunk_size=2))
+        self.assertEqual([row[0] for row in rows], [comp.pk for comp in 
+            self.comps[1:] + self.comps[:1]])
+        self.assertEqual(rows[0][:5], (self.comps[1].pk, self.cat.pk, 
+            self.a.pk, self.b.pk, self.a.pk))
+        
+    def test_filters(self):
+        (querysets, fields) = get_querysets('competitions', 
+            categories=[self.cat])
+        self.assertEqual(len(list(iter_rows(querysets, fields))), 4)
+        
+        today = timezone.localtime(timezone.now()).date()
+        (querysets, fields) = get_querysets('competitions', since=today)
+        self.assertEqual(len(list(iter_rows(querysets, fields))), 4)
+        (querysets, fields) = get_querysets('competitions', 
+            until=today - datetime.timedelta(days=1))
+        self.assertEqual([row[0] for row in iter_rows(querysets, fields)], 
+            [self.comps[0].pk])
+            
+        (querysets, fields) = get_querysets('candidates', 
+            categories=[self.other], since=today, until=today)
+        self.assertEqual([row[0] for row in iter_rows(querysets, fields)], 
+            [self.c.pk, self.d.pk])
+            
+    def test_csv(self):
+        content = ''.join(iter_export('candidates', 'csv', [self.cat]))
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0][:4], ['id', 'category_id', 'name', 'slug'])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][2].decode('utf-8'), u'Caf\xe9')
+        # votes
+        self.assertEqual(rows[1][7], '4')
+        
+    def test_jsonl(self):
+        lines = ''.join(iter_export('competitions', 'jsonl')).splitlines()
+        self.assertEqual(len(lines), 5)
+        row = json.loads(lines[0])
+        self.assertEqual(sorted(row.keys()), sorted(COMPETITION_FIELDS))
+        self.assertEqual(row['id'], self.comps[1].pk)
+        self.assertEqual(row['winning_side'], Competition.SIDES.LEFT)
+        self.assertTrue(row['date_voted'].startswith(
+            str(timezone.now().year)))
+            
+    def test_gzip(self):
+        plain = ''.join(iter_export('competitions', 'jsonl'))
+        compressed = ''.join(iter_export('competitions', 'jsonl', gzip=True))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(compressed)).read(),
+            plain)
+        
+    def test_buffered(self):
+        self.assertEqual(list(iter_buffered(['ab', 'c', 'de', 'f'], size=3)),
+            ['abc', 'def'])
+        self.assertEqual(list(iter_buffered(['ab', 'cd', 'e'], size=3)),
+            ['abcd', 'e'])
+        self.assertEqual(list(iter_buffered([], size=3)), [])
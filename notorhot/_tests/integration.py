@@ -1,13 +1,23 @@
 import datetime
+import gzip
+import json
+from StringIO import StringIO
 from mock import Mock, patch
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.forms import ValidationError
+from django.utils import timezone
 
 from notorhot._tests.factories import mixer
 from notorhot._tests._utils import setup_view, ViewTestMixin, \
-    generate_leaderboard_data
-from notorhot.models import CandidateCategory, Candidate, Competition
+    generate_leaderboard_data, QueryCountMixin
+from notorhot.caching import get_notorhot_cache
+from notorhot.models import CandidateCategory, Candidate, Competition, \
+    QueuedVote
 from notorhot.forms import VoteForm
 from notorhot.views import CompetitionView, VoteView, CandidateView, \
     LeaderboardView, CategoryListView
@@ -27,7 +37,17 @@ class AbsoluteURLTestCase(URLConfMixin, TestCase):
         self.assertEqual(cand.get_absolute_url(), '/candidate/cat-slug/cand-slug/')
 
 
-class CompetitionViewTestCase(URLConfMixin, TestCase):
+class CompetitionViewTestCase(QueryCountMixin, URLConfMixin, TestCase):
+    def test_query_count(self):
+        get_notorhot_cache().clear()
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        mixer.cycle(3).blend('notorhot.Candidate', category=cat)
+        self.client.get('/cat-slug/')
+        
+        # category, candidate selection, insert, challenge increment
+        response = self.assertNumDataQueries(4, self.client.get, '/cat-slug/')
+        self.assertEqual(response.status_code, 200)
+        
     def test_success(self):
         cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
         mixer.blend('notorhot.CandidateCategory')
@@ -45,6 +65,46 @@ class CompetitionViewTestCase(URLConfMixin, TestCase):
         self.assertContains(response, 'Beta')
         self.assertTemplateUsed(response, 'notorhot/competition.html')
         
+    def test_preload_next_competition(self):
+        get_notorhot_cache().clear()
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        mixer.cycle(6).blend('notorhot.Candidate', category=cat, 
+            pic='candidate.jpg')
+        thumbnail = Mock(url='/media/thumb.jpg')
+        
+        for storage in ('session', 'cookie'):
+            with override_settings(NOTORHOT_SETTINGS={ 
+                    'PRELOAD_NEXT_COMPETITION': True, 
+                    'PREVIOUS_VOTE_STORAGE': storage, }):
+                with patch('notorhot.views.get_cached_thumbnail', 
+                        return_value=thumbnail):
+                    response = self.client.get('/cat-slug/')
+                    
+                view = response.context['view']
+                self.assertEqual(view.next_pair[0], cat.pk)
+                self.assertEqual(response['Link'], 
+                    '</media/thumb.jpg>; rel=prefetch, '
+                    '</media/thumb.jpg>; rel=prefetch')
+                self.assertContains(response, 
+                    '<link rel="prefetch" href="/media/thumb.jpg" />', 2)
+                    
+                # the next page presents the candidates chosen in advance
+                response = self.client.get('/cat-slug/')
+                comp = response.context['competition']
+                self.assertEqual([comp.left_id, comp.right_id], 
+                    view.next_pair[1:])
+                self.assertNotIn('Link', response)
+                    
+                # ...only in the same category
+                other = mixer.blend('notorhot.CandidateCategory', 
+                    slug='other-%s' % storage)
+                mixer.cycle(2).blend('notorhot.Candidate', category=other)
+                response = self.client.get('/other-%s/' % storage)
+                self.assertEqual(response.context['competition'].category, 
+                    other)
+                    
+        self.assertIn('notorhot_next_pair', response.cookies)
+        
     def test_insufficient_data(self):
         cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
         mixer.blend('notorhot.CandidateCategory')
@@ -60,7 +120,7 @@ class CompetitionViewTestCase(URLConfMixin, TestCase):
         self.assertTemplateUsed(response, 'notorhot/insufficient_data.html')
 
 
-class VoteViewTestCase(URLConfMixin, TestCase):
+class VoteViewTestCase(QueryCountMixin, URLConfMixin, TestCase):
     def test_success(self):
         cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
         cand1 = mixer.blend('notorhot.Candidate', category=cat, name='Alpha')
@@ -79,6 +139,38 @@ class VoteViewTestCase(URLConfMixin, TestCase):
         self.assertIsNotNone(the_comp.date_voted)
         self.assertRedirects(response, '/cat-slug/')
         
+    def test_token_vote(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        cand1 = mixer.blend('notorhot.Candidate', category=cat, name='Alpha')
+        cand2 = mixer.blend('notorhot.Candidate', category=cat, name='Beta')
+        
+        with override_settings(NOTORHOT_SETTINGS={ 'LAZY_COMPETITIONS': True, }):
+            response = self.client.get('/cat-slug/')
+        comp = response.context['competition']
+        self.assertIsNone(comp.pk)
+        self.assertContains(response, comp.token)
+        self.assertContains(response, 'action="/vote/token/"')
+        self.assertEqual(Competition.objects.count(), 0)
+        
+        response = self.client.post('/vote/token/', follow=False,
+            data={ 'winner': Competition.SIDES.RIGHT, 'token': comp.token, })
+        
+        self.assertEqual(response.status_code, 302)
+        the_comp = Competition.objects.get()
+        self.assertEqual(the_comp.winner, comp.right)
+        self.assertEqual(the_comp.lazy_key, comp.lazy_key)
+        self.assertEqual(self.client.session['last_vote_pk'], the_comp.pk)
+        
+        # resubmission is swallowed, as with double-clicks on saved competitions
+        response = self.client.post('/vote/token/', follow=False,
+            data={ 'winner': Competition.SIDES.LEFT, 'token': comp.token, })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Competition.objects.count(), 1)
+        
+        response = self.client.post('/vote/token/', follow=False,
+            data={ 'winner': Competition.SIDES.LEFT, 'token': 'bogus', })
+        self.assertEqual(response.status_code, 404)
+        
     def test_invalid_answer(self):
         cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
         cand1 = mixer.blend('notorhot.Candidate', category=cat, name='Alpha')
@@ -99,6 +191,161 @@ class VoteViewTestCase(URLConfMixin, TestCase):
         self.assertIsInstance(response.context['view'], VoteView)
         self.assertTemplateUsed(response, 'notorhot/invalid_vote.html')
         
+    def test_previous_vote_cookie(self):
+        get_notorhot_cache().clear()
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        cand1 = mixer.blend('notorhot.Candidate', category=cat, name='Alpha',
+            slug='alpha')
+        cand2 = mixer.blend('notorhot.Candidate', category=cat, name='Beta', 
+            pic='')
+        comp = mixer.blend('notorhot.Competition', left=cand1, right=cand2, 
+            category=cat, id=1)
+            
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'PREVIOUS_VOTE_STORAGE': 'cookie', }):
+            response = self.client.post('/vote/1/', follow=False,
+                data={ 'winner': Competition.SIDES.RIGHT, })
+            self.assertEqual(response.status_code, 302)
+            self.assertIn('notorhot_previous_vote', response.cookies)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+            
+            self.client.get('/cat-slug/')
+            # category, candidate selection, insert, challenge increment; 
+            # nothing for the previous vote
+            response = self.assertNumDataQueries(4, self.client.get, 
+                '/cat-slug/')
+            
+            previous = response.context['previous_vote']
+            self.assertEqual(previous['id'], 1)
+            self.assertEqual(previous['winning_side'], Competition.SIDES.RIGHT)
+            self.assertEqual(previous['left']['name'], 'Alpha')
+            self.assertEqual(previous['left']['url'], 
+                '/candidate/cat-slug/alpha/')
+            self.assertEqual(previous['winner']['name'], 'Beta')
+            self.assertIsNone(previous['winner']['thumbnail'])
+            
+            self.client.cookies['notorhot_previous_vote'] = 'tampered'
+            response = self.client.get('/cat-slug/')
+            self.assertIsNone(response.context['previous_vote'])
+            
+    def test_render_next_competition(self):
+        get_notorhot_cache().clear()
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        cand1 = mixer.blend('notorhot.Candidate', category=cat, name='Alpha')
+        cand2 = mixer.blend('notorhot.Candidate', category=cat, name='Beta')
+        comp = mixer.blend('notorhot.Competition', left=cand1, right=cand2, 
+            category=cat, id=1)
+            
+        with override_settings(NOTORHOT_SETTINGS={ 'VOTE_RESPONSE': 'render', }):
+            response = self.client.post('/vote/1/', follow=False,
+                data={ 'winner': Competition.SIDES.LEFT, })
+                
+            self.assertEqual(response.status_code, 200)
+            self.assertTemplateUsed(response, 'notorhot/competition.html')
+            self.assertEqual(Competition.objects.get(pk=1).winner, cand1)
+            self.assertEqual(response.context['previous_vote'], comp)
+            self.assertEqual(response.context['category'], cat)
+            self.assertNotEqual(response.context['competition'].pk, 1)
+            self.assertNotIn('last_vote_pk', self.client.session)
+            
+            # resubmitting (e.g. refreshing) records nothing, but still 
+            # renders a new competition
+            response = self.client.post('/vote/1/', follow=False,
+                data={ 'winner': Competition.SIDES.RIGHT, })
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.context['previous_vote'])
+            self.assertEqual(Competition.objects.get(pk=1).winner, cand1)
+            self.assertEqual(Candidate.objects.get(pk=cand2.pk).wins, 0)
+            
+            with override_settings(NOTORHOT_SETTINGS={ 
+                    'VOTE_RESPONSE': 'render', 'LAZY_COMPETITIONS': True, 
+                    'PREVIOUS_VOTE_STORAGE': 'cookie', }):
+                lazy = self.client.get('/cat-slug/').context['competition']
+                token = lazy.token
+                response = self.client.post('/vote/token/', follow=False,
+                    data={ 'winner': Competition.SIDES.RIGHT, 'token': token, })
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['previous_vote']['winner'][
+                    'name'], lazy.right.name)
+                self.assertNotIn('notorhot_previous_vote', response.cookies)
+                
+                response = self.client.post('/vote/token/', follow=False,
+                    data={ 'winner': Competition.SIDES.LEFT, 'token': token, })
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(Competition.objects.filter(
+                    date_voted__isnull=False).count(), 2)
+                    
+    def test_render_next_competition_pooled(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        cand1 = mixer.blend('notorhot.Candidate', category=cat)
+        cand2 = mixer.blend('notorhot.Candidate', category=cat)
+        pooled = mixer.blend('notorhot.Competition', left=cand1, right=cand2, 
+            category=cat, is_pooled=True)
+            
+        with override_settings(NOTORHOT_SETTINGS={ 'VOTE_RESPONSE': 'render', }):
+            # never presented, so can't be voted on
+            response = self.client.post('/vote/%d/' % pooled.pk, 
+                follow=False, data={ 'winner': Competition.SIDES.LEFT, })
+            self.assertEqual(response.status_code, 404)
+            
+        pooled = Competition.objects.get(pk=pooled.pk)
+        self.assertTrue(pooled.is_pooled)
+        self.assertIsNone(pooled.date_voted)
+        self.assertRaises(Competition.AlreadyVoted, pooled.record_vote, 
+            Competition.SIDES.LEFT)
+        self.assertIsNone(Competition.objects.get(pk=pooled.pk).date_voted)
+        
+    def test_vote_queue(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        cand1 = mixer.blend('notorhot.Candidate', category=cat, name='Alpha')
+        cand2 = mixer.blend('notorhot.Candidate', category=cat, name='Beta', 
+            pic='')
+        comps = mixer.cycle(3).blend('notorhot.Competition', left=cand1, 
+            right=cand2, category=cat)
+            
+        with override_settings(NOTORHOT_SETTINGS={ 'VOTE_QUEUE': True, 
+                'VOTE_QUEUE_HIGH_WATER': 1, 
+                'PREVIOUS_VOTE_STORAGE': 'cookie', }):
+            # competition, oldest and newest queued IDs, insert
+            response = self.assertNumDataQueries(4, self.client.post, 
+                '/vote/%d/' % comps[0].pk, 
+                data={ 'winner': Competition.SIDES.RIGHT, })
+            self.assertEqual(response.status_code, 302)
+            self.assertIsNone(Competition.objects.get(pk=comps[0].pk).winner)
+            self.assertEqual(QueuedVote.objects.get().competition_id, 
+                comps[0].pk)
+            response = self.client.get('/cat-slug/')
+            self.assertEqual(response.context['previous_vote']['winner'][
+                'name'], 'Beta')
+                
+            # above the high-water mark, votes are recorded synchronously...
+            response = self.client.post('/vote/%d/' % comps[1].pk, 
+                data={ 'winner': Competition.SIDES.LEFT, })
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(Competition.objects.get(pk=comps[1].pk).winner, 
+                cand1)
+            self.assertEqual(QueuedVote.objects.count(), 1)
+            
+        # ...or rejected
+        with override_settings(NOTORHOT_SETTINGS={ 'VOTE_QUEUE': True, 
+                'VOTE_QUEUE_HIGH_WATER': 1, 'VOTE_QUEUE_OVERFLOW': 'reject', }):
+            response = self.client.post('/vote/%d/' % comps[2].pk, 
+                data={ 'winner': Competition.SIDES.LEFT, })
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '5')
+            self.assertIsNone(Competition.objects.get(pk=comps[2].pk).winner)
+            self.assertEqual(QueuedVote.objects.count(), 1)
+            
+        # with session storage, the previous vote shows the queued result
+        with override_settings(NOTORHOT_SETTINGS={ 'VOTE_QUEUE': True, }):
+            self.client.post('/vote/%d/' % comps[2].pk, 
+                data={ 'winner': Competition.SIDES.LEFT, })
+            self.assertIsNone(Competition.objects.get(pk=comps[2].pk).winner)
+            previous = self.client.get('/cat-slug/').context['previous_vote']
+            self.assertEqual(previous.pk, comps[2].pk)
+            self.assertEqual(previous.winning_side, Competition.SIDES.LEFT)
+            self.assertEqual(previous.winner, cand1)
+            
     def test_already_voted(self):
         cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
         cand1 = mixer.blend('notorhot.Candidate', category=cat, name='Alpha')
@@ -120,9 +367,227 @@ class VoteViewTestCase(URLConfMixin, TestCase):
             data={ 'winner': Competition.SIDES.LEFT, })
             
         self.assertEqual(response.status_code, 404)
+        
+    def test_expired(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        comp = mixer.blend('notorhot.Competition', category=cat, id=1, 
+            date_presented=timezone.now() - datetime.timedelta(hours=2))
+            
+        with override_settings(NOTORHOT_SETTINGS={ 'COMPETITION_TTL': 3600, }):
+            response = self.client.post('/vote/1/', follow=False,
+                data={ 'winner': Competition.SIDES.LEFT, })
+                
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(Competition.objects.get(id=1).date_voted)
     
 
-class CandidateViewTestCase(URLConfMixin, TestCase):
+class BatchVoteViewTestCase(URLConfMixin, TestCase):
+    def test_success(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        private = mixer.blend('notorhot.CandidateCategory', is_public=False)
+        cand1 = mixer.blend('notorhot.Candidate', category=cat, name='Alpha')
+        cand2 = mixer.blend('notorhot.Candidate', category=cat, name='Beta')
+        comp1 = mixer.blend('notorhot.Competition', left=cand1, right=cand2, 
+            category=cat)
+        comp2 = mixer.blend('notorhot.Competition', category=private)
+        
+        response = self.client.post('/vote/batch/', json.dumps([
+            [comp1.pk, Competition.SIDES.RIGHT], 
+            [comp1.pk, Competition.SIDES.RIGHT], 
+            [comp2.pk, Competition.SIDES.LEFT],
+        ]), content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), { 'results': [
+            { 'competition': comp1.pk, 'result': 'ok', },
+            { 'competition': comp1.pk, 'result': 'already_voted', },
+            { 'competition': comp2.pk, 'result': 'not_found', },
+        ], })
+        self.assertEqual(Competition.objects.get(pk=comp1.pk).winner, cand2)
+        self.assertNotIn('last_vote_pk', self.client.session)
+        
+    def test_bad_request(self):
+        for body in ('not json', '{"a": 1}', '[[1]]', '[["x", 1]]'):
+            response = self.client.post('/vote/batch/', body, 
+                content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            
+        response = self.client.post('/vote/batch/', json.dumps([[1, 1]] * 101), 
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        
+        response = self.client.get('/vote/batch/')
+        self.assertEqual(response.status_code, 405)
+        
+
+class CompetitionAPIViewTestCase(URLConfMixin, TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        self.cands = mixer.cycle(4).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True)
+            
+    def test_competitions(self):
+        response = self.client.get('/api/cat-slug/competitions/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        comps = json.loads(response.content)['competitions']
+        self.assertEqual(len(comps), 5)
+        self.assertEqual(Competition.objects.count(), 5)
+        self.assertEqual(set(comps[0]), set(['id', 'token', 'left', 'right']))
+        self.assertEqual(set(comps[0]['left']), set(['id', 'name', 'url', 
+            'thumbnail']))
+        
+        response = self.client.get('/api/cat-slug/competitions/', 
+            { 'count': '2', })
+        self.assertEqual(len(json.loads(response.content)['competitions']), 2)
+        
+    def test_insufficient_data(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='empty')
+        response = self.client.get('/api/empty/competitions/')
+        self.assertEqual(json.loads(response.content), { 'competitions': [], })
+        
+    def test_bad_request(self):
+        for count in ('0', '21', 'x'):
+            response = self.client.get('/api/cat-slug/competitions/', 
+                { 'count': count, })
+            self.assertEqual(response.status_code, 400)
+            
+        mixer.blend('notorhot.CandidateCategory', slug='private', 
+            is_public=False)
+        for slug in ('private', 'missing'):
+            response = self.client.get('/api/%s/competitions/' % slug)
+            self.assertEqual(response.status_code, 404)
+            
+        response = self.client.post('/api/cat-slug/competitions/')
+        self.assertEqual(response.status_code, 405)
+        
+
+class VoteAPIViewTestCase(URLConfMixin, TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        self.cands = mixer.cycle(4).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True, votes=0, wins=0)
+            
+    def vote(self, data, slug='cat-slug'):
+        return self.client.post('/api/%s/vote/' % slug, json.dumps(data), 
+            content_type='application/json')
+            
+    def test_vote(self):
+        comp = Competition.objects.generate_from_candidates(self.cands[0], 
+            self.cands[1])
+        response = self.vote({ 'competition': comp.pk, 
+            'winning_side': Competition.SIDES.RIGHT, 'count': 3, })
+            
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['result'], 'ok')
+        self.assertEqual(len(data['competitions']), 3)
+        self.assertEqual(Competition.objects.get(pk=comp.pk).winner, 
+            self.cands[1])
+        self.assertNotIn('last_vote_pk', self.client.session)
+        
+        response = self.vote({ 'competition': comp.pk, 
+            'winning_side': Competition.SIDES.LEFT, })
+        data = json.loads(response.content)
+        self.assertEqual(data['result'], 'already_voted')
+        self.assertEqual(len(data['competitions']), 1)
+        
+        other = mixer.blend('notorhot.CandidateCategory', slug='other')
+        mixer.cycle(2).blend('notorhot.Candidate', category=other)
+        data = json.loads(self.vote({ 'competition': comp.pk, 
+            'winning_side': Competition.SIDES.LEFT, }, 'other').content)
+        self.assertEqual(data['result'], 'not_found')
+        
+    def test_token_vote(self):
+        with override_settings(NOTORHOT_SETTINGS={ 'LAZY_COMPETITIONS': True, }):
+            comp = json.loads(self.client.get('/api/cat-slug/competitions/', 
+                { 'count': 1, }).content)['competitions'][0]
+            data = json.loads(self.vote({ 'token': comp['token'], 
+                'winning_side': Competition.SIDES.LEFT, }).content)
+                
+            self.assertEqual(data['result'], 'ok')
+            self.assertIsNotNone(data['competitions'][0]['token'])
+            saved = Competition.objects.get()
+            self.assertEqual(saved.winner_id, comp['left']['id'])
+            
+            data = json.loads(self.vote({ 'token': comp['token'], 
+                'winning_side': Competition.SIDES.LEFT, }).content)
+            self.assertEqual(data['result'], 'already_voted')
+            
+            data = json.loads(self.vote({ 'token': 'bogus', 
+                'winning_side': Competition.SIDES.LEFT, }).content)
+            self.assertEqual(data['result'], 'not_found')
+            
+            data = json.loads(self.vote({ 'token': comp['token'], 
+                'winning_side': 3, }).content)
+            self.assertEqual(data['result'], 'invalid')
+            
+    def test_bad_request(self):
+        for body in ('not json', '[1, 2]'):
+            response = self.client.post('/api/cat-slug/vote/', body, 
+                content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            
+        response = self.vote({ 'competition': 1, 'winning_side': 1, 
+            'count': 50, })
+        self.assertEqual(response.status_code, 400)
+        
+        response = self.client.get('/api/cat-slug/vote/')
+        self.assertEqual(response.status_code, 405)
+        
+
+class ExportViewTestCase(URLConfMixin, TestCase):
+    def setUp(self):
+        self.cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        (a, b) = mixer.cycle(2).blend('notorhot.Candidate', category=self.cat)
+        Competition.objects.generate_from_candidates(a, b).record_vote(
+            Competition.SIDES.LEFT)
+        User.objects.create_user('staff', 'staff@example.com', 'pw')
+        User.objects.filter(username='staff').update(is_staff=True)
+        User.objects.create_user('visitor', 'visitor@example.com', 'pw')
+        
+    def test_staff_only(self):
+        response = self.client.get('/export/competitions.csv')
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+        
+        self.client.login(username='visitor', password='pw')
+        response = self.client.get('/export/competitions.csv')
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+        
+    def test_export(self):
+        self.client.login(username='staff', password='pw')
+        response = self.client.get('/export/competitions.csv', 
+            { 'category': 'cat-slug', 'since': '2000-01-01', })
+        
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 
+            'attachment; filename="competitions.csv"')
+        self.assertEqual(len(''.join(response.streaming_content
+            ).splitlines()), 2)
+            
+        response = self.client.get('/export/candidates.jsonl', 
+            { 'gzip': '1', })
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 
+            'attachment; filename="candidates.jsonl.gz"')
+        content = gzip.GzipFile(fileobj=StringIO(''.join(
+            response.streaming_content))).read()
+        self.assertEqual(len(content.splitlines()), 2)
+        
+    def test_bad_filters(self):
+        self.client.login(username='staff', password='pw')
+        response = self.client.get('/export/competitions.csv', 
+            { 'until': 'yesterday', })
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/export/competitions.csv', 
+            { 'category': 'nope', })
+        self.assertEqual(response.status_code, 404)
+        
+        
+class CandidateViewTestCase(URLConfMixin, QueryCountMixin, TestCase):
     def test_success(self):
         cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
         cand = mixer.blend('notorhot.Candidate', category=cat, name='Alpha', slug='alpha')
@@ -148,6 +613,32 @@ class CandidateViewTestCase(URLConfMixin, TestCase):
         
         self.assertEqual(response.status_code, 404)
         
+    def test_cached(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        cand = mixer.blend('notorhot.Candidate', category=cat, name='Alpha', 
+            slug='alpha')
+        get_notorhot_cache().clear()
+        
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'INSTANCE_CACHE_TIMEOUT': 60, }):
+            self.client.get('/candidate/cat-slug/alpha/')
+            response = self.assertNumDataQueries(0, self.client.get, 
+                '/candidate/cat-slug/alpha/')
+                
+            self.assertEqual(response.context['candidate'], cand)
+            self.assertEqual(response.context['category'], cat)
+            
+            # saved changes are seen at once
+            cand.name = 'Beta'
+            cand.save()
+            response = self.client.get('/candidate/cat-slug/alpha/')
+            self.assertContains(response, 'Beta')
+            
+            cat.is_public = False
+            cat.save()
+            response = self.client.get('/candidate/cat-slug/alpha/')
+            self.assertEqual(response.status_code, 404)
+        
 
 
 class LeaderboardViewTestCase(URLConfMixin, TestCase):
@@ -170,6 +661,58 @@ class LeaderboardViewTestCase(URLConfMixin, TestCase):
         self.assertContains(response, 'Delta')
         self.assertTemplateUsed(response, 'notorhot/leaders.html')
         
+    def test_rating(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        cands = [mixer.blend('notorhot.Candidate', category=cat, name=name, 
+            rating=rating) for (name, rating) in 
+            (('Alpha', 1400), ('Beta', 1612.4), ('Gamma', 1500))]
+            
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'LEADERBOARD_RANKING': 'rating', }):
+            response = self.client.get('/cat-slug/leaders/')
+            
+        self.assertEqual(list(response.context['leaders']), 
+            [cands[1], cands[2], cands[0]])
+        self.assertContains(response, '<td class="rating">1612</td>', 
+            html=True)
+        
+    def test_strength(self):
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        cands = [mixer.blend('notorhot.Candidate', category=cat, name=name, 
+            strength=strength) for (name, strength) in 
+            (('Alpha', -0.5), ('Beta', 1.234), ('Gamma', 0.1))]
+            
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'LEADERBOARD_RANKING': 'strength', }):
+            response = self.client.get('/cat-slug/leaders/')
+            
+        self.assertEqual(list(response.context['leaders']), 
+            [cands[1], cands[2], cands[0]])
+        self.assertContains(response, '<td class="strength">1.23</td>', 
+            html=True)
+        
+    def test_cached(self):
+        get_notorhot_cache().clear()
+        cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        (cand1, cand2) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=cat, is_enabled=True, votes=0, wins=0)
+        comp = Competition.objects.generate_from_candidates(cand1, cand2)
+        
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'LEADERBOARD_CACHE_TIMEOUT': 60, 
+                'LEADERBOARD_MIN_REFRESH': 0, }):
+            self.client.get('/cat-slug/leaders/')
+            with self.assertNumQueries(4):
+                # only category lookups; no candidate queries
+                response = self.client.get('/cat-slug/leaders/')
+            self.assertIsNotNone(response.context['leaderboard_version'])
+            
+            comp.record_vote(Competition.SIDES.RIGHT)
+            response = self.client.get('/cat-slug/leaders/')
+            
+        self.assertEqual(list(response.context['leaders']), [cand2, cand1])
+        self.assertEqual(response.context['leaders'][0].wins, 1)
+        
     def test_empty(self):
         cat1 = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
 
@@ -1,11 +1,23 @@
 import datetime
+import threading
+import time
+from mock import patch
 
-from django.test import TestCase
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 from notorhot._tests.factories import mixer
-from notorhot._tests._utils import generate_leaderboard_data
-from notorhot.models import CandidateCategory, Candidate, Competition
+from notorhot._tests._utils import generate_leaderboard_data, QueryCountMixin
+from notorhot.caching import CandidateIndex, get_notorhot_cache
+from notorhot import indexes
+from notorhot.models import CandidateCategory, Candidate, Competition, \
+    ArchivedCompetition, QueuedVote
+from notorhot.ratings import apply_votes
 
 class NotorHotCategoryTestCase(TestCase):
     def test_category_publicity_manager(self):
@@ -41,6 +53,74 @@ class NotorHotCategoryTestCase(TestCase):
             date_voted=datetime.datetime.now())
         self.assertEqual(cat.num_voted_competitions, 2)
         
+    def test_category_with_counts(self):
+        cats = mixer.cycle(2).blend('notorhot.CandidateCategory')
+        mixer.cycle(3).blend('notorhot.Candidate', category=cats[0], 
+            is_enabled=True)
+        mixer.blend('notorhot.Candidate', category=cats[0], is_enabled=False)
+        mixer.cycle(2).blend('notorhot.Competition', category=cats[0], 
+            date_voted=None)
+        mixer.cycle(2).blend('notorhot.Competition', category=cats[1], 
+            date_voted=datetime.datetime.now())
+            
+        with self.assertNumQueries(1):
+            counts = [(cat.num_candidates, cat.num_voted_competitions) for cat
+                in CandidateCategory.objects.with_counts().order_by('pk')]
+        # competitions' candidates are blended into new categories
+        self.assertEqual(counts[:2], [(3, 0), (0, 2)])
+        
+        
+class CompetitionIndexTestCase(TestCase):
+    """
+    Checks, with SQLite's ``EXPLAIN QUERY PLAN``, that competition queries 
+    are answered from the indexes meant for them.
+    """
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("Query plans are checked on SQLite only")
+            
+    def get_index_name(self, columns):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA index_list(notorhot_competition)')
+        for row in cursor.fetchall():
+            cursor.execute('PRAGMA index_info(%s)' % 
+                connection.ops.quote_name(row[1]))
+            if tuple(info[2] for info in cursor.fetchall()) == columns:
+                return row[1]
+                
+    def get_plan(self, queryset):
+        (sql, params) = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN %s' % sql, params)
+        return u' '.join(row[-1] for row in cursor.fetchall())
+        
+    def assertUsesIndex(self, queryset, columns):
+        name = self.get_index_name(columns)
+        self.assertIsNotNone(name)
+        self.assertIn(u'INDEX %s' % name, self.get_plan(queryset))
+        
+    def test_category_date_voted(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        self.assertUsesIndex(Competition.objects.filter(category=cat, 
+            date_voted__isnull=False), ('category_id', 'date_voted'))
+            
+    def test_date_voted(self):
+        self.assertUsesIndex(Competition.objects.filter(
+            date_voted__lt=timezone.now()), ('date_voted',))
+            
+    def test_unvoted(self):
+        # with statistics showing that most competitions are unvoted, the 
+        # planner prefers the partial index to the one on date_voted
+        cat = mixer.blend('notorhot.CandidateCategory')
+        (cand1, cand2) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=cat)
+        Competition.objects.bulk_create([Competition(category=cat, left=cand1,
+            right=cand2) for i in range(50)])
+        connection.cursor().execute('ANALYZE')
+        
+        self.assertUsesIndex(Competition.objects.expired(timezone.now()), 
+            ('date_presented',))
+            
     
 class NotorHotCandidateTestCase(TestCase):
     def test_order_by_wins(self):
@@ -55,6 +135,14 @@ class NotorHotCandidateTestCase(TestCase):
         wins = [c.wins for c in in_order]
         self.assertEqual(wins, [6, 7, 8, 9])
         
+    def test_order_by_rating(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        cands = [mixer.blend('notorhot.Candidate', category=cat, rating=rating)
+            for rating in (1400, 1600, 1500)]
+        
+        in_order = Candidate.objects.for_category(cat).order_by_rating()
+        self.assertEqual(list(in_order), [cands[1], cands[2], cands[0]])
+        
     def test_for_category(self):
         cat1 = mixer.blend('notorhot.CandidateCategory')
         cat2 = mixer.blend('notorhot.CandidateCategory')
@@ -95,6 +183,39 @@ class NotorHotCandidateTestCase(TestCase):
         self.assertEqual(cand.votes, 3)
         self.assertEqual(cand.wins, 2)
         
+    def test_stored_win_pct(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        (cand1, cand2) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=cat, votes=3, wins=1)
+        self.assertAlmostEqual(cand1.win_pct, 1 / 3.0)
+        
+        comp = Competition.objects.generate_from_candidates(cand1, cand2)
+        comp.record_vote(Competition.SIDES.LEFT)
+        self.assertEqual(cand1.win_pct, 0.5)
+        self.assertEqual(Candidate.objects.get(pk=cand1.pk).win_pct, 0.5)
+        self.assertEqual(Candidate.objects.get(pk=cand2.pk).win_pct, 0.25)
+        
+        cand2.increment_votes(True)
+        self.assertEqual(cand2.win_pct, 0.4)
+        self.assertEqual(Candidate.objects.get(pk=cand2.pk).win_pct, 0.4)
+        
+        Candidate.objects.add_counter_deltas({ 
+            cand1.pk: { 'votes': 4, 'wins': 4, }, 
+            cand2.pk: { 'challenges': 1, },
+        })
+        self.assertEqual(Candidate.objects.get(pk=cand1.pk).win_pct, 0.75)
+        self.assertEqual(Candidate.objects.get(pk=cand2.pk).win_pct, 0.4)
+        
+    def test_order_by_wins_unvoted(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        unvoted = mixer.blend('notorhot.Candidate', category=cat, votes=0, 
+            wins=0)
+        voted = mixer.blend('notorhot.Candidate', category=cat, votes=2, 
+            wins=1)
+        
+        self.assertEqual(list(Candidate.objects.order_by_wins()), 
+            [voted, unvoted])
+        
     def test_win_percentage(self):
         cand = mixer.blend('notorhot.Candidate', votes=10, wins=5)        
         self.assertEqual(cand.win_percentage, 50.0)
@@ -147,6 +268,106 @@ class NotorHotCompetitionTestCase(TestCase):
             self.assertEqual(Competition.objects.count(), i + 2)
             self.assertTrue(comp.left in popular)
             self.assertTrue(comp.right in popular)
+            
+    def test_generate_for_category(self):
+        get_notorhot_cache().clear()
+        cat = mixer.blend('notorhot.CandidateCategory')
+        other_cat = mixer.blend('notorhot.CandidateCategory')
+        
+        with self.assertRaises(Candidate.DoesNotExist):
+            Competition.objects.generate_for_category(cat)
+            
+        enabled = mixer.cycle(3).blend('notorhot.Candidate', category=cat, 
+            is_enabled=True)
+        mixer.cycle(2).blend('notorhot.Candidate', category=cat, 
+            is_enabled=False)
+        mixer.cycle(2).blend('notorhot.Candidate', category=other_cat, 
+            is_enabled=True)
+        
+        for i in range(20):
+            comp = Competition.objects.generate_for_category(cat)
+            self.assertIn(comp.left, enabled)
+            self.assertIn(comp.right, enabled)
+            self.assertNotEqual(comp.left, comp.right)
+            self.assertEqual(comp.category, cat)
+            
+    def test_generate_for_category_index_invalidation(self):
+        get_notorhot_cache().clear()
+        cat = mixer.blend('notorhot.CandidateCategory')
+        other_cat = mixer.blend('notorhot.CandidateCategory')
+        cands = mixer.cycle(3).blend('notorhot.Candidate', category=cat, 
+            is_enabled=True)
+        index = CandidateIndex(cat.pk)
+
+        Competition.objects.generate_for_category(cat)
+        self.assertIsNotNone(index.sample(2))
+        
+        # counter updates leave the index alone
+        cands[0].increment_votes(True)
+        self.assertIsNotNone(index.sample(2))
+        
+        # disabling, moving, adding, and deleting all invalidate
+        cands[0].is_enabled = False
+        cands[0].save()
+        self.assertIsNone(index.sample(2))
+        
+        for i in range(20):
+            comp = Competition.objects.generate_for_category(cat)
+            self.assertEqual(set([comp.left, comp.right]), set(cands[1:]))
+            
+        other_index = CandidateIndex(other_cat.pk)
+        other_index.build([])
+        cands[1].category = other_cat
+        cands[1].save()
+        self.assertIsNone(index.sample(2))
+        self.assertIsNone(other_index.sample(2))
+        
+        with self.assertRaises(Candidate.DoesNotExist):
+            Competition.objects.generate_for_category(cat)
+            
+        new_cand = mixer.blend('notorhot.Candidate', category=cat, 
+            is_enabled=True)
+        self.assertIsNone(index.sample(2))
+        comp = Competition.objects.generate_for_category(cat)
+        self.assertEqual(set([comp.left, comp.right]), set([cands[2], new_cand]))
+        
+        new_cand.delete()
+        self.assertIsNone(index.sample(2))
+        
+    @override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', },
+            'dummy': { 
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache', },
+        }, NOTORHOT_SETTINGS={ 'CACHE_ALIAS': 'dummy', })
+    def test_generate_for_category_uncached(self):
+        # a cache that keeps nothing still yields candidates
+        cat = mixer.blend('notorhot.CandidateCategory')
+        cands = mixer.cycle(3).blend('notorhot.Candidate', category=cat, 
+            is_enabled=True)
+        comp = Competition.objects.generate_for_category(cat)
+        self.assertNotEqual(comp.left, comp.right)
+        self.assertIn(comp.left, cands)
+        self.assertIn(comp.right, cands)
+        
+        values = Competition.objects.present_values_for_category(cat, 2)
+        self.assertEqual(len(values), 2)
+        
+    def test_generate_for_category_stale_index(self):
+        get_notorhot_cache().clear()
+        cat = mixer.blend('notorhot.CandidateCategory')
+        cands = mixer.cycle(3).blend('notorhot.Candidate', category=cat, 
+            is_enabled=True)
+        Competition.objects.generate_for_category(cat)
+            
+        # QuerySet.update() bypasses signals, so the index goes stale; 
+        # generation should notice and rebuild it.
+        Candidate.objects.filter(pk=cands[0].pk).update(is_enabled=False)
+        
+        for i in range(20):
+            comp = Competition.objects.generate_for_category(cat)
+            self.assertEqual(set([comp.left.pk, comp.right.pk]), 
+                set([cands[1].pk, cands[2].pk]))
 
     
     def test_clean(self):
@@ -273,3 +494,728 @@ class NotorHotCompetitionTestCase(TestCase):
         # been voted on
         with self.assertRaises(Competition.AlreadyVoted):
             comp.record_vote(Competition.SIDES.RIGHT)
+
+
+class CompetitionVoteRecordingTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True, challenges=0, votes=0, wins=0)
+        self.comp = Competition.objects.generate_from_candidates(self.cands[0], 
+            self.cands[1])
+            
+    def test_query_count(self):
+        comp = Competition.objects.get(pk=self.comp.pk)
+        # vote claim, ratings, candidate counters and ratings
+        self.assertNumDataQueries(3, comp.record_vote, 
+            Competition.SIDES.LEFT)
+        self.assertEqual(comp.winner_id, self.cands[0].pk)
+        self.assertAlmostEqual(comp.left.rating, 1516.0)
+        
+        left = Candidate.objects.get(pk=self.cands[0].pk)
+        self.assertEqual((left.votes, left.wins), (1, 1))
+        self.assertAlmostEqual(left.rating, 1516.0)
+        right = Candidate.objects.get(pk=self.cands[1].pk)
+        self.assertEqual((right.votes, right.wins), (1, 0))
+        self.assertAlmostEqual(right.rating, 1484.0)
+        
+    @override_settings(NOTORHOT_SETTINGS={ 'ELO_RATINGS': False, })
+    def test_query_count_without_ratings(self):
+        comp = Competition.objects.get(pk=self.comp.pk)
+        # vote claim, candidate counters; no row locks for ratings
+        self.assertNumDataQueries(2, comp.record_vote, 
+            Competition.SIDES.LEFT)
+        
+        left = Candidate.objects.get(pk=self.cands[0].pk)
+        self.assertEqual((left.votes, left.wins), (1, 1))
+        self.assertAlmostEqual(left.rating, 1500.0)
+        right = Candidate.objects.get(pk=self.cands[1].pk)
+        self.assertEqual((right.votes, right.wins), (1, 0))
+        
+    def test_stale_instance(self):
+        first = Competition.objects.get(pk=self.comp.pk)
+        second = Competition.objects.get(pk=self.comp.pk)
+        
+        first.record_vote(Competition.SIDES.LEFT)
+        # the second instance hasn't seen the vote, but the database has
+        with self.assertRaises(Competition.AlreadyVoted):
+            second.record_vote(Competition.SIDES.RIGHT)
+            
+        self.assertIsNone(second.date_voted)
+        saved = Competition.objects.get(pk=self.comp.pk)
+        self.assertEqual(saved.winning_side, Competition.SIDES.LEFT)
+        right = Candidate.objects.get(pk=self.cands[1].pk)
+        self.assertEqual((right.votes, right.wins), (1, 0))
+        
+    def test_no_winner(self):
+        self.comp.record_vote(None)
+        self.assertIsNone(self.comp.winner)
+        self.assertIsNotNone(self.comp.date_voted)
+        
+        for cand in Candidate.objects.all():
+            self.assertEqual((cand.votes, cand.wins), (1, 0))
+
+
+class BulkVoteTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(3).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True, challenges=0, votes=0, wins=0)
+        self.comps = [Competition.objects.generate_from_candidates(left, right) 
+            for (left, right) in [(self.cands[0], self.cands[1]), 
+                (self.cands[1], self.cands[2]), (self.cands[2], self.cands[0])]]
+                
+    def get_counts(self, cand):
+        cand = Candidate.objects.get(pk=cand.pk)
+        return (cand.votes, cand.wins)
+        
+    def test_record_votes_bulk(self):
+        self.comps[2].record_vote(Competition.SIDES.LEFT)
+        RESULTS = Competition.VOTE_RESULTS
+        
+        results = Competition.objects.record_votes_bulk([
+            (self.comps[0].pk, Competition.SIDES.LEFT),
+            (self.comps[1].pk, Competition.SIDES.RIGHT),
+            (self.comps[2].pk, Competition.SIDES.RIGHT),
+            (self.comps[0].pk, Competition.SIDES.RIGHT),
+            (9999, Competition.SIDES.LEFT),
+            (self.comps[1].pk, 99),
+        ])
+        
+        self.assertEqual(results, [
+            (self.comps[0].pk, RESULTS.OK),
+            (self.comps[1].pk, RESULTS.OK),
+            (self.comps[2].pk, RESULTS.ALREADY_VOTED),
+            (self.comps[0].pk, RESULTS.ALREADY_VOTED),
+            (9999, RESULTS.NOT_FOUND),
+            (self.comps[1].pk, RESULTS.INVALID),
+        ])
+        
+        comp = Competition.objects.get(pk=self.comps[0].pk)
+        self.assertEqual(comp.winner_id, self.cands[0].pk)
+        self.assertEqual(comp.winning_side, Competition.SIDES.LEFT)
+        self.assertIsNotNone(comp.date_voted)
+        comp = Competition.objects.get(pk=self.comps[1].pk)
+        self.assertEqual(comp.winner_id, self.cands[2].pk)
+        
+        self.assertEqual(self.get_counts(self.cands[0]), (2, 1))
+        self.assertEqual(self.get_counts(self.cands[1]), (2, 0))
+        self.assertEqual(self.get_counts(self.cands[2]), (2, 2))
+        
+    def test_query_count(self):
+        votes = [(self.comps[0].pk, Competition.SIDES.LEFT),
+            (self.comps[1].pk, Competition.SIDES.LEFT),
+            (self.comps[2].pk, Competition.SIDES.LEFT)]
+        # fetch, one claim per side, counters (each candidate gains two votes
+        # and one win, so all are updated together), win percentages, 
+        # ratings fetch, one rating update per candidate
+        self.assertNumDataQueries(8, Competition.objects.record_votes_bulk, 
+            votes)
+        for cand in self.cands:
+            self.assertEqual(self.get_counts(cand), (2, 1))
+            
+        # ratings are applied in order, as though voted one by one
+        ratings = [Candidate.objects.get(pk=cand.pk).rating 
+            for cand in self.cands]
+        self.assertAlmostEqual(sum(ratings), 3 * 1500.0)
+        expected = apply_votes({}, [(self.cands[0].pk, self.cands[1].pk), 
+            (self.cands[1].pk, self.cands[2].pk), 
+            (self.cands[2].pk, self.cands[0].pk)])
+        for (cand, rating) in zip(self.cands, ratings):
+            self.assertAlmostEqual(rating, expected[cand.pk])
+            
+    @override_settings(NOTORHOT_SETTINGS={ 'ELO_RATINGS': False, })
+    def test_query_count_without_ratings(self):
+        votes = [(self.comps[0].pk, Competition.SIDES.LEFT),
+            (self.comps[1].pk, Competition.SIDES.LEFT),
+            (self.comps[2].pk, Competition.SIDES.LEFT)]
+        # fetch, one claim per side, counters, win percentages
+        self.assertNumDataQueries(4, Competition.objects.record_votes_bulk, 
+            votes)
+        for cand in self.cands:
+            self.assertEqual(self.get_counts(cand), (2, 1))
+            self.assertEqual(Candidate.objects.get(pk=cand.pk).rating, 1500.0)
+            
+    def test_historical_dates(self):
+        date_voted = timezone.now() - datetime.timedelta(days=30)
+        Competition.objects.record_votes_bulk([
+            (self.comps[0].pk, Competition.SIDES.RIGHT, date_voted),])
+        self.assertEqual(Competition.objects.get(pk=self.comps[0].pk
+            ).date_voted, date_voted)
+            
+    def test_restricted_queryset(self):
+        results = Competition.objects.record_votes_bulk(
+            [(self.comps[0].pk, Competition.SIDES.LEFT),], 
+            Competition.objects.exclude(pk=self.comps[0].pk))
+        self.assertEqual(results, 
+            [(self.comps[0].pk, Competition.VOTE_RESULTS.NOT_FOUND),])
+            
+    def test_expired(self):
+        presented = timezone.now() - datetime.timedelta(hours=2)
+        Competition.objects.filter(pk=self.comps[0].pk).update(
+            date_presented=presented)
+            
+        with override_settings(NOTORHOT_SETTINGS={ 'COMPETITION_TTL': 3600, }):
+            results = Competition.objects.record_votes_bulk([
+                (self.comps[0].pk, Competition.SIDES.LEFT),
+                (self.comps[1].pk, Competition.SIDES.LEFT),
+                # judged by when the vote was cast
+                (self.comps[0].pk, Competition.SIDES.LEFT, 
+                    presented + datetime.timedelta(minutes=30)),
+            ])
+            
+        self.assertEqual([result for (pk, result) in results], [
+            Competition.VOTE_RESULTS.EXPIRED, Competition.VOTE_RESULTS.OK,
+            Competition.VOTE_RESULTS.OK])
+        
+        
+class CompetitionExpiryTestCase(TestCase):
+    def setUp(self):
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        (cand1, cand2) = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=self.cat, votes=0, wins=0)
+        now = timezone.now()
+        self.fresh = Competition.objects.generate_from_candidates(cand1, cand2)
+        self.stale = Competition.objects.generate_from_candidates(cand1, cand2)
+        self.voted = Competition.objects.generate_from_candidates(cand1, cand2)
+        self.voted.record_vote(Competition.SIDES.LEFT)
+        Competition.objects.filter(pk__in=(self.stale.pk, self.voted.pk)
+            ).update(date_presented=now - datetime.timedelta(days=2))
+        self.stale = Competition.objects.get(pk=self.stale.pk)
+        
+    def test_no_ttl(self):
+        self.assertIsNone(Competition.get_expiry_cutoff())
+        self.assertFalse(self.stale.is_expired())
+        self.assertFalse(Competition.objects.expired().exists())
+        
+    @override_settings(NOTORHOT_SETTINGS={ 'COMPETITION_TTL': 60 * 60 * 24, })
+    def test_expired(self):
+        self.assertFalse(self.fresh.is_expired())
+        self.assertTrue(self.stale.is_expired())
+        self.assertFalse(self.stale.is_expired(
+            self.stale.date_presented + datetime.timedelta(hours=1)))
+        self.assertEqual(list(Competition.objects.expired()), [self.stale])
+        
+    def test_delete_expired_batch(self):
+        more = [Competition.objects.generate_from_candidates(self.fresh.left,
+            self.fresh.right) for i in range(2)]
+        Competition.objects.filter(pk__in=[comp.pk for comp in more]).update(
+            date_presented=self.stale.date_presented)
+        cutoff = timezone.now() - datetime.timedelta(days=1)
+        
+        self.assertEqual(Competition.objects.delete_expired_batch(cutoff, 2), 2)
+        self.assertEqual(Competition.objects.delete_expired_batch(cutoff, 2), 1)
+        self.assertEqual(Competition.objects.delete_expired_batch(cutoff, 2), 0)
+        self.assertEqual(set(Competition.objects.values_list('pk', flat=True)),
+            set([self.fresh.pk, self.voted.pk]))
+        # counters are untouched
+        self.assertEqual(Candidate.objects.get(pk=self.fresh.left_id
+            ).challenges, 5)
+            
+    def test_archive_voted_batch(self):
+        cutoff = timezone.now() + datetime.timedelta(seconds=1)
+        # as though an earlier run was interrupted after copying
+        ArchivedCompetition.objects.create(id=self.voted.pk, 
+            category=self.cat, left=self.voted.left, right=self.voted.right, 
+            date_presented=self.voted.date_presented, 
+            date_voted=self.voted.date_voted)
+            
+        self.assertEqual(Competition.objects.archive_voted_batch(cutoff), 1)
+        self.assertEqual(Competition.objects.archive_voted_batch(cutoff), 0)
+        self.assertFalse(Competition.objects.filter(pk=self.voted.pk).exists())
+        self.assertEqual(ArchivedCompetition.objects.count(), 1)
+        
+        self.voted.left.delete()
+        archived = ArchivedCompetition.objects.get()
+        self.assertEqual(archived.left_id, self.voted.left_id)
+        
+        
+class CompetitionIndexesTestCase(TestCase):
+    def exists(self):
+        return indexes.index_exists(connection, 'notorhot_competition', 
+            'notorhot_competition_unvoted')
+        
+    def test_fallback_indexes(self):
+        # supported here, so only the partial index is created
+        self.assertTrue(self.exists())
+        indexes.create_fallback_indexes(connection)
+        indexes.drop_fallback_indexes(connection)
+        self.assertTrue(self.exists())
+        
+        indexes.drop_partial_indexes(connection)
+        self.assertFalse(self.exists())
+        with patch('notorhot.indexes.supports_partial_indexes', 
+                return_value=False):
+            indexes.create_fallback_indexes(connection)
+            self.assertTrue(self.exists())
+            # already there
+            indexes.create_fallback_indexes(connection)
+            
+            indexes.drop_fallback_indexes(connection)
+            self.assertFalse(self.exists())
+        indexes.create_partial_indexes(connection)
+        self.assertTrue(self.exists())
+
+
+class ConcurrentVoteTestCase(TransactionTestCase):
+    num_voters = 50
+    
+    def setUp(self):
+        # threads each get their own database connection, so they can't share
+        # SQLite's in-memory test database
+        if connection.vendor == 'sqlite' and \
+                connection.settings_dict['NAME'] in ('', ':memory:'):
+            self.skipTest("Concurrent voting needs a file-based test database")
+            
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True, challenges=0, votes=0, wins=0)
+            
+    def run_voters(self, comp_ids):
+        start = threading.Event()
+        results = []
+        
+        def vote(comp_id):
+            try:
+                comp = Competition.objects.get(pk=comp_id)
+                start.wait()
+                try:
+                    comp.record_vote(Competition.SIDES.LEFT)
+                    results.append(True)
+                except Competition.AlreadyVoted:
+                    results.append(False)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=vote, args=(comp_id,)) 
+            for comp_id in comp_ids]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+            
+        return results
+            
+    def test_same_competition(self):
+        comp = Competition.objects.generate_from_candidates(self.cands[0], 
+            self.cands[1])
+            
+        results = self.run_voters([comp.pk] * self.num_voters)
+        
+        self.assertEqual(len(results), self.num_voters)
+        self.assertEqual(results.count(True), 1)
+        left = Candidate.objects.get(pk=self.cands[0].pk)
+        self.assertEqual((left.votes, left.wins), (1, 1))
+        right = Candidate.objects.get(pk=self.cands[1].pk)
+        self.assertEqual((right.votes, right.wins), (1, 0))
+        
+    def test_many_competitions(self):
+        comp_ids = [Competition.objects.generate_from_candidates(
+            self.cands[0], self.cands[1]).pk for i in range(self.num_voters)]
+            
+        results = self.run_voters(comp_ids)
+        
+        self.assertEqual(results.count(True), self.num_voters)
+        left = Candidate.objects.get(pk=self.cands[0].pk)
+        self.assertEqual((left.challenges, left.votes, left.wins), 
+            (self.num_voters, self.num_voters, self.num_voters))
+        right = Candidate.objects.get(pk=self.cands[1].pk)
+        self.assertEqual((right.challenges, right.votes, right.wins), 
+            (self.num_voters, self.num_voters, 0))
+
+
+class CompetitionGenerationQueryTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(3).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True, challenges=0)
+    
+    def test_generate_from_candidates(self):
+        # insert, challenge increment
+        comp = self.assertNumDataQueries(2, 
+            Competition.objects.generate_from_candidates, self.cands[0], 
+            self.cands[1])
+        self.assertEqual(comp.category_id, self.cat.pk)
+        self.assertEqual(self.cands[0].challenges, 1)
+        self.assertEqual(
+            Candidate.objects.get(pk=self.cands[0].pk).challenges, 1)
+        self.assertEqual(
+            Candidate.objects.get(pk=self.cands[1].pk).challenges, 1)
+        self.assertEqual(
+            Candidate.objects.get(pk=self.cands[2].pk).challenges, 0)
+        
+    def test_generate_from_queryset(self):
+        # category check, selection, insert, challenge increment
+        self.assertNumDataQueries(4, 
+            Competition.objects.generate_from_queryset, 
+            Candidate.objects.all())
+        
+    def test_generate_for_category(self):
+        # cold index: + one query to build it
+        self.assertNumDataQueries(4, 
+            Competition.objects.generate_for_category, self.cat)
+        # warm index: selection, insert, challenge increment
+        self.assertNumDataQueries(3, 
+            Competition.objects.generate_for_category, self.cat)
+        
+        total_challenges = sum(Candidate.objects.values_list('challenges', 
+            flat=True))
+        self.assertEqual(total_challenges, 4)
+        
+    def test_select_preselected(self):
+        ids = [self.cands[2].pk, self.cands[0].pk]
+        # only the two rows; the index isn't touched
+        (left, right) = self.assertNumDataQueries(1, 
+            Competition.objects.select_from_category, self.cat, ids)
+        self.assertEqual((left, right), (self.cands[2], self.cands[0]))
+        
+        # unusable choices fall back to random selection
+        other = mixer.blend('notorhot.Candidate', is_enabled=True)
+        for ids in ([self.cands[0].pk, other.pk], 
+                [self.cands[0].pk, self.cands[0].pk]):
+            (left, right) = Competition.objects.select_from_category(self.cat,
+                ids)
+            self.assertNotEqual(left, right)
+            self.assertIn(left, self.cands)
+            self.assertIn(right, self.cands)
+
+
+class CompetitionPoolTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(4).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True, challenges=0)
+        
+    def test_fill_pool(self):
+        other_cat = mixer.blend('notorhot.CandidateCategory')
+        mixer.cycle(2).blend('notorhot.Candidate', category=other_cat)
+        
+        self.assertEqual(Competition.objects.fill_pool(self.cat, 10), 10)
+        self.assertEqual(Competition.objects.pooled().count(), 10)
+        self.assertEqual(Competition.votable.count(), 0)
+        
+        for comp in Competition.objects.pooled():
+            self.assertEqual(comp.category, self.cat)
+            self.assertIn(comp.left, self.cands)
+            self.assertIn(comp.right, self.cands)
+            self.assertNotEqual(comp.left, comp.right)
+            
+        challenges = Candidate.objects.filter(category=self.cat).values_list(
+            'challenges', flat=True)
+        self.assertEqual(sum(challenges), 20)
+        
+        # already full
+        self.assertEqual(Competition.objects.fill_pool(self.cat, 10), 0)
+        self.assertEqual(Competition.objects.fill_pool(self.cat, 12), 2)
+        self.assertEqual(Competition.objects.pooled().count(), 12)
+        
+    def test_fill_pool_discards_disabled(self):
+        Competition.objects.fill_pool(self.cat, 20)
+        disabled = Candidate.objects.get(pk=self.cands[0].pk)
+        disabled.is_enabled = False
+        disabled.save()
+        
+        Competition.objects.fill_pool(self.cat, 20)
+        pool = Competition.objects.pooled()
+        self.assertEqual(pool.count(), 20)
+        self.assertFalse(pool.filter(left=self.cands[0]).exists())
+        self.assertFalse(pool.filter(right=self.cands[0]).exists())
+        
+        # challenges count only the competitions still pooled
+        self.assertEqual(Candidate.objects.get(pk=self.cands[0].pk
+            ).challenges, 0)
+        for cand in self.cands[1:]:
+            self.assertEqual(Candidate.objects.get(pk=cand.pk).challenges, 
+                pool.filter(Q(left=cand) | Q(right=cand)
+                ).count())
+        
+    def test_fill_pool_insufficient_candidates(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        mixer.blend('notorhot.Candidate', category=cat)
+        self.assertEqual(Competition.objects.fill_pool(cat, 10), 0)
+        
+    def test_pop_from_pool(self):
+        self.assertIsNone(Competition.objects.pop_from_pool(self.cat))
+        
+        Competition.objects.fill_pool(self.cat, 3)
+        popped = []
+        for i in range(3):
+            # claim window select + conditional update
+            comp = self.assertNumDataQueries(2, 
+                Competition.objects.pop_from_pool, self.cat)
+            self.assertFalse(comp.is_pooled)
+            popped.append(comp.pk)
+            
+        self.assertEqual(len(set(popped)), 3)
+        self.assertEqual(Competition.votable.count(), 3)
+        self.assertIsNone(Competition.objects.pop_from_pool(self.cat))
+        
+    def test_generate_competition(self):
+        Competition.objects.fill_pool(self.cat, 1)
+        pooled = Competition.objects.pooled().get()
+        
+        # pool not used unless enabled
+        comp = self.cat.generate_competition()
+        self.assertNotEqual(comp.pk, pooled.pk)
+        
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'COMPETITION_POOL_DEPTH': 5, }):
+            comp = self.cat.generate_competition()
+            self.assertEqual(comp.pk, pooled.pk)
+            
+            # empty pool falls back to on-demand generation
+            comp = self.cat.generate_competition()
+            self.assertEqual(comp.category, self.cat)
+            self.assertFalse(comp.is_pooled)
+            
+        self.assertEqual(Competition.objects.pooled().count(), 0)
+        self.assertEqual(Competition.votable.count(), 3)
+
+
+class LazyCompetitionTestCase(TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True, challenges=0, votes=0, wins=0)
+            
+    def test_present_for_category(self):
+        comp = Competition.objects.present_for_category(self.cat)
+        
+        self.assertIsNone(comp.pk)
+        self.assertEqual(Competition.objects.count(), 0)
+        self.assertEqual(set([comp.left, comp.right]), set(self.cands))
+        self.assertEqual(comp.category, self.cat)
+        self.assertIsNotNone(comp.token)
+        self.assertEqual(comp.left.challenges, 1)
+        for cand in Candidate.objects.all():
+            self.assertEqual(cand.challenges, 1)
+        
+    def test_generate_competition(self):
+        with override_settings(NOTORHOT_SETTINGS={ 'LAZY_COMPETITIONS': True, }):
+            comp = self.cat.generate_competition()
+        self.assertIsNone(comp.pk)
+        self.assertEqual(Competition.objects.count(), 0)
+        
+    def test_from_token(self):
+        comp = Competition.objects.present_for_category(self.cat)
+        rebuilt = Competition.objects.from_token(comp.token)
+        
+        self.assertIsNone(rebuilt.pk)
+        self.assertEqual(rebuilt.left, comp.left)
+        self.assertEqual(rebuilt.right, comp.right)
+        self.assertEqual(rebuilt.category_id, self.cat.pk)
+        self.assertEqual(rebuilt.lazy_key, comp.lazy_key)
+        self.assertEqual(rebuilt.date_presented, comp.date_presented)
+        
+        with self.assertRaises(Competition.InvalidToken):
+            Competition.objects.from_token(comp.token + 'x')
+            
+        with self.assertRaises(Competition.InvalidToken):
+            Competition.objects.from_token(signing.dumps([1, 2], 
+                salt=Competition.TOKEN_SALT))
+            
+        with self.assertRaises(Competition.InvalidToken):
+            Competition.objects.from_token('')
+            
+        token = comp.token
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'LAZY_COMPETITION_MAX_AGE': 60, }):
+            with patch('time.time', return_value=time.time() + 61):
+                with self.assertRaises(Competition.InvalidToken):
+                    Competition.objects.from_token(token)
+                    
+        comp.left.delete()
+        with self.assertRaises(Competition.InvalidToken):
+            Competition.objects.from_token(token)
+        
+    def test_record_vote(self):
+        comp = Competition.objects.present_for_category(self.cat)
+        token = comp.token
+        
+        rebuilt = Competition.objects.from_token(token)
+        rebuilt.record_vote(Competition.SIDES.LEFT)
+        
+        self.assertIsNotNone(rebuilt.pk)
+        saved = Competition.objects.get()
+        self.assertEqual(saved.winner, comp.left)
+        self.assertEqual(saved.winning_side, Competition.SIDES.LEFT)
+        self.assertIsNotNone(saved.date_voted)
+        self.assertEqual(saved.date_presented, comp.date_presented)
+        
+        left = Candidate.objects.get(pk=comp.left.pk)
+        self.assertEqual((left.challenges, left.votes, left.wins), (1, 1, 1))
+        right = Candidate.objects.get(pk=comp.right.pk)
+        self.assertEqual((right.challenges, right.votes, right.wins), (1, 1, 0))
+        
+        # reusing the token can't record a second vote
+        again = Competition.objects.from_token(token)
+        with self.assertRaises(Competition.AlreadyVoted):
+            again.record_vote(Competition.SIDES.RIGHT)
+            
+        self.assertEqual(Competition.objects.count(), 1)
+        right = Candidate.objects.get(pk=comp.right.pk)
+        self.assertEqual((right.challenges, right.votes, right.wins), (1, 1, 0))
+        
+        
+class PresentValuesTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory', slug='cat-slug')
+        self.cands = mixer.cycle(6).blend('notorhot.Candidate', 
+            category=self.cat, is_enabled=True, challenges=0)
+        CandidateIndex(self.cat.pk).build([cand.pk for cand in self.cands])
+        
+    def test_saved(self):
+        # values, insert, lazy_key read-back, one challenge increment
+        comps = self.assertNumDataQueries(4, 
+            Competition.objects.present_values_for_category, self.cat, 3)
+            
+        self.assertEqual(len(comps), 3)
+        self.assertEqual(Competition.objects.count(), 3)
+        seen = []
+        for comp in comps:
+            self.assertIsNone(comp['token'])
+            saved = Competition.objects.get(pk=comp['id'])
+            self.assertEqual((saved.left_id, saved.right_id), 
+                (comp['left']['id'], comp['right']['id']))
+            self.assertEqual(saved.category, self.cat)
+            seen.extend([saved.left_id, saved.right_id])
+            
+        # big enough category: no candidate is repeated
+        self.assertEqual(sorted(seen), sorted(cand.pk for cand in self.cands))
+        self.assertEqual(set(Candidate.objects.values_list('challenges', 
+            flat=True)), set([1]))
+        
+        cand = Candidate.objects.get(pk=comps[0]['left']['id'])
+        self.assertEqual(comps[0]['left'], { 'id': cand.pk, 
+            'name': cand.name, 'url': cand.get_absolute_url(), 
+            'thumbnail': None, })
+            
+    def test_lazy(self):
+        with override_settings(NOTORHOT_SETTINGS={ 'LAZY_COMPETITIONS': True, }):
+            comps = Competition.objects.present_values_for_category(self.cat, 
+                5)
+                
+        self.assertEqual(len(comps), 5)
+        self.assertEqual(Competition.objects.count(), 0)
+        for comp in comps:
+            self.assertIsNone(comp['id'])
+            rebuilt = Competition.objects.from_token(comp['token'])
+            self.assertEqual((rebuilt.left_id, rebuilt.right_id), 
+                (comp['left']['id'], comp['right']['id']))
+            self.assertNotEqual(rebuilt.left_id, rebuilt.right_id)
+            
+        # candidates repeat once there are too few to go round
+        challenges = Candidate.objects.values_list('challenges', flat=True)
+        self.assertEqual(sum(challenges), 10)
+        
+    def test_stale_index(self):
+        Candidate.objects.filter(pk=self.cands[0].pk).update(is_enabled=False)
+        comps = Competition.objects.present_values_for_category(self.cat, 3)
+        
+        self.assertTrue(1 <= len(comps) <= 3)
+        for comp in comps:
+            self.assertNotIn(self.cands[0].pk, (comp['left']['id'], 
+                comp['right']['id']))
+                
+    def test_insufficient_candidates(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        mixer.blend('notorhot.Candidate', category=cat)
+        with self.assertRaises(Candidate.DoesNotExist):
+            Competition.objects.present_values_for_category(cat, 3)
+                
+                
+class QueuedVoteTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = mixer.cycle(2).blend('notorhot.Candidate', 
+            category=self.cat, challenges=0, votes=0, wins=0)
+            
+    def test_enqueue(self):
+        comp = Competition.objects.generate_from_candidates(*self.cands)
+        queued = self.assertNumDataQueries(1, QueuedVote.objects.enqueue, 
+            comp, Competition.SIDES.LEFT)
+        self.assertEqual(queued.competition_id, comp.pk)
+        self.assertIsNone(Competition.objects.get(pk=comp.pk).date_voted)
+        
+        lazy = Competition.objects.present_for_category(self.cat)
+        queued = QueuedVote.objects.enqueue(lazy, Competition.SIDES.RIGHT)
+        self.assertIsNone(queued.competition_id)
+        self.assertEqual(queued.token, lazy.token)
+        
+    def test_is_full(self):
+        comp = Competition.objects.generate_from_candidates(*self.cands)
+        for i in range(3):
+            QueuedVote.objects.enqueue(comp, Competition.SIDES.LEFT)
+        self.assertTrue(QueuedVote.objects.is_full(3))
+        self.assertFalse(QueuedVote.objects.is_full(4))
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'VOTE_QUEUE_HIGH_WATER': 2, }):
+            self.assertTrue(QueuedVote.objects.is_full())
+            
+        # estimated without counting rows
+        self.assertNumDataQueries(2, QueuedVote.objects.is_full, 3)
+        QueuedVote.objects.order_by('id')[0].delete()
+        self.assertFalse(QueuedVote.objects.is_full(3))
+        QueuedVote.objects.all().delete()
+        self.assertFalse(QueuedVote.objects.is_full(1))
+            
+    def test_drain_batch(self):
+        comps = [Competition.objects.generate_from_candidates(*self.cands) 
+            for i in range(2)]
+        lazy = Competition.objects.present_for_category(self.cat)
+        QueuedVote.objects.enqueue(comps[0], Competition.SIDES.LEFT)
+        QueuedVote.objects.enqueue(comps[0], Competition.SIDES.RIGHT)
+        QueuedVote.objects.enqueue(lazy, Competition.SIDES.RIGHT)
+        QueuedVote.objects.enqueue(lazy, Competition.SIDES.LEFT)
+        QueuedVote.objects.enqueue(comps[1], Competition.SIDES.RIGHT)
+        
+        self.assertEqual(QueuedVote.objects.drain_batch(4), { 'ok': 2, 
+            'already_voted': 2, })
+        self.assertEqual(QueuedVote.objects.count(), 1)
+        self.assertEqual(Competition.objects.get(pk=comps[0].pk).winner, 
+            self.cands[0])
+        self.assertEqual(Competition.objects.get(lazy_key=lazy.lazy_key
+            ).winner, lazy.right)
+        
+        self.assertEqual(QueuedVote.objects.drain_batch(4), { 'ok': 1, })
+        self.assertEqual(QueuedVote.objects.drain_batch(4), {})
+        
+        votes = Candidate.objects.values_list('votes', flat=True)
+        self.assertEqual(list(votes), [3, 3])
+        
+    def test_drain_expired_token(self):
+        # tokens presented two hours ago, with votes queued 10 minutes and
+        # 90 minutes after
+        presented = time.time() - 2 * 60 * 60
+        with patch('django.core.signing.time.time', return_value=presented):
+            lazy = [Competition.objects.present_for_category(self.cat) 
+                for i in range(2)]
+            queued = [QueuedVote.objects.enqueue(comp, Competition.SIDES.LEFT)
+                for comp in lazy]
+        dates = [timezone.now() - datetime.timedelta(minutes=minutes) 
+            for minutes in (110, 30)]
+        for (vote, date_voted) in zip(queued, dates):
+            QueuedVote.objects.filter(pk=vote.pk).update(date_voted=date_voted)
+                
+        # judged by when each vote was queued, not when it's drained
+        with override_settings(NOTORHOT_SETTINGS={ 'COMPETITION_TTL': 3600, }):
+            self.assertEqual(QueuedVote.objects.drain_batch(), { 'ok': 1, 
+                'not_found': 1, })
+        comp = Competition.objects.get(lazy_key=lazy[0].lazy_key)
+        self.assertEqual(comp.winner, lazy[0].left)
+        self.assertEqual(comp.date_voted, dates[0])
+        
+    def test_drain_failure_keeps_votes(self):
+        comp = Competition.objects.generate_from_candidates(*self.cands)
+        QueuedVote.objects.enqueue(comp, Competition.SIDES.LEFT)
+        with patch.object(Competition.objects, 'record_votes_bulk', 
+                side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                QueuedVote.objects.drain_batch()
+        self.assertEqual(QueuedVote.objects.count(), 1)
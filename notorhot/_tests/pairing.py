@@ -0,0 +1,192 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from notorhot._tests.factories import mixer
+from notorhot._tests._utils import QueryCountMixin
+from notorhot.caching import get_notorhot_cache
+from notorhot import pairing
+from notorhot.pairing import AdaptivePairing, CategoryQueue, \
+    PairingStrategy, get_pairing_strategy
+from notorhot.models import Candidate, Competition
+
+
+class FixedPairing(PairingStrategy):
+    pair = None
+
+    def choose(self, category):
+        return self.pair
+
+
+class CategoryQueueTestCase(TestCase):
+    def setUp(self):
+        self.queue = CategoryQueue([(1, 3, 1500.0), (2, 0, 1400.0),
+            (3, 1, 1600.0), (4, 0, 1450.0), (5, 2, 1700.0)])
+
+    def test_least_challenged(self):
+        self.assertIn(self.queue.least_challenged(), (2, 4))
+        self.queue.add_challenge(2)
+        self.assertEqual(self.queue.least_challenged(), 4)
+        self.queue.add_challenge(4)
+        self.queue.add_challenge(4)
+        self.assertIn(self.queue.least_challenged(), (2, 3))
+        self.queue.add_challenge(3)
+        self.assertEqual(self.queue.least_challenged(), 2)
+        self.assertEqual(self.queue.challenges[4], 2)
+
+    def test_heap_rebuilt(self):
+        for i in range(30):
+            self.queue.add_challenge(1)
+        self.assertTrue(len(self.queue.heap) <= 4 * len(self.queue))
+        self.assertIn(self.queue.least_challenged(), (2, 4))
+
+    def test_nearest(self):
+        self.assertEqual(self.queue.nearest(1, 1), [4, 3])
+        self.assertEqual(self.queue.nearest(2, 2), [4, 1])
+
+        self.queue.set_rating(2, 1800.0)
+        self.assertEqual(self.queue.nearest(2, 1), [5])
+        self.assertEqual([pk for (rating, pk) in self.queue.by_rating],
+            [4, 1, 3, 5, 2])
+
+
+class AdaptivePairingTestCase(QueryCountMixin, TestCase):
+    def setUp(self):
+        get_notorhot_cache().clear()
+        pairing._strategies.clear()
+        self.cat = mixer.blend('notorhot.CandidateCategory')
+        self.cands = [mixer.blend('notorhot.Candidate', category=self.cat,
+            is_enabled=True, challenges=challenges, rating=rating)
+            for (challenges, rating) in ((5, 1500.0), (0, 1510.0),
+            (3, 1520.0), (1, 1900.0), (5, 1100.0))]
+
+    def tearDown(self):
+        pairing._strategies.clear()
+
+    def test_choose(self):
+        strategy = AdaptivePairing(neighbours=2, exploration=0, refresh=60)
+        # candidate queue loaded once, then kept in memory
+        pair = self.assertNumDataQueries(1, strategy.choose, self.cat)
+        # fewest challenges, then the least-challenged near it in rating
+        self.assertEqual(set(pair), set([self.cands[1].pk,
+            self.cands[3].pk]))
+
+        pair = self.assertNumDataQueries(0, strategy.choose, self.cat)
+        self.assertEqual(set(pair), set([self.cands[1].pk,
+            self.cands[3].pk]))
+
+        queue = strategy.queues[self.cat.pk]
+        self.assertEqual(queue.challenges[self.cands[1].pk], 2)
+
+    def test_refresh(self):
+        strategy = AdaptivePairing(neighbours=2, exploration=0, refresh=60)
+        strategy.choose(self.cat)
+        queue = strategy.queues[self.cat.pk]
+        queue.loaded = 0
+        
+        # while another thread reloads the stale queue, it's still used
+        strategy.loading.add(self.cat.pk)
+        self.assertNumDataQueries(0, strategy.choose, self.cat)
+        self.assertIs(strategy.queues[self.cat.pk], queue)
+        
+        strategy.loading.clear()
+        self.assertNumDataQueries(1, strategy.choose, self.cat)
+        self.assertIsNot(strategy.queues[self.cat.pk], queue)
+        self.assertEqual(strategy.loading, set())
+        
+    def test_max_candidates(self):
+        strategy = AdaptivePairing(max_candidates=2)
+        pair = strategy.choose(self.cat)
+        # only the least challenged are loaded
+        self.assertEqual(set(pair), set([self.cands[1].pk, self.cands[3].pk]))
+        self.assertEqual(len(strategy.queues[self.cat.pk]), 2)
+        
+    def test_without_ratings(self):
+        for (cand, win_pct) in zip(self.cands, (0.5, 0.2, 0.9, 0.3, 0.8)):
+            Candidate.objects.filter(pk=cand.pk).update(win_pct=win_pct)
+        with override_settings(NOTORHOT_SETTINGS={ 'ELO_RATINGS': False, }):
+            strategy = AdaptivePairing(neighbours=1, exploration=0)
+            # stored ratings are stale, so rivals are near in win percentage
+            pair = strategy.choose(self.cat)
+            self.assertEqual(set(pair), set([self.cands[1].pk, 
+                self.cands[3].pk]))
+                
+            strategy.record_votes(self.cat.pk, [(self.cands[3].pk,
+                self.cands[1].pk)])
+            queue = strategy.queues[self.cat.pk]
+            self.assertEqual(queue.ratings[self.cands[3].pk], 0.3)
+            
+    def test_no_neighbours(self):
+        with self.assertRaises(ValueError):
+            AdaptivePairing(neighbours=0)
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'ADAPTIVE_PAIRING_NEIGHBOURS': 0, }):
+            with self.assertRaises(ValueError):
+                AdaptivePairing()
+                
+    def test_exploration(self):
+        strategy = AdaptivePairing(neighbours=1, exploration=1.0)
+        seen = set()
+        for i in range(50):
+            (left, right) = strategy.choose(self.cat)
+            self.assertNotEqual(left, right)
+            seen.update([left, right])
+        self.assertEqual(seen, set(cand.pk for cand in self.cands))
+
+    def test_record_votes(self):
+        strategy = AdaptivePairing()
+        strategy.record_votes(self.cat.pk, [(self.cands[4].pk,
+            self.cands[3].pk)])
+        self.assertNotIn(self.cat.pk, strategy.queues)
+
+        strategy.choose(self.cat)
+        strategy.record_votes(self.cat.pk, [(self.cands[4].pk,
+            self.cands[3].pk), (self.cands[4].pk, 0)])
+        queue = strategy.queues[self.cat.pk]
+        self.assertTrue(queue.ratings[self.cands[4].pk] > 1100.0)
+        self.assertTrue(queue.ratings[self.cands[3].pk] < 1900.0)
+
+        strategy.invalidate(self.cat.pk)
+        self.assertNotIn(self.cat.pk, strategy.queues)
+
+    def test_insufficient_candidates(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        mixer.blend('notorhot.Candidate', category=cat)
+        self.assertIsNone(AdaptivePairing().choose(cat))
+
+    def test_generate_competition(self):
+        with override_settings(NOTORHOT_SETTINGS={
+                'PAIRING_STRATEGY': 'adaptive',
+                'ADAPTIVE_PAIRING_EXPLORATION': 0, }):
+            strategy = get_pairing_strategy()
+            self.assertIsInstance(strategy, AdaptivePairing)
+            self.assertIs(get_pairing_strategy(), strategy)
+
+            comp = self.cat.generate_competition()
+            self.assertIn(self.cands[1], (comp.left, comp.right))
+
+            # votes in this process reach the strategy
+            comp.record_vote(Competition.SIDES.LEFT)
+            queue = strategy.queues[self.cat.pk]
+            for cand in (comp.left, comp.right):
+                self.assertAlmostEqual(queue.ratings[cand.pk],
+                    Candidate.objects.get(pk=cand.pk).rating)
+            original = dict((cand.pk, cand.rating) for cand in self.cands)
+            self.assertTrue(queue.ratings[comp.left_id] >
+                original[comp.left_id])
+
+    def test_custom_strategy(self):
+        FixedPairing.pair = (self.cands[2].pk, self.cands[4].pk)
+        with override_settings(NOTORHOT_SETTINGS={ 'PAIRING_STRATEGY':
+                'notorhot._tests.pairing.FixedPairing', }):
+            comp = self.cat.generate_competition()
+            self.assertEqual((comp.left, comp.right), (self.cands[2],
+                self.cands[4]))
+
+            # stale choices fall back to random selection
+            FixedPairing.pair = (self.cands[2].pk, 0)
+            comp = self.cat.generate_competition()
+            self.assertNotEqual(comp.left, comp.right)
+
+            FixedPairing.pair = None
+            comp = self.cat.generate_competition()
+            self.assertEqual(comp.category, self.cat)
@@ -0,0 +1,146 @@
+from unittest import skipIf
+import datetime
+import math
+import random
+
+from django.test import TestCase
+from django.utils import timezone
+
+from notorhot._tests.factories import mixer
+from notorhot.models import Candidate, Competition, ArchivedCompetition
+
+try:
+    import numpy
+    from notorhot.strength import PairwiseCounts, fit_bradley_terry
+except ImportError:
+    numpy = None
+
+
+@skipIf(numpy is None, "NumPy is not installed")
+class BradleyTerryTestCase(TestCase):
+    def test_counts(self):
+        counts = PairwiseCounts([30, 10, 20])
+        self.assertEqual(counts.ids.tolist(), [10, 20, 30])
+        
+        self.assertEqual(counts.add([10, 30], [20, 10]), 2)
+        # unknown candidates and self-pairings are ignored
+        self.assertEqual(counts.add([20, 10, 99], [10, 10, 20]), 1)
+        self.assertEqual(counts.add([], []), 0)
+        
+        self.assertEqual(counts.num_votes, 3)
+        self.assertEqual(counts.wins.tolist(), [1, 1, 1])
+        (first, second, pair_counts) = counts.get_pairs()
+        self.assertEqual(sorted(zip(first.tolist(), second.tolist(), 
+            pair_counts.tolist())), [(0, 1, 2), (0, 2, 1)])
+        
+    def test_two_candidates(self):
+        counts = PairwiseCounts([1, 2])
+        counts.add([1, 1, 1, 2], [2, 2, 2, 1])
+        
+        # the maximum likelihood estimate: strengths in the ratio of wins
+        (strengths, iterations) = fit_bradley_terry(counts, prior=0)
+        self.assertAlmostEqual(strengths[0] - strengths[1], math.log(3), 
+            places=6)
+        self.assertAlmostEqual(strengths.sum(), 0.0)
+        
+        # the prior pulls the estimates towards each other
+        (strengths, iterations) = fit_bradley_terry(counts, prior=1.0)
+        self.assertGreater(strengths[0], strengths[1])
+        self.assertLess(strengths[0] - strengths[1], math.log(3))
+        
+    def test_opponents_count(self):
+        # 1 and 3 have each won two of three votes, but 1 beat 2, the 
+        # strongest candidate, and 3 only beat 4, the weakest
+        counts = PairwiseCounts([1, 2, 3, 4])
+        counts.add([1, 1, 4, 2, 2, 2, 3, 3], [2, 4, 1, 3, 4, 3, 4, 4])
+        (strengths, iterations) = fit_bradley_terry(counts)
+        self.assertGreater(strengths[0], strengths[2])
+        self.assertEqual(strengths.argmin(), 3)
+        
+    def test_never_won(self):
+        counts = PairwiseCounts([1, 2, 3])
+        counts.add([1, 1], [2, 2])
+        (strengths, iterations) = fit_bradley_terry(counts)
+        self.assertTrue(numpy.isfinite(strengths).all())
+        # a candidate without votes stays average
+        self.assertAlmostEqual(strengths[2], 0.0, places=6)
+        
+    def test_chunks_merge(self):
+        # most chunks bring new pairs, between and beside those seen so far
+        rand = random.Random(3)
+        votes = [rand.sample(range(200), 2) for i in range(3000)]
+        chunked = PairwiseCounts(range(200))
+        whole = PairwiseCounts(range(200))
+        for start in range(0, 3000, 50):
+            chunk = votes[start:start + 50]
+            chunked.add([a for (a, b) in chunk], [b for (a, b) in chunk])
+        whole.add([a for (a, b) in votes], [b for (a, b) in votes])
+        
+        self.assertEqual(chunked.pair_keys.tolist(), whole.pair_keys.tolist())
+        self.assertEqual(chunked.pair_counts.tolist(), 
+            whole.pair_counts.tolist())
+        self.assertEqual(chunked.pair_counts.sum(), 3000)
+        
+    def test_recovers_strengths(self):
+        rand = random.Random(7)
+        true = [rand.gauss(0, 1) for i in range(20)]
+        chunked = PairwiseCounts(range(20))
+        whole = PairwiseCounts(range(20))
+        (winners, losers) = ([], [])
+        for i in range(10000):
+            (a, b) = rand.sample(range(20), 2)
+            if rand.random() < 1.0 / (1.0 + math.exp(true[b] - true[a])):
+                (a, b) = (a, b)
+            else:
+                (a, b) = (b, a)
+            winners.append(a)
+            losers.append(b)
+        for start in range(0, 10000, 1000):
+            chunked.add(winners[start:start + 1000], losers[start:start + 1000])
+        whole.add(winners, losers)
+        
+        # chunked accumulation gives the same summary
+        self.assertEqual(chunked.wins.tolist(), whole.wins.tolist())
+        self.assertEqual(chunked.pair_counts.tolist(), 
+            whole.pair_counts.tolist())
+        
+        (strengths, iterations) = fit_bradley_terry(chunked)
+        true = numpy.array(true) - numpy.mean(true)
+        self.assertLess(numpy.abs(strengths - true).max(), 0.3)
+        self.assertLess(iterations, 1000)
+        
+        
+@skipIf(numpy is None, "NumPy is not installed")
+class FitStrengthsTestCase(TestCase):
+    def test_fit(self):
+        cat = mixer.blend('notorhot.CandidateCategory')
+        (a, b, c) = mixer.cycle(3).blend('notorhot.Candidate', category=cat)
+        other = mixer.blend('notorhot.Candidate')
+        
+        for (left, right, side) in ((a, b, Competition.SIDES.LEFT), 
+                (a, b, Competition.SIDES.LEFT), (b, c, Competition.SIDES.LEFT),
+                (c, a, Competition.SIDES.RIGHT)):
+            comp = Competition.objects.generate_from_candidates(left, right)
+            comp.record_vote(side)
+        # unvoted and archived competitions
+        Competition.objects.generate_from_candidates(c, b)
+        comp = Competition.objects.generate_from_candidates(b, c)
+        comp.record_vote(Competition.SIDES.LEFT)
+        Competition.objects.archive_voted_batch(timezone.now() + 
+            datetime.timedelta(seconds=1), batch_size=10)
+        self.assertEqual(ArchivedCompetition.objects.count(), 5)
+            
+        with self.assertNumQueries(8):
+            # candidates; competitions (none voted); archive in 2 chunks, then
+            # an empty read; savepoint, UPDATE, release
+            self.assertEqual(Candidate.objects.fit_strengths(cat, 
+                chunk_size=3)[:2], (3, 5))
+        
+        strengths = dict(Candidate.objects.values_list('id', 'strength'))
+        self.assertGreater(strengths[a.pk], strengths[b.pk])
+        self.assertGreater(strengths[b.pk], strengths[c.pk])
+        self.assertAlmostEqual(sum(strengths[cand.pk] for cand in (a, b, c)),
+            0.0)
+        self.assertEqual(strengths[other.pk], 0.0)
+        self.assertEqual(list(Candidate.objects.for_category(cat
+            ).order_by_strength()), [a, b, c])
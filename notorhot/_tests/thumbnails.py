@@ -0,0 +1,84 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mock import patch
+
+from notorhot._tests.factories import mixer
+from notorhot.models import Candidate
+from notorhot.thumbnails import ThumbnailWorker, generate_thumbnails, \
+    has_thumbnails, pregenerate_thumbnails
+
+
+class ThumbnailPregenerationTestCase(TestCase):
+    def setUp(self):
+        self.cand = mixer.blend('notorhot.Candidate', pic='candidates/a.jpg')
+        self.storage = Candidate._meta.get_field('pic').storage
+        
+    def save_upload(self, cand):
+        # as the admin saves an upload, but without writing to MEDIA_ROOT
+        cand.pic = SimpleUploadedFile('new.jpg', 'data')
+        with patch.object(self.storage, 'save', 
+                return_value='candidates/new.jpg'):
+            cand.save()
+            
+    @patch('notorhot.thumbnails.get_thumbnail')
+    def test_generate(self, mock_get):
+        self.assertEqual(generate_thumbnails(self.cand.pic), 3)
+        self.assertEqual([call[0][1:] for call in mock_get.call_args_list],
+            [('300x300',), ('300x600',), ('60x60',)])
+        self.assertEqual(mock_get.call_args_list[0][1], { 'crop': 'center', })
+        
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'THUMBNAIL_GEOMETRIES': [('100x100', {}),], }):
+            self.assertEqual(generate_thumbnails(self.cand.pic), 1)
+            
+    @patch('notorhot.thumbnails.get_cached_thumbnail')
+    def test_has_thumbnails(self, mock_get):
+        mock_get.return_value = object()
+        self.assertTrue(has_thumbnails(self.cand.pic))
+        mock_get.side_effect = [object(), None, object()]
+        self.assertFalse(has_thumbnails(self.cand.pic))
+    
+    @patch('notorhot.thumbnails.generate_thumbnails')
+    def test_disabled(self, mock_generate):
+        self.save_upload(self.cand)
+        self.assertFalse(pregenerate_thumbnails(self.cand.pic))
+        self.assertFalse(mock_generate.called)
+        
+    @patch('notorhot.thumbnails.generate_thumbnails')
+    def test_new_pic(self, mock_generate):
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'THUMBNAIL_PREGENERATION': 'sync', }):
+            # unchanged pictures aren't regenerated
+            self.cand.name = 'Renamed'
+            self.cand.save()
+            self.assertFalse(mock_generate.called)
+            
+            self.save_upload(self.cand)
+            
+        mock_generate.assert_called_once_with(self.cand.pic)
+        self.assertEqual(self.cand.pic.name, 'candidates/new.jpg')
+        
+    @patch('notorhot.thumbnails.ThumbnailWorker.add')
+    def test_thread(self, mock_add):
+        with override_settings(NOTORHOT_SETTINGS={ 
+                'THUMBNAIL_PREGENERATION': 'thread', }):
+            self.save_upload(self.cand)
+        mock_add.assert_called_once_with(self.cand.pic)
+        
+    @patch('notorhot.thumbnails.generate_thumbnails')
+    def test_worker(self, mock_generate):
+        mock_generate.side_effect = [IOError('broken'), 3]
+        worker = ThumbnailWorker()
+        with patch('notorhot.thumbnails.logger') as mock_logger:
+            worker.add('candidates/broken.jpg')
+            worker.add(self.cand.pic)
+            worker.queue.join()
+            
+        self.assertTrue(worker.thread.daemon)
+        self.assertEqual([call[0][0].name for call in 
+            mock_generate.call_args_list], 
+            ['candidates/broken.jpg', 'candidates/a.jpg'])
+        # a failure is logged and doesn't stop the worker
+        self.assertEqual(mock_logger.exception.call_count, 1)
@@ -1,17 +1,205 @@
+import datetime
+import re
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.db.models import Q, Sum
+from django.utils.datastructures import SortedDict
+from django.utils.formats import date_format
+from django.utils.html import escape, format_html
+from django.utils.translation import ugettext as _, ugettext_lazy as _l
 
 from sorl.thumbnail.admin import AdminImageMixin
 
-from notorhot.models import Competition, Candidate, CandidateCategory
+from notorhot.models import Competition, Candidate, CandidateCategory, \
+    DailyVoteCount
+from notorhot.thumbnails import get_cached_thumbnail
+
 
+def estimate_count(queryset, exact_below=10000):
+    """
+    Counts an unfiltered queryset from the table statistics kept by 
+    PostgreSQL or MySQL, rather than with ``COUNT(*)``, which has to scan the 
+    whole table.  Filtered querysets, other backends, and estimates below 
+    ``exact_below`` (where statistics are least reliable and counting is 
+    cheap) are counted exactly.
+    
+    :rtype: integer
+    """
+    query = queryset.query
+    if query.where.children or query.having.children or query.distinct or \
+            query.low_mark or query.high_mark is not None:
+        return queryset.count()
+        
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'mysql':
+        sql = ('SELECT table_rows FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s')
+    else:
+        return queryset.count()
+        
+    cursor = connection.cursor()
+    cursor.execute(sql, [table])
+    row = cursor.fetchone()
+    if row is None or row[0] is None or int(row[0]) < exact_below:
+        return queryset.count()
+    return int(row[0])
+    
 
+class EstimatedCountPaginator(Paginator):
+    """
+    :class:`Paginator` whose count comes from :func:`estimate_count`.
+    """
+    def _get_count(self):
+        if self._count is None:
+            self._count = estimate_count(self.object_list)
+        return self._count
+    count = property(_get_count)
+    
+    
+class EstimatedCountChangeList(ChangeList):
+    """
+    :class:`ChangeList` that also estimates the unfiltered total it shows 
+    alongside filtered results, using the admin's paginator.
+    """
+    class EstimatedTotal(object):
+        def __init__(self, paginator):
+            self.paginator = paginator
+            
+        def count(self):
+            return self.paginator.count
+    
+    def get_results(self, request):
+        # ChangeList.get_results() counts root_queryset whenever filters or a
+        # search are applied
+        root_queryset = self.root_queryset
+        self.root_queryset = self.EstimatedTotal(self.model_admin.get_paginator(
+            request, root_queryset, self.list_per_page))
+        try:
+            super(EstimatedCountChangeList, self).get_results(request)
+        finally:
+            self.root_queryset = root_queryset
+            
+            
+class VoteDateListFilter(admin.SimpleListFilter):
+    """
+    Drills down through the years, months and days on which votes were cast.
+    Unlike ``date_hierarchy``, which scans the competition table for 
+    distinct dates, choices are read from the per-day 
+    :class:`~notorhot.models.DailyVoteCount` totals (see the 
+    ``refresh_vote_counts`` management command); the chosen range is then 
+    read from the ``date_voted`` index.
+    """
+    title = _l(u"date voted")
+    parameter_name = 'voted'
+    value_re = re.compile(r'^(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?$')
+    
+    def get_range(self):
+        """
+        :returns: ``(start, end, level)`` for the selected year (level 1), 
+            month (2) or day (3), or ``None`` if nothing valid is selected
+        """
+        match = self.value_re.match(self.value() or '')
+        if match is None:
+            return None
+            
+        parts = [int(part) for part in match.groups() if part is not None]
+        try:
+            start = datetime.date(*(parts + [1] * (3 - len(parts))))
+        except ValueError:
+            return None
+            
+        if len(parts) == 1:
+            end = datetime.date(start.year + 1, 1, 1)
+        elif len(parts) == 2:
+            end = (start + datetime.timedelta(days=31)).replace(day=1)
+        else:
+            end = start + datetime.timedelta(days=1)
+        return (start, end, len(parts))
+        
+    def lookups(self, request, model_admin):
+        selected = self.get_range()
+        lookups = []
+        days = DailyVoteCount.objects.all()
+        level = 0
+        
+        if selected is not None:
+            (start, end, level) = selected
+            # show the way back up
+            lookups.append((start.strftime('%Y'), start.strftime('%Y')))
+            if level > 1:
+                lookups.append((start.strftime('%Y-%m'), 
+                    date_format(start, 'YEAR_MONTH_FORMAT')))
+                    
+            # a selected day lists the other days of its month
+            if level == 3:
+                start = start.replace(day=1)
+                end = (start + datetime.timedelta(days=31)).replace(day=1)
+                level = 2
+            days = days.filter(day__gte=start, day__lt=end)
+            
+        key_format = ('%Y', '%Y-%m', '%Y-%m-%d')[level]
+        totals = SortedDict()
+        for (day, votes) in days.values_list('day').annotate(Sum('votes')
+                ).order_by('day'):
+            totals.setdefault(day.strftime(key_format), [day, 0])[1] += votes
+            
+        label_format = ('%Y', 'YEAR_MONTH_FORMAT', 'MONTH_DAY_FORMAT')[level]
+        for (key, (day, votes)) in totals.items():
+            label = day.strftime(label_format) if level == 0 else \
+                date_format(day, label_format)
+            lookups.append((key, u"%s (%d)" % (label, votes)))
+        return lookups
+        
+    def queryset(self, request, queryset):
+        selected = self.get_range()
+        if selected is None:
+            return queryset
+            
+        (start, end, level) = selected
+        return queryset.filter(
+            date_voted__gte=DailyVoteCount.objects.get_day_bounds(start)[0],
+            date_voted__lt=DailyVoteCount.objects.get_day_bounds(end)[0])
+            
+    
 class CompetitionAdmin(admin.ModelAdmin):
     list_display = ('__unicode__', 'category', 'date_presented', 'date_voted', 
         'winner',)
-    date_hierarchy = 'date_voted'
-    list_filter = ('category',)
-    search_fields = ('left__name', 'right__name',)
+    list_select_related = ('left', 'right', 'winner', 'category',)
+    list_filter = (VoteDateListFilter, 'category',)
+    # only prefix matches; see get_search_results()
+    search_fields = ('^left__name', '^right__name',)
     raw_id_fields = ('left', 'right', 'winner', 'category',)
+    paginator = EstimatedCountPaginator
+    # most candidates matched by a search
+    max_search_candidates = 1000
+    
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+        
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Finds competitions in which either candidate's name starts with the 
+        search term.  Matching is case-sensitive, so that it can use the 
+        index on candidate names, and matching candidates are looked up 
+        first, so that competitions are then found through their ``left`` and
+        ``right`` indexes rather than a join.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return (queryset, False)
+            
+        candidate_ids = list(Candidate.objects.filter(
+            name__startswith=search_term).values_list('id', flat=True
+            )[:self.max_search_candidates])
+        return (queryset.filter(Q(left__in=candidate_ids) | 
+            Q(right__in=candidate_ids)), False)
     
 
 class CompetitionInline(admin.TabularInline):
@@ -28,24 +216,65 @@ class RightCompetitionInline(CompetitionInline):
     extra = 0
 
 class CandidateAdmin(AdminImageMixin, admin.ModelAdmin):    
-    list_display = ('__unicode__', 'pic', 'category', 'is_enabled', 
+    list_display = ('__unicode__', 'thumbnail', 'category', 'is_enabled', 
         'challenges', 'votes', 'wins',)
+    list_select_related = ('category',)
     date_hierarchy = 'added'
     search_fields = ('name',)
     list_filter = ('is_enabled', 'category',)
     raw_id_fields = ('category',)
+    thumbnail_geometry = '60x60'
+    
+    def thumbnail(self, obj):
+        """
+        Shows the candidate's thumbnail if it has already been generated (see
+        :func:`~notorhot.thumbnails.get_cached_thumbnail`), so listing 
+        candidates never opens their images; otherwise, the file name.
+        """
+        if not obj.pic:
+            return u''
+        thumb = get_cached_thumbnail(obj.pic, self.thumbnail_geometry, 
+            crop='center')
+        if thumb is None:
+            return escape(obj.pic.name)
+        return format_html(u'<img src="{0}" width="{1}" height="{2}" alt="" />',
+            thumb.url, thumb.width, thumb.height)
+    thumbnail.allow_tags = True
+    thumbnail.short_description = _l(u"Pic")
     
-
-class CandidateInline(AdminImageMixin, admin.StackedInline):
-    model = Candidate
-    inline_classes = ('grp-collapse grp-open',)
-
 
 class CategoryAdmin(admin.ModelAdmin):
-    inlines = [CandidateInline,]
-    list_display = ('__unicode__', 'is_public', 'num_voted_competitions')
+    # candidates are edited on their own (paginated) changelist, linked from
+    # here, as an inline would load every candidate in the category
+    list_display = ('__unicode__', 'is_public', 'candidates', 
+        'num_voted_competitions')
     list_filter = ('is_public',)
     search_fields = ('name',)
+    readonly_fields = ('candidates',)
+    
+    def get_queryset(self, request):
+        return super(CategoryAdmin, self).get_queryset(request).with_counts()
+        
+    def candidates(self, obj):
+        """
+        Number of enabled candidates, linked to the candidate changelist 
+        filtered to the category, plus a link to add a candidate to it.
+        """
+        if obj.pk is None:
+            return u''
+        return format_html(u'<a href="{0}?category__id__exact={1}">{2}</a> '
+            u'(<a href="{3}?category={1}">{4}</a>)', 
+            reverse('admin:notorhot_candidate_changelist'), obj.pk, 
+            obj.num_candidates, reverse('admin:notorhot_candidate_add'), 
+            _(u"add"))
+    candidates.allow_tags = True
+    candidates.short_description = _l(u"Candidates")
+    candidates.admin_order_field = '_num_candidates'
+    
+    def num_voted_competitions(self, obj):
+        return obj.num_voted_competitions
+    num_voted_competitions.short_description = _l(u"Competitions voted in")
+    num_voted_competitions.admin_order_field = '_num_voted_competitions'
 
 
 admin.site.register(Competition, CompetitionAdmin)
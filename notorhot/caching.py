@@ -0,0 +1,487 @@
+from collections import OrderedDict
+import random
+import threading
+import time
+import uuid
+
+from django.core.cache import get_cache
+
+from notorhot.conf import get_notorhot_setting
+
+
+_caches = {}
+
+def get_notorhot_cache():
+    """
+    Retrieves the Django cache backend used by django-notorhot, as named by
+    ``settings.NOTORHOT_SETTINGS['CACHE_ALIAS']`` (defaults to ``"default"``).
+    Backends are created once per alias and then reused.
+
+    This should be a cache shared by all worker processes (e.g. memcached) in
+    any multi-process deployment.
+    """
+    alias = get_notorhot_setting('CACHE_ALIAS', 'default')
+    if alias not in _caches:
+        _caches[alias] = get_cache(alias)
+    return _caches[alias]
+
+
+class CandidateIndex(object):
+    """
+    Cached list of the IDs of all enabled
+    :class:`~notorhot.models.Candidate` instances in a single
+    :class:`~notorhot.models.CandidateCategory`, from which random IDs can be
+    drawn without sorting or scanning the candidate table.
+
+    The index is stored as a pointer key (holding a build token and the number
+    of IDs) plus fixed-size buckets of IDs keyed by that token, so drawing IDs
+    costs two cache round trips no matter how large the category is.
+    Invalidating the index simply deletes the pointer; buckets from old builds
+    are left to expire.
+
+    :param category_id: primary key of the category to be indexed
+    """
+    bucket_size = 1000
+    key_prefix = 'notorhot:candidate_index'
+
+    def __init__(self, category_id):
+        self.category_id = category_id
+        self.cache = get_notorhot_cache()
+        self.timeout = get_notorhot_setting('CANDIDATE_INDEX_TIMEOUT',
+            60 * 60 * 24)
+
+    @property
+    def pointer_key(self):
+        return '%s:%s' % (self.key_prefix, self.category_id)
+
+    def get_bucket_key(self, token, bucket):
+        return '%s:%s:%s' % (self.pointer_key, token, bucket)
+
+    def build(self, ids):
+        """
+        Stores a new index containing ``ids``, replacing any existing index
+        for the category.
+
+        :param ids: iterable of candidate IDs; may be a lazy iterator
+        :returns: number of IDs stored
+        :rtype: integer
+        """
+        token = uuid.uuid4().hex
+        count = 0
+        bucket = []
+
+        for candidate_id in ids:
+            bucket.append(candidate_id)
+            count += 1
+            if len(bucket) == self.bucket_size:
+                self.cache.set(self.get_bucket_key(token,
+                    (count - 1) // self.bucket_size), bucket, self.timeout)
+                bucket = []
+
+        if bucket:
+            self.cache.set(self.get_bucket_key(token,
+                (count - 1) // self.bucket_size), bucket, self.timeout)
+
+        self.cache.set(self.pointer_key, (token, count), self.timeout)
+        return count
+
+    def build_and_sample(self, ids, k=2):
+        """
+        Stores a new index containing ``ids`` (see :meth:`build`), and draws
+        ``k`` distinct IDs at random from them as they are stored, so that 
+        IDs are drawn even if the cache doesn't keep the index (e.g. a dummy
+        cache, or one that evicts it at once).
+
+        :param ids: iterable of candidate IDs; may be a lazy iterator
+        :returns: list of ``k`` IDs, or fewer if there are fewer than ``k``
+        :rtype: list
+        """
+        sample = []
+
+        def reservoir(ids):
+            for (position, candidate_id) in enumerate(ids):
+                if position < k:
+                    sample.append(candidate_id)
+                else:
+                    replaced = random.randint(0, position)
+                    if replaced < k:
+                        sample[replaced] = candidate_id
+                yield candidate_id
+
+        self.build(reservoir(ids))
+        random.shuffle(sample)
+        return sample
+
+    def invalidate(self):
+        """
+        Discards the index, forcing a rebuild on next use.
+        """
+        self.cache.delete(self.pointer_key)
+
+    def sample(self, k=2):
+        """
+        Draws ``k`` distinct IDs at random from the index.
+
+        :returns: list of ``k`` IDs; a shorter list if the index holds fewer
+            than ``k`` IDs; or ``None`` if the index has not been built (or
+            some part of it has been evicted from the cache).
+        :rtype: list
+        """
+        pointer = self.cache.get(self.pointer_key)
+        if pointer is None:
+            return None
+
+        (token, count) = pointer
+        positions = random.sample(xrange(count), min(k, count))
+
+        keys = dict((position, self.get_bucket_key(token,
+            position // self.bucket_size)) for position in positions)
+        buckets = self.cache.get_many(set(keys.values()))
+
+        ids = []
+        for position in positions:
+            bucket = buckets.get(keys[position])
+            if bucket is None:
+                return None
+            ids.append(bucket[position % self.bucket_size])
+
+        return ids
+
+
+class LeaderboardCache(object):
+    """
+    Cache of computed leaderboards for a single
+    :class:`~notorhot.models.CandidateCategory`.
+
+    Entries are tagged with the category's current version, a token that is
+    replaced (via :meth:`bump`) whenever a vote is recorded or a candidate is
+    added, changed, or removed.  An entry whose version is out of date is
+    still served until it is ``settings.NOTORHOT_SETTINGS['LEADERBOARD_MIN_REFRESH']``
+    seconds old (default 10), so a burst of votes causes at most one recompute
+    per interval.  Only the worker that wins a short-lived lock recomputes an
+    entry; other workers keep serving the stale entry meanwhile.
+
+    Caching is disabled unless
+    ``settings.NOTORHOT_SETTINGS['LEADERBOARD_CACHE_TIMEOUT']`` is set.
+
+    :param category_id: primary key of the category
+    """
+    key_prefix = 'notorhot:leaderboard'
+    lock_timeout = 30
+
+    def __init__(self, category_id):
+        self.category_id = category_id
+        self.cache = get_notorhot_cache()
+        self.timeout = get_notorhot_setting('LEADERBOARD_CACHE_TIMEOUT', None)
+        self.min_refresh = get_notorhot_setting('LEADERBOARD_MIN_REFRESH', 10)
+
+    @property
+    def is_enabled(self):
+        return bool(self.timeout)
+
+    @property
+    def version_key(self):
+        return '%s:%s:version' % (self.key_prefix, self.category_id)
+
+    def get_entry_key(self, variant):
+        return '%s:%s:%s' % (self.key_prefix, self.category_id, variant)
+
+    def get_lock_key(self, variant):
+        return '%s:lock' % self.get_entry_key(variant)
+
+    def bump(self):
+        """
+        Marks all cached leaderboards for the category as out of date.
+
+        :returns: the new version, or ``None`` if caching is disabled
+        """
+        if not self.is_enabled:
+            return None
+        version = uuid.uuid4().hex
+        self.cache.set(self.version_key, version, self.timeout)
+        return version
+
+    def get_version(self):
+        """
+        :returns: the category's current version, or ``None`` if caching is
+            disabled
+        """
+        if not self.is_enabled:
+            return None
+        version = self.cache.get(self.version_key)
+        if version is None:
+            version = self.bump()
+        return version
+
+    def get(self, variant, compute):
+        """
+        Retrieves a leaderboard, recomputing it if necessary.
+
+        :param variant: string distinguishing leaderboards for the same
+            category (e.g. by ranking and length)
+        :param compute: callable, taking no arguments, that returns the
+            leaderboard; the result must be picklable
+        """
+        if not self.is_enabled:
+            return compute()
+
+        version = self.get_version()
+        entry_key = self.get_entry_key(variant)
+        entry = self.cache.get(entry_key)
+        now = time.time()
+
+        if entry is not None:
+            (entry_version, computed_at, value) = entry
+            if entry_version == version or \
+                    now - computed_at < self.min_refresh:
+                return value
+
+        lock_key = self.get_lock_key(variant)
+        if not self.cache.add(lock_key, True, self.lock_timeout):
+            # another worker is recomputing
+            if entry is not None:
+                return entry[2]
+            return compute()
+
+        try:
+            value = compute()
+            # tagged with the version read before computing, so that votes 
+            # recorded in the meantime are picked up by the next refresh
+            self.cache.set(entry_key, (version, now, value), self.timeout)
+        finally:
+            self.cache.delete(lock_key)
+        return value
+
+
+_instance_caches = {}
+
+def get_instance_cache(model):
+    """
+    Retrieves the :class:`InstanceCache` for ``model``.  Caches are created 
+    once per model and then reused, so each process keeps a single local LRU 
+    per model.
+    """
+    label = '%s.%s' % (model._meta.app_label, model._meta.object_name.lower())
+    if label not in _instance_caches:
+        _instance_caches[label] = InstanceCache(model)
+    return _instance_caches[label]
+
+
+def get_related_instance(instance, field_name):
+    """
+    Follows the foreign key ``field_name`` of ``instance`` through the 
+    related model's :class:`InstanceCache`, unless the related instance has 
+    already been loaded (e.g. by ``select_related()``).  The result is kept 
+    on ``instance``, so later access to the attribute costs nothing.
+    """
+    field = instance._meta.get_field(field_name)
+    cache_name = field.get_cache_name()
+    if not hasattr(instance, cache_name):
+        related = get_instance_cache(field.rel.to).get(
+            getattr(instance, field.attname))
+        setattr(instance, cache_name, related)
+    return getattr(instance, cache_name)
+
+
+class InstanceCache(object):
+    """
+    Read-through cache of the instances of a model with a unique ``slug`` 
+    field, looked up by primary key or by slug.  Lookups are answered from a
+    least-recently-used dictionary in the current process, then from the 
+    shared cache (see :func:`get_notorhot_cache`), and only then from the 
+    database.
+
+    Instances are cached as dictionaries of their field values (instances of
+    models with a ``FieldTracker`` can't be pickled) and rebuilt on each 
+    lookup, so callers never share an instance.  Slugs map to primary keys, 
+    and a slug lookup is only answered from the cache if the cached instance 
+    still has that slug.
+
+    Caching is disabled unless 
+    ``settings.NOTORHOT_SETTINGS['INSTANCE_CACHE_TIMEOUT']`` is set.  The 
+    local LRU holds up to ``settings.NOTORHOT_SETTINGS['INSTANCE_CACHE_SIZE']``
+    entries (default 1000; 0 disables it) for up to 
+    ``settings.NOTORHOT_SETTINGS['INSTANCE_CACHE_LOCAL_TIMEOUT']`` seconds 
+    (default 5).  :meth:`invalidate` (called when an instance is saved or 
+    deleted) clears the shared cache and this process's LRU; other 
+    processes may serve their local copy until it times out.
+
+    Counter fields updated in bulk (e.g. :attr:`~notorhot.models.Candidate.votes`)
+    don't send signals, so cached values may lag the database by up to 
+    the shared timeout.
+
+    Read-through fills only add entries that aren't in the shared cache, and
+    :meth:`invalidate` replaces entries with a marker for 
+    :attr:`invalidation_timeout` seconds rather than deleting them; so a 
+    lookup that read a row just before it was saved can't cache the old 
+    row after the invalidation.
+
+    Lookups are counted in :attr:`stats`, as ``'local'`` and ``'shared'`` 
+    hits and ``'misses'``, to help size the cache.
+
+    :param model: model class whose instances are cached
+    """
+    key_prefix = 'notorhot:instance'
+    # stored in place of invalidated entries, which can't be filled until it
+    # expires; longer than any lookup should take between query and fill
+    invalidated = 'invalidated'
+    invalidation_timeout = 10
+
+    def __init__(self, model):
+        self.model = model
+        self.label = '%s.%s' % (model._meta.app_label, 
+            model._meta.object_name.lower())
+        self.cache = get_notorhot_cache()
+        self.lock = threading.Lock()
+        self.local = OrderedDict()
+        self.reset_stats()
+
+    @property
+    def timeout(self):
+        return get_notorhot_setting('INSTANCE_CACHE_TIMEOUT', None)
+
+    @property
+    def is_enabled(self):
+        return bool(self.timeout)
+
+    def get_key(self, field_name, value):
+        return '%s:%s:%s:%s' % (self.key_prefix, self.label, field_name, value)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = { 'local': 0, 'shared': 0, 'misses': 0, }
+
+    def count(self, level):
+        with self.lock:
+            self.stats[level] += 1
+
+    def clear_local(self):
+        """
+        Empties this process's LRU.
+        """
+        with self.lock:
+            self.local.clear()
+
+    def get_local(self, key):
+        with self.lock:
+            entry = self.local.pop(key, None)
+            if entry is None:
+                return None
+            (expires, value) = entry
+            if expires < time.time():
+                return None
+            # most recently used entries are kept at the end
+            self.local[key] = entry
+            return value
+
+    def set_local(self, items):
+        size = get_notorhot_setting('INSTANCE_CACHE_SIZE', 1000)
+        if not size:
+            return
+        expires = time.time() + get_notorhot_setting(
+            'INSTANCE_CACHE_LOCAL_TIMEOUT', 5)
+        with self.lock:
+            for (key, value) in items.items():
+                self.local.pop(key, None)
+                self.local[key] = (expires, value)
+            while len(self.local) > size:
+                self.local.popitem(last=False)
+
+    def lookup(self, key):
+        """
+        :returns: ``(value, level)`` for a key, where ``level`` is 
+            ``'local'`` or ``'shared'``; or ``(None, None)`` if neither cache
+            holds it
+        """
+        value = self.get_local(key)
+        if value is not None:
+            return (value, 'local')
+        value = self.cache.get(key)
+        if value is not None and value != self.invalidated:
+            self.set_local({ key: value, })
+            return (value, 'shared')
+        return (None, None)
+
+    def get_row(self, instance):
+        return dict((field.attname, getattr(instance, field.attname)) 
+            for field in self.model._meta.concrete_fields)
+
+    def build(self, row):
+        instance = self.model(**row)
+        instance._state.adding = False
+        instance._state.db = self.model._default_manager.db
+        return instance
+
+    def store(self, instance, replace=False):
+        """
+        Caches ``instance`` by primary key and by slug, in the shared cache 
+        only where it holds no entry (neither a copy nor an invalidation 
+        marker) unless ``replace`` is set.
+        """
+        row = self.get_row(instance)
+        items = {
+            self.get_key('pk', instance.pk): row,
+            self.get_key('slug', instance.slug): instance.pk,
+        }
+        if replace:
+            self.cache.set_many(items, self.timeout)
+        else:
+            items = dict((key, value) for (key, value) in items.items()
+                if self.cache.add(key, value, self.timeout))
+        self.set_local(items)
+
+    def fetch(self, replace=False, **kwargs):
+        self.count('misses')
+        instance = self.model._default_manager.get(**kwargs)
+        self.store(instance, replace)
+        return instance
+
+    def get(self, pk):
+        """
+        :returns: the instance with primary key ``pk``
+        :raises: the model's :exc:`DoesNotExist` if there is none
+        """
+        if not self.is_enabled:
+            return self.model._default_manager.get(pk=pk)
+
+        (row, level) = self.lookup(self.get_key('pk', pk))
+        if row is None:
+            return self.fetch(pk=pk)
+        self.count(level)
+        return self.build(row)
+
+    def get_by_slug(self, slug):
+        """
+        :returns: the instance whose slug is ``slug``
+        :raises: the model's :exc:`DoesNotExist` if there is none
+        """
+        if not self.is_enabled:
+            return self.model._default_manager.get(slug=slug)
+
+        (pk, pk_level) = self.lookup(self.get_key('slug', slug))
+        if pk is not None:
+            (row, level) = self.lookup(self.get_key('pk', pk))
+            if row is None:
+                # evicted or invalidated: only fill where nothing is cached
+                return self.fetch(slug=slug)
+            if row['slug'] == slug:
+                # counted at the slower of the two levels consulted
+                self.count('shared' if 'shared' in (pk_level, level) 
+                    else 'local')
+                return self.build(row)
+            # the slug has changed without an invalidation, so the cached 
+            # entries are known to be stale
+            return self.fetch(replace=True, slug=slug)
+        return self.fetch(slug=slug)
+
+    def invalidate(self, instance):
+        """
+        Discards cached copies of ``instance``, by primary key and by slug.
+        """
+        keys = [self.get_key('pk', instance.pk), 
+            self.get_key('slug', instance.slug)]
+        self.cache.set_many(dict((key, self.invalidated) for key in keys), 
+            self.invalidation_timeout)
+        with self.lock:
+            for key in keys:
+                self.local.pop(key, None)
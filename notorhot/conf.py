@@ -0,0 +1,15 @@
+from django.conf import settings
+
+
+def get_notorhot_setting(name, default=None):
+    """
+    Retrieves a single value from the ``settings.NOTORHOT_SETTINGS``
+    dictionary.
+
+    :param string name: key to look up in ``settings.NOTORHOT_SETTINGS``
+    :param default: value to return if ``settings.NOTORHOT_SETTINGS`` is not
+        defined or does not contain ``name``
+    :returns: the configured value, or ``default``
+    """
+    notorhot_settings = getattr(settings, 'NOTORHOT_SETTINGS', {})
+    return notorhot_settings.get(name, default)
@@ -0,0 +1,460 @@
+import atexit
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Sum
+
+from notorhot.caching import get_notorhot_cache
+from notorhot.conf import get_notorhot_setting
+
+
+COUNTER_FIELDS = ('challenges', 'votes', 'wins')
+
+_buffers = {}
+
+def get_counter_buffer():
+    """
+    Retrieves the write-behind counter buffer configured by
+    ``settings.NOTORHOT_SETTINGS['COUNTER_BUFFER']``: ``"cache"`` for a
+    :class:`CacheCounterBuffer`, ``"local"`` for a
+    :class:`LocalCounterBuffer`, ``"shards"`` for a 
+    :class:`ShardedCounterBuffer`.  Buffers are created once per type and 
+    then reused.
+
+    :returns: the configured buffer, or ``None`` if counters are written
+        straight to the database (the default)
+    """
+    kind = get_notorhot_setting('COUNTER_BUFFER', None)
+    if not kind:
+        return None
+    if kind not in _buffers:
+        _buffers[kind] = BUFFER_CLASSES[kind]()
+    return _buffers[kind]
+
+
+def write_counter_deltas(deltas, queryset=None, chunk_size=500):
+    """
+    Adds buffered deltas to the :class:`~notorhot.models.Candidate` counter
+    columns, in one transaction.  Candidates with identical deltas are
+    updated together, so there is at most one ``UPDATE`` per candidate and
+    usually far fewer.
+
+    :arg deltas: dictionary mapping candidate IDs to dictionaries of
+        ``{ field_name: delta }``
+    :arg queryset: queryset of the rows to update, if not candidates (e.g.
+        :class:`~notorhot.models.CandidateCounterShard` rows, keyed by their
+        own IDs)
+    """
+    from notorhot.models import Candidate
+    if queryset is None:
+        queryset = Candidate.objects.all()
+    # candidates' stored win_pct must follow their votes and wins
+    update_win_pct = queryset.model is Candidate
+
+    by_delta = defaultdict(list)
+    for (candidate_id, fields) in deltas.items():
+        key = tuple(fields.get(name, 0) for name in COUNTER_FIELDS)
+        if any(key):
+            by_delta[key].append(candidate_id)
+
+    with transaction.atomic():
+        for (key, ids) in by_delta.items():
+            updates = dict((name, F(name) + amount) for (name, amount) in
+                zip(COUNTER_FIELDS, key) if amount)
+            for start in range(0, len(ids), chunk_size):
+                queryset.filter(pk__in=ids[start:start + chunk_size]
+                    ).update(**updates)
+                    
+        if update_win_pct:
+            # a separate UPDATE, so every backend sees the new counts
+            ids = [pk for (key, key_ids) in by_delta.items() 
+                for pk in key_ids if key[1] or key[2]]
+            for start in range(0, len(ids), chunk_size):
+                queryset.filter(pk__in=ids[start:start + chunk_size], 
+                    votes__gt=0).update(win_pct=F('wins') * 1.0 / F('votes'))
+
+
+class CounterBuffer(object):
+    """
+    Base class for write-behind buffers of
+    :class:`~notorhot.models.Candidate` counter increments.  Rather than
+    updating a popular candidate's row on every challenge and vote, deltas are
+    accumulated here and written out periodically by :meth:`flush`.
+
+    Subclasses implement :meth:`add_many`, :meth:`get_pending` and
+    :meth:`flush`.
+    """
+    def add(self, candidate_id, **deltas):
+        """
+        Buffers increments for a single candidate, e.g.
+        ``buffer.add(pk, votes=1, wins=1)``.
+        """
+        self.add_many({ candidate_id: deltas, })
+
+    def add_many(self, deltas):
+        """
+        Buffers increments for several candidates.
+
+        :arg deltas: dictionary mapping candidate IDs to dictionaries of
+            ``{ field_name: delta }``
+        """
+        raise NotImplementedError
+
+    def get_pending(self, candidate_ids):
+        """
+        :returns: dictionary mapping each of ``candidate_ids`` that has
+            unflushed deltas to a dictionary of ``{ field_name: delta }``
+        :rtype: dictionary
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Writes all buffered deltas to the database.
+
+        :returns: number of candidates updated
+        :rtype: integer
+        """
+        raise NotImplementedError
+
+    def apply_pending(self, candidates):
+        """
+        Adds unflushed deltas to the counters of in-memory
+        :class:`~notorhot.models.Candidate` instances, so that e.g.
+        :attr:`~notorhot.models.Candidate.win_percentage` reflects votes that
+        haven't been written yet.
+
+        :arg candidates: iterable of :class:`~notorhot.models.Candidate`
+        :returns: the candidates, as a list
+        :rtype: list
+        """
+        candidates = list(candidates)
+        pending = self.get_pending([c.pk for c in candidates])
+        for candidate in candidates:
+            for (name, amount) in pending.get(candidate.pk, {}).items():
+                setattr(candidate, name, getattr(candidate, name) + amount)
+            candidate.win_pct = candidate.calculate_win_pct(candidate.wins, 
+                candidate.votes)
+        return candidates
+
+
+class LocalCounterBuffer(CounterBuffer):
+    """
+    Buffers deltas in a dictionary in the current process.  A daemon thread
+    flushes it every ``NOTORHOT_SETTINGS['COUNTER_FLUSH_INTERVAL']`` seconds
+    (default 5), and it is flushed once more when the process exits.
+
+    Reads only see the current process's pending deltas.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deltas = defaultdict(lambda: defaultdict(int))
+        self.interval = get_notorhot_setting('COUNTER_FLUSH_INTERVAL', 5)
+        self.timer = None
+
+    def add_many(self, deltas):
+        with self.lock:
+            for (candidate_id, fields) in deltas.items():
+                for (name, amount) in fields.items():
+                    self.deltas[candidate_id][name] += amount
+            if self.timer is None and self.interval:
+                self.start_timer()
+
+    def get_pending(self, candidate_ids):
+        with self.lock:
+            return dict((pk, dict(self.deltas[pk])) for pk in candidate_ids
+                if pk in self.deltas)
+
+    def flush(self):
+        with self.lock:
+            (deltas, self.deltas) = (self.deltas,
+                defaultdict(lambda: defaultdict(int)))
+        if not deltas:
+            return 0
+
+        try:
+            write_counter_deltas(deltas)
+        except Exception:
+            # put the deltas back so they're retried at the next flush
+            self.add_many(deltas)
+            raise
+        return len(deltas)
+
+    def start_timer(self):
+        def run():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.flush()
+                finally:
+                    connection.close()
+
+        self.timer = threading.Thread(target=run,
+            name='notorhot-counter-flush')
+        self.timer.daemon = True
+        self.timer.start()
+        atexit.register(self.flush)
+
+
+class CacheCounterBuffer(CounterBuffer):
+    """
+    Buffers deltas in the django-notorhot cache (see
+    :func:`~notorhot.caching.get_notorhot_cache`) with atomic ``incr``, so
+    that all processes share one buffer.  Flush it periodically with the
+    ``flush_candidate_counters`` management command.
+
+    Each counter has its own key.  The first increment to a candidate since
+    the last flush also appends its ID to a numbered list of dirty slots, so
+    a flush reads only the candidates that have changed.  A flush decrements
+    each counter by the amount it writes, so increments made while it runs
+    are kept for the next one.
+
+    Pending deltas live only in the cache: use a backend with atomic ``incr``
+    that won't evict them before they're flushed (e.g. a dedicated memcached
+    or Redis instance).
+    """
+    key_prefix = 'notorhot:counters'
+    # seconds after which a flusher that died mid-flush stops blocking others
+    lock_timeout = 60
+
+    def __init__(self):
+        self.cache = get_notorhot_cache()
+        self.timeout = get_notorhot_setting('COUNTER_BUFFER_TIMEOUT',
+            60 * 60 * 24)
+
+    def get_counter_key(self, candidate_id, name):
+        return '%s:%s:%s' % (self.key_prefix, candidate_id, name)
+
+    def get_mark_key(self, candidate_id):
+        return '%s:%s:dirty' % (self.key_prefix, candidate_id)
+
+    def get_slot_key(self, slot):
+        return '%s:slot:%s' % (self.key_prefix, slot)
+
+    @property
+    def slot_count_key(self):
+        return '%s:slots' % self.key_prefix
+
+    @property
+    def flushed_key(self):
+        return '%s:flushed' % self.key_prefix
+
+    @property
+    def lock_key(self):
+        return '%s:lock' % self.key_prefix
+
+    def incr(self, key, amount, timeout):
+        try:
+            return self.cache.incr(key, amount)
+        except ValueError:
+            # no such key; if another process creates it first, increment it
+            if self.cache.add(key, amount, timeout):
+                return amount
+            return self.cache.incr(key, amount)
+
+    def decr(self, key, amount):
+        try:
+            self.cache.decr(key, amount)
+        except ValueError:
+            # evicted since it was read, so what was read is all there was
+            pass
+
+    def add_many(self, deltas):
+        for (candidate_id, fields) in deltas.items():
+            for (name, amount) in fields.items():
+                if amount:
+                    self.incr(self.get_counter_key(candidate_id, name), amount,
+                        self.timeout)
+            # mark after incrementing: a flush clears marks before reading
+            # counters, so an increment it misses always gets re-marked
+            if self.cache.add(self.get_mark_key(candidate_id), 1,
+                    self.timeout):
+                slot = self.incr(self.slot_count_key, 1, None)
+                self.cache.set(self.get_slot_key(slot), candidate_id,
+                    self.timeout)
+
+    def get_pending(self, candidate_ids):
+        keys = dict(((pk, name), self.get_counter_key(pk, name))
+            for pk in candidate_ids for name in COUNTER_FIELDS)
+        values = self.cache.get_many(keys.values())
+
+        pending = defaultdict(dict)
+        for ((pk, name), key) in keys.items():
+            if values.get(key):
+                pending[pk][name] = values[key]
+        return dict(pending)
+
+    def flush(self):
+        if not self.cache.add(self.lock_key, 1, self.lock_timeout):
+            return 0
+
+        try:
+            first = (self.cache.get(self.flushed_key) or 0) + 1
+            last = self.cache.get(self.slot_count_key) or 0
+            slot_keys = [self.get_slot_key(slot) for slot in
+                xrange(first, last + 1)]
+            slots = self.cache.get_many(slot_keys)
+
+            # a missing slot is usually one whose ID is still being written,
+            # so it's retried next time; if it's still missing, it's been
+            # evicted, and is skipped
+            flushed = last
+            missing = [i for (i, key) in enumerate(slot_keys)
+                if key not in slots]
+            if missing:
+                stalled_key = '%s:stalled' % self.key_prefix
+                if first + missing[0] != self.cache.get(stalled_key):
+                    flushed = first + missing[0] - 1
+                    self.cache.set(stalled_key, first + missing[0], None)
+
+            candidate_ids = set(slots.values())
+            self.cache.delete_many([self.get_mark_key(pk) for pk in
+                candidate_ids])
+            deltas = self.get_pending(candidate_ids)
+
+            taken = defaultdict(dict)
+            try:
+                for (pk, fields) in deltas.items():
+                    for (name, amount) in fields.items():
+                        self.decr(self.get_counter_key(pk, name), amount)
+                        taken[pk][name] = amount
+                write_counter_deltas(deltas)
+            except Exception:
+                # put back whatever was taken out, to be retried
+                self.add_many(taken)
+                raise
+
+            self.cache.set(self.flushed_key, flushed, None)
+            return len(deltas)
+        finally:
+            self.cache.delete(self.lock_key)
+
+
+class ShardedCounterBuffer(CounterBuffer):
+    """
+    Buffers deltas in the database, in 
+    :class:`~notorhot.models.CandidateCounterShard` rows: each increment goes 
+    to one of ``NOTORHOT_SETTINGS['COUNTER_SHARDS']`` (default 8) rows per 
+    candidate, chosen at random, so concurrent votes for a popular candidate 
+    seldom wait on the same row lock.  Increments are written in the caller's
+    transaction, so nothing is lost if a process dies.
+
+    Shard totals are read with one aggregate query and cached for
+    ``NOTORHOT_SETTINGS['COUNTER_SHARD_CACHE_TIMEOUT']`` seconds (default 10).
+    :meth:`flush` compacts the shards, folding their counts back into the
+    candidates' own rows; run it periodically with the 
+    ``flush_candidate_counters`` management command.
+    """
+    key_prefix = 'notorhot:counter_shards'
+
+    def __init__(self):
+        self.cache = get_notorhot_cache()
+        self.num_shards = get_notorhot_setting('COUNTER_SHARDS', 8)
+        self.timeout = get_notorhot_setting('COUNTER_SHARD_CACHE_TIMEOUT', 10)
+
+    def get_totals_key(self, candidate_id):
+        return '%s:%s' % (self.key_prefix, candidate_id)
+
+    def add_many(self, deltas):
+        from notorhot.models import CandidateCounterShard
+
+        with transaction.atomic():
+            for (candidate_id, fields) in deltas.items():
+                fields = dict((name, amount) for (name, amount) in
+                    fields.items() if amount)
+                if not fields:
+                    continue
+                    
+                number = random.randrange(self.num_shards)
+                shard = CandidateCounterShard.objects.filter(
+                    candidate=candidate_id, shard=number)
+                updates = dict((name, F(name) + amount) for (name, amount) in
+                    fields.items())
+                if shard.update(**updates):
+                    continue
+                    
+                # first increment to this shard: create it, unless another
+                # process just did
+                try:
+                    with transaction.atomic():
+                        CandidateCounterShard.objects.create(
+                            candidate_id=candidate_id, shard=number, **fields)
+                except IntegrityError:
+                    shard.update(**updates)
+
+    def get_pending(self, candidate_ids):
+        from notorhot.models import CandidateCounterShard
+
+        keys = dict((pk, self.get_totals_key(pk)) for pk in candidate_ids)
+        cached = self.cache.get_many(keys.values()) if self.timeout else {}
+        pending = dict((pk, cached[key]) for (pk, key) in keys.items()
+            if key in cached)
+
+        missing = [pk for pk in candidate_ids if pk not in pending]
+        if missing:
+            totals = CandidateCounterShard.objects.filter(
+                candidate__in=missing).values('candidate').annotate(
+                    challenges=Sum('challenges'), votes=Sum('votes'),
+                    wins=Sum('wins'))
+            for row in totals:
+                pending[row['candidate']] = dict((name, row[name]) for name in
+                    COUNTER_FIELDS if row[name])
+            for pk in missing:
+                pending.setdefault(pk, {})
+            if self.timeout:
+                self.cache.set_many(dict((keys[pk], pending[pk]) 
+                    for pk in missing), self.timeout)
+
+        return dict((pk, fields) for (pk, fields) in pending.items() 
+            if fields)
+
+    def flush(self, batch_size=1000):
+        """
+        Compacts the shards: adds their counts to the candidates' own rows and
+        subtracts the same amounts from the shards (so increments made 
+        meanwhile are kept), then deletes shards left empty.  Shards are
+        processed in batches of ``batch_size``, one transaction each.
+
+        :returns: number of candidates updated
+        :rtype: integer
+        """
+        from notorhot.models import CandidateCounterShard
+
+        shards = CandidateCounterShard.objects.all()
+        candidate_ids = set()
+        last_pk = 0
+        while True:
+            batch = list(shards.filter(pk__gt=last_pk).order_by('pk').values(
+                'pk', 'candidate', *COUNTER_FIELDS)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]['pk']
+
+            candidate_deltas = defaultdict(lambda: defaultdict(int))
+            shard_deltas = {}
+            for row in batch:
+                for name in COUNTER_FIELDS:
+                    candidate_deltas[row['candidate']][name] += row[name]
+                shard_deltas[row['pk']] = dict((name, -row[name]) for name in
+                    COUNTER_FIELDS)
+
+            with transaction.atomic():
+                write_counter_deltas(candidate_deltas)
+                write_counter_deltas(shard_deltas, shards)
+            candidate_ids.update(candidate_deltas.keys())
+
+        # a single DELETE ... WHERE, so a shard incremented meanwhile is kept
+        shards.filter(challenges=0, votes=0, wins=0).delete()
+        self.cache.delete_many([self.get_totals_key(pk) for pk in 
+            candidate_ids])
+        return len(candidate_ids)
+
+
+BUFFER_CLASSES = {
+    'local': LocalCounterBuffer,
+    'cache': CacheCounterBuffer,
+    'shards': ShardedCounterBuffer,
+}
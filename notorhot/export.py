@@ -0,0 +1,183 @@
+"""
+Streaming exports of voted competitions and candidate statistics, as CSV or
+JSON Lines, optionally gzipped.  Rows are read in keyset chunks and
+serialized as they are read, so memory use doesn't depend on the size of the
+export.  Used by the ``export_notorhot`` management command and
+:class:`~notorhot.views.ExportView`.
+"""
+import csv
+import datetime
+import json
+import zlib
+
+from django.utils import six
+
+from notorhot.models import Candidate, Competition, ArchivedCompetition, \
+    DailyVoteCount
+
+
+EXPORT_KINDS = ('competitions', 'candidates')
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+COMPETITION_FIELDS = ('id', 'category_id', 'left_id', 'right_id',
+    'winner_id', 'winning_side', 'date_presented', 'date_voted')
+CANDIDATE_FIELDS = ('id', 'category_id', 'name', 'slug', 'is_enabled',
+    'added', 'challenges', 'votes', 'wins', 'win_pct', 'rating', 'strength')
+
+
+def parse_day(value):
+    """
+    :arg value: date as ``YYYY-MM-DD``, or ``None``
+    :rtype: :class:`datetime.date`
+    :raises: :exc:`ValueError` if ``value`` is not a valid date
+    """
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def get_querysets(kind, categories=None, since=None, until=None):
+    """
+    :arg kind: ``'competitions'`` for voted competitions, live and archived,
+        filtered by the day they were voted on; or ``'candidates'``, filtered
+        by the day they were added
+    :arg categories: :class:`~notorhot.models.CandidateCategory` instances to
+        restrict the export to, or ``None`` for all
+    :arg since: first day (:class:`datetime.date`) to include, in the current
+        time zone, or ``None``
+    :arg until: last day to include, or ``None``
+    :returns: ``(querysets, fields)``: querysets to be exported one after
+        the other, and the names of the fields to export from them
+    """
+    if kind == 'competitions':
+        (querysets, fields, date_field) = ([Competition.objects.filter(
+            date_voted__isnull=False), ArchivedCompetition.objects.all()],
+            COMPETITION_FIELDS, 'date_voted')
+    else:
+        (querysets, fields, date_field) = ([Candidate.objects.all()],
+            CANDIDATE_FIELDS, 'added')
+
+    filters = {}
+    if categories is not None:
+        filters['category__in'] = categories
+    if since is not None:
+        filters['%s__gte' % date_field] = \
+            DailyVoteCount.objects.get_day_bounds(since)[0]
+    if until is not None:
+        filters['%s__lt' % date_field] = \
+            DailyVoteCount.objects.get_day_bounds(until)[1]
+
+    return ([queryset.filter(**filters) for queryset in querysets], fields)
+
+
+def iter_rows(querysets, fields, chunk_size=2000):
+    """
+    Yields tuples of ``fields``' values from each queryset in turn, in
+    primary key order.  Each chunk of ``chunk_size`` rows is read with a
+    keyset query on the primary key and iterated without being cached, so
+    no query has to skip over earlier rows and at most one chunk is held in
+    memory.
+    """
+    pk_index = list(fields).index('id')
+    for queryset in querysets:
+        queryset = queryset.order_by('pk').values_list(*fields)
+        last_pk = None
+        while True:
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            count = 0
+            for row in chunk[:chunk_size].iterator():
+                count += 1
+                last_pk = row[pk_index]
+                yield row
+            if count < chunk_size:
+                break
+
+
+def serialize_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+class Echo(object):
+    """
+    File-like object whose :meth:`write` returns what was written, so that
+    :mod:`csv` can serialize one row at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, fields):
+    """
+    Yields a UTF-8 encoded CSV line for the header and for each row.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([value.encode('utf-8')
+            if isinstance(value, six.text_type) else serialize_value(value)
+            for value in row])
+
+
+def iter_jsonl(rows, fields):
+    """
+    Yields a line holding a JSON object for each row.
+    """
+    for row in rows:
+        yield json.dumps(dict(zip(fields, [serialize_value(value)
+            for value in row]))) + '\n'
+
+
+def iter_buffered(chunks, size=64 * 1024):
+    """
+    Joins small chunks into chunks of at least ``size`` bytes (except the
+    last), so that output isn't written or compressed a line at a time.
+    """
+    buffered = []
+    length = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffered)
+            buffered = []
+            length = 0
+    if buffered:
+        yield ''.join(buffered)
+
+
+def iter_gzip(chunks):
+    """
+    Compresses chunks into a single gzip stream, as they arrive.
+    """
+    # 16 + MAX_WBITS: gzip header and trailer rather than zlib's
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_export(kind, format, categories=None, since=None, until=None,
+        gzip=False, chunk_size=2000):
+    """
+    :arg kind: one of :data:`EXPORT_KINDS` (see :func:`get_querysets`)
+    :arg format: one of :data:`EXPORT_FORMATS`
+    :arg gzip: whether to gzip the output
+    :returns: iterator of byte strings making up the export
+    """
+    (querysets, fields) = get_querysets(kind, categories, since, until)
+    rows = iter_rows(querysets, fields, chunk_size)
+    if format == 'csv':
+        chunks = iter_csv(rows, fields)
+    else:
+        chunks = iter_jsonl(rows, fields)
+
+    chunks = iter_buffered(chunks)
+    if gzip:
+        chunks = iter_gzip(chunks)
+    return chunks
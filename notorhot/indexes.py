@@ -0,0 +1,116 @@
+# (name, table, columns, condition) of indexes covering only some rows; these
+# can't be declared on models, so are created by migrations and on syncdb
+PARTIAL_INDEXES = (
+    # most competitions are never voted on, so an index of just the unvoted
+    # ones stays small; it serves expiry (see CompetitionQuerySet.expired())
+    ('notorhot_competition_unvoted', 'notorhot_competition', 
+        ('date_presented',), '%(date_voted)s IS NULL'),
+)
+
+# (name, table, columns) of plain indexes standing in for PARTIAL_INDEXES on
+# databases that can't create those (e.g. MySQL); larger, since they cover 
+# every row
+FALLBACK_INDEXES = (
+    ('notorhot_competition_unvoted', 'notorhot_competition', 
+        ('date_voted', 'date_presented')),
+)
+
+
+def supports_partial_indexes(connection):
+    """
+    :returns: whether the database behind ``connection`` can create indexes 
+        with a ``WHERE`` clause (PostgreSQL, or SQLite 3.8.0 and later)
+    :rtype: boolean
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 8, 0)
+    return False
+    
+
+def create_partial_indexes(connection):
+    """
+    Creates the :data:`PARTIAL_INDEXES` that don't already exist, if the 
+    database supports them; otherwise does nothing.
+    """
+    if not supports_partial_indexes(connection):
+        return
+        
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for (name, table, columns, condition) in PARTIAL_INDEXES:
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s) WHERE %s' % (
+            qn(name), qn(table), ', '.join(qn(column) for column in columns),
+            condition % { 'date_voted': qn('date_voted'), }))
+            
+            
+def drop_partial_indexes(connection):
+    """
+    Drops the :data:`PARTIAL_INDEXES`, if the database supports them.
+    """
+    if not supports_partial_indexes(connection):
+        return
+        
+    cursor = connection.cursor()
+    for (name, table, columns, condition) in PARTIAL_INDEXES:
+        cursor.execute('DROP INDEX IF EXISTS %s' % 
+            connection.ops.quote_name(name))
+
+
+def index_exists(connection, table, name):
+    """
+    :returns: whether ``table`` has an index called ``name``
+    :rtype: boolean
+    """
+    cursor = connection.cursor()
+    if connection.vendor == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s WHERE Key_name = %%s' % 
+            connection.ops.quote_name(table), [name])
+    elif connection.vendor == 'postgresql':
+        cursor.execute('SELECT 1 FROM pg_indexes WHERE tablename = %s AND '
+            'indexname = %s', [table, name])
+    elif connection.vendor == 'sqlite':
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND "
+            "tbl_name = %s AND name = %s", [table, name])
+    elif connection.vendor == 'oracle':
+        cursor.execute('SELECT 1 FROM user_indexes WHERE index_name = '
+            'UPPER(%s)', [name])
+    else:
+        return False
+    return bool(cursor.fetchall())
+
+
+def create_fallback_indexes(connection):
+    """
+    Creates the :data:`FALLBACK_INDEXES` that don't already exist, if the 
+    database doesn't support partial indexes; otherwise does nothing.
+    """
+    if supports_partial_indexes(connection):
+        return
+        
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for (name, table, columns) in FALLBACK_INDEXES:
+        if not index_exists(connection, table, name):
+            cursor.execute('CREATE INDEX %s ON %s (%s)' % (qn(name), 
+                qn(table), ', '.join(qn(column) for column in columns)))
+                
+                
+def drop_fallback_indexes(connection):
+    """
+    Drops the :data:`FALLBACK_INDEXES`, if the database doesn't support 
+    partial indexes.
+    """
+    if supports_partial_indexes(connection):
+        return
+        
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for (name, table, columns) in FALLBACK_INDEXES:
+        if index_exists(connection, table, name):
+            if connection.vendor == 'mysql':
+                cursor.execute('DROP INDEX %s ON %s' % (qn(name), qn(table)))
+            else:
+                cursor.execute('DROP INDEX %s' % qn(name))
@@ -0,0 +1,46 @@
+import time
+from collections import defaultdict
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from notorhot.models import QueuedVote
+
+
+class Command(BaseCommand):
+    """
+    Records votes queued by :class:`~notorhot.views.VoteView` when
+    ``settings.NOTORHOT_SETTINGS['VOTE_QUEUE']`` is set, in batches (see
+    :meth:`~notorhot.models.QueuedVoteManager.drain_batch`), until the queue
+    is empty.  Run it from cron, or with ``--interval`` as a long-running
+    worker.
+    """
+    help = u"Records queued votes in batches."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=500,
+            help=u"Votes to record per transaction."),
+        make_option('--interval', type='float', dest='interval', default=None,
+            help=u"Keep running, checking for new votes every INTERVAL "
+                u"seconds once the queue is empty."),
+    )
+
+    def handle(self, *args, **options):
+        interval = options.get('interval')
+        totals = defaultdict(int)
+        while True:
+            counts = QueuedVote.objects.drain_batch(options['batch_size'])
+            for (result, count) in counts.items():
+                totals[result] += count
+            if counts and int(options.get('verbosity', 1)) > 1:
+                self.stdout.write(u"... %d" % sum(totals.values()))
+
+            if not counts:
+                if interval is None:
+                    break
+                time.sleep(interval)
+
+        self.stdout.write(u"Processed %d queued votes%s" % (sum(
+            totals.values()), u"".join(u"; %s: %d" % (result, count)
+            for (result, count) in sorted(totals.items()))))
@@ -0,0 +1,69 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notorhot.export import EXPORT_KINDS, EXPORT_FORMATS, iter_export, \
+    parse_day
+from notorhot.models import CandidateCategory
+
+
+class Command(BaseCommand):
+    """
+    Streams voted competitions (live and archived) or candidate statistics 
+    to a file or to standard output, as CSV or JSON Lines (see 
+    :mod:`notorhot.export`).  Memory use doesn't grow with the size of the 
+    export.
+    """
+    help = u"Exports voted competitions or candidate stats as CSV or JSON Lines."
+    args = u"competitions|candidates"
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv', 
+            choices=EXPORT_FORMATS, help=u"csv (default) or jsonl."),
+        make_option('--category', action='append', dest='categories', 
+            default=[], help=u"Slug of a category to export; may be "
+                u"repeated.  Defaults to all categories."),
+        make_option('--since', dest='since', default=None,
+            help=u"First day to export, as YYYY-MM-DD (by vote date for "
+                u"competitions, date added for candidates)."),
+        make_option('--until', dest='until', default=None,
+            help=u"Last day to export, as YYYY-MM-DD."),
+        make_option('--gzip', action='store_true', dest='gzip', 
+            default=False, help=u"Gzip the output."),
+        make_option('--output', dest='output', default=None,
+            help=u"File to write to.  Defaults to standard output."),
+        make_option('--chunk-size', type='int', dest='chunk_size', 
+            default=2000, help=u"Rows to read per query."),
+    )
+    
+    def handle(self, kind=None, *args, **options):
+        if kind not in EXPORT_KINDS or args:
+            raise CommandError(u"Specify one of: %s." % u", ".join(
+                EXPORT_KINDS))
+        try:
+            (since, until) = (parse_day(options.get('since')), 
+                parse_day(options.get('until')))
+        except ValueError:
+            raise CommandError(u"--since and --until must be dates as "
+                u"YYYY-MM-DD.")
+                
+        categories = None
+        if options['categories']:
+            categories = list(CandidateCategory.objects.filter(
+                slug__in=options['categories']))
+            if len(categories) != len(set(options['categories'])):
+                raise CommandError(u"Unknown category slug.")
+                
+        chunks = iter_export(kind, options['format'], categories, since, 
+            until, gzip=options['gzip'], chunk_size=options['chunk_size'])
+            
+        if options.get('output'):
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            output = options.get('stdout', sys.stdout)
+            for chunk in chunks:
+                output.write(chunk)
+            output.flush()
@@ -0,0 +1,50 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notorhot.conf import get_notorhot_setting
+from notorhot.models import CandidateCategory, Competition
+
+
+class Command(BaseCommand):
+    """
+    Tops up each public category's pool of pre-generated competitions (see
+    :meth:`~notorhot.models.CompetitionGeneratingManager.fill_pool`).  Run it 
+    from cron, or with ``--interval`` as a long-running worker.
+    """
+    help = (u"Fills each public category's pool of pre-generated "
+        u"competitions to the configured depth.")
+    args = u"[category_slug category_slug ...]"
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--depth', type='int', dest='depth', default=None,
+            help=u"Competitions to keep in each pool.  Defaults to "
+                u"NOTORHOT_SETTINGS['COMPETITION_POOL_DEPTH']."),
+        make_option('--interval', type='float', dest='interval', default=None,
+            help=u"Keep running, refilling pools every INTERVAL seconds."),
+    )
+    
+    def handle(self, *category_slugs, **options):
+        depth = options.get('depth')
+        if depth is None:
+            depth = get_notorhot_setting('COMPETITION_POOL_DEPTH', 0)
+        if depth <= 0:
+            raise CommandError(u"Pool depth must be positive; set "
+                u"NOTORHOT_SETTINGS['COMPETITION_POOL_DEPTH'] or pass --depth.")
+                
+        categories = CandidateCategory.public.all()
+        if category_slugs:
+            categories = categories.filter(slug__in=category_slugs)
+            
+        interval = options.get('interval')
+        while True:
+            for category in categories.all():
+                added = Competition.objects.fill_pool(category, depth)
+                if added and int(options.get('verbosity', 1)) > 1:
+                    self.stdout.write(u"%s: added %d competitions" % (
+                        category, added))
+                        
+            if interval is None:
+                break
+            time.sleep(interval)
@@ -0,0 +1,48 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notorhot.models import CandidateCategory, Candidate
+
+
+class Command(BaseCommand):
+    """
+    Estimates every candidate's Bradley-Terry 
+    :attr:`~notorhot.models.Candidate.strength` from the whole voting history
+    of its category, including archived competitions (see 
+    :meth:`~notorhot.models.CandidateManager.fit_strengths`).  Requires 
+    NumPy.  Run it from cron, e.g. nightly; strengths are not updated as 
+    votes come in.
+    """
+    help = u"Fits candidates' Bradley-Terry strengths to competition history."
+    args = u"[category_slug category_slug ...]"
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size', 
+            default=100000, help=u"Competitions to read per query."),
+        make_option('--prior', type='float', dest='prior', default=1.0,
+            help=u"Virtual wins and losses credited to each candidate."),
+        make_option('--max-iterations', type='int', dest='max_iterations', 
+            default=1000, help=u"Maximum number of fitting iterations."),
+    )
+    
+    def handle(self, *category_slugs, **options):
+        try:
+            import numpy
+        except ImportError:
+            raise CommandError(u"Fitting strengths requires NumPy.")
+            
+        categories = CandidateCategory.objects.all()
+        if category_slugs:
+            categories = categories.filter(slug__in=category_slugs)
+            
+        for category in categories:
+            (candidates, votes, iterations) = Candidate.objects.fit_strengths(
+                category, chunk_size=options['chunk_size'], 
+                prior=options['prior'], 
+                max_iterations=options['max_iterations'])
+            
+            if int(options.get('verbosity', 1)) > 1:
+                self.stdout.write(u"%s: fitted %d candidates to %d votes in "
+                    u"%d iterations" % (category, candidates, votes, 
+                    iterations))
@@ -0,0 +1,40 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notorhot.counters import get_counter_buffer, LocalCounterBuffer
+
+
+class Command(BaseCommand):
+    """
+    Writes buffered candidate counter increments to the database (see
+    :class:`~notorhot.counters.CacheCounterBuffer`), or compacts counter 
+    shards (see :class:`~notorhot.counters.ShardedCounterBuffer`).  Run it 
+    from cron, or with ``--interval`` as a long-running worker.
+    """
+    help = (u"Flushes buffered candidate challenge, vote and win counts to "
+        u"the database.")
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--interval', type='float', dest='interval', default=None,
+            help=u"Keep running, flushing every INTERVAL seconds."),
+    )
+    
+    def handle(self, *args, **options):
+        buffer = get_counter_buffer()
+        if buffer is None or isinstance(buffer, LocalCounterBuffer):
+            raise CommandError(u"Only a shared counter buffer can be flushed "
+                u"by command; set NOTORHOT_SETTINGS['COUNTER_BUFFER'] to "
+                u"'cache' or 'shards'.")
+                
+        interval = options.get('interval')
+        while True:
+            flushed = buffer.flush()
+            if flushed and int(options.get('verbosity', 1)) > 1:
+                self.stdout.write(u"Flushed counters for %d candidates" % 
+                    flushed)
+                    
+            if interval is None:
+                break
+            time.sleep(interval)
@@ -0,0 +1,119 @@
+import multiprocessing
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from sorl.thumbnail.images import ImageFile
+
+from notorhot.models import Candidate
+from notorhot.thumbnails import generate_thumbnails, has_thumbnails
+
+
+def prewarm_candidate(item):
+    """
+    Generates one candidate's thumbnails.  Runs in a pool worker, so takes 
+    and returns only picklable values.
+    
+    :arg item: ``(candidate_id, pic_name)``
+    :returns: ``(candidate_id, error)``, where ``error`` is ``None`` on 
+        success
+    """
+    (candidate_id, name) = item
+    storage = Candidate._meta.get_field('pic').storage
+    try:
+        generate_thumbnails(ImageFile(name, storage))
+    except Exception as e:
+        return (candidate_id, u"%s" % e or e.__class__.__name__)
+    return (candidate_id, None)
+
+
+class Command(BaseCommand):
+    """
+    Generates the configured thumbnails (see 
+    :func:`~notorhot.thumbnails.get_thumbnail_geometries`) of every 
+    candidate's picture, across a pool of processes, so that no visitor 
+    waits for one to be generated -- e.g. after a deployment that emptied 
+    the thumbnail store.  Thumbnails that already exist are not regenerated.
+    
+    With ``--resume``, candidates whose thumbnails are all in sorl-thumbnail's
+    key-value store are skipped without being handed to a worker, so an 
+    interrupted run continues about where it stopped.
+    """
+    help = u"Generates thumbnails of all candidates' pictures."
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes', 
+            default=None,
+            help=u"Worker processes to use.  Defaults to the number of CPUs; "
+                u"1 generates thumbnails in this process."),
+        make_option('--resume', action='store_true', dest='resume', 
+            default=False,
+            help=u"Skip candidates whose thumbnails have all been generated."),
+        make_option('--chunk-size', type='int', dest='chunk_size', 
+            default=100,
+            help=u"Candidates per progress report, and per read of the "
+                u"candidate table."),
+    )
+    
+    def get_items(self, chunk_size, resume):
+        """
+        Yields ``(candidate_id, pic_name)`` in primary key order, reading 
+        candidates ``chunk_size`` at a time.
+        """
+        queryset = Candidate.objects.exclude(pic='').order_by('pk')
+        storage = Candidate._meta.get_field('pic').storage
+        last_pk = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk).values_list('pk', 
+                'pic')[:chunk_size])
+            if not chunk:
+                return
+            for (pk, name) in chunk:
+                if not (resume and has_thumbnails(ImageFile(name, storage))):
+                    yield (pk, name)
+            last_pk = chunk[-1][0]
+            
+    def handle(self, *args, **options):
+        processes = options.get('processes') or multiprocessing.cpu_count()
+        chunk_size = options['chunk_size']
+        if processes < 1 or chunk_size < 1:
+            raise CommandError(u"--processes and --chunk-size must be "
+                u"positive.")
+                
+        total = Candidate.objects.exclude(pic='').count()
+        items = self.get_items(chunk_size, options['resume'])
+        
+        pool = None
+        if processes == 1:
+            results = (prewarm_candidate(item) for item in items)
+        else:
+            # forked workers must open their own database connections
+            for connection in connections.all():
+                connection.close()
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap_unordered(prewarm_candidate, items, 
+                max(1, chunk_size // processes))
+            
+        done = failed = 0
+        try:
+            for (candidate_id, error) in results:
+                done += 1
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(u"Candidate %s: %s" % (candidate_id, 
+                        error))
+                if done % chunk_size == 0 and \
+                        int(options.get('verbosity', 1)) > 0:
+                    self.stdout.write(u"... %d of up to %d" % (done, total))
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        
+        self.stdout.write(u"Generated thumbnails for %d candidates (%d "
+            u"failed)" % (done - failed, failed))
@@ -0,0 +1,81 @@
+import datetime
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from notorhot.conf import get_notorhot_setting
+from notorhot.models import Competition
+
+
+class Command(BaseCommand):
+    """
+    Deletes competitions that expired without being voted on (see 
+    :meth:`~notorhot.models.CompetitionGeneratingManager.delete_expired_batch`)
+    and moves old voted competitions into the archive table (see 
+    :meth:`~notorhot.models.CompetitionGeneratingManager.archive_voted_batch`),
+    in batches.  Candidates' counters are not changed.  The command can be 
+    interrupted and re-run at any time; it picks up where it stopped.
+    """
+    help = (u"Deletes expired unvoted competitions and archives old voted "
+        u"ones, in batches.")
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--ttl', type='int', dest='ttl', default=None,
+            help=u"Delete unvoted competitions presented more than TTL "
+                u"seconds ago.  Defaults to "
+                u"NOTORHOT_SETTINGS['COMPETITION_TTL']."),
+        make_option('--archive-after', type='int', dest='archive_after', 
+            default=None,
+            help=u"Archive competitions voted on more than ARCHIVE_AFTER "
+                u"seconds ago.  Defaults to "
+                u"NOTORHOT_SETTINGS['COMPETITION_ARCHIVE_AFTER']."),
+        make_option('--batch-size', type='int', dest='batch_size', 
+            default=1000,
+            help=u"Competitions to delete or archive per transaction."),
+        make_option('--pause', type='float', dest='pause', default=0,
+            help=u"Seconds to wait between batches, to let other writers in."),
+    )
+    
+    def handle(self, *args, **options):
+        ttl = options.get('ttl')
+        if ttl is None:
+            ttl = get_notorhot_setting('COMPETITION_TTL', None)
+        archive_after = options.get('archive_after')
+        if archive_after is None:
+            archive_after = get_notorhot_setting('COMPETITION_ARCHIVE_AFTER', 
+                None)
+        if not ttl and not archive_after:
+            raise CommandError(u"Nothing to do; set "
+                u"NOTORHOT_SETTINGS['COMPETITION_TTL'] or "
+                u"NOTORHOT_SETTINGS['COMPETITION_ARCHIVE_AFTER'], or pass "
+                u"--ttl or --archive-after.")
+                
+        now = timezone.now()
+        if ttl:
+            deleted = self.run_batches(Competition.objects.delete_expired_batch,
+                now - datetime.timedelta(seconds=ttl), options)
+            self.stdout.write(u"Deleted %d expired competitions" % deleted)
+            
+        if archive_after:
+            # a lazy competition's token can vote until the competition is 
+            # saved; archived competitions no longer block a second vote
+            archive_after = max(archive_after, get_notorhot_setting(
+                'LAZY_COMPETITION_MAX_AGE', 60 * 60 * 24))
+            archived = self.run_batches(
+                Competition.objects.archive_voted_batch,
+                now - datetime.timedelta(seconds=archive_after), options)
+            self.stdout.write(u"Archived %d voted competitions" % archived)
+            
+    def run_batches(self, process_batch, cutoff, options):
+        total = 0
+        while True:
+            count = process_batch(cutoff, options['batch_size'])
+            if not count:
+                return total
+            total += count
+            if int(options.get('verbosity', 1)) > 1:
+                self.stdout.write(u"... %d" % total)
+            if options['pause']:
+                time.sleep(options['pause'])
@@ -0,0 +1,92 @@
+import heapq
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from notorhot.models import CandidateCategory, Candidate, Competition, \
+    ArchivedCompetition
+from notorhot.ratings import INITIAL_RATING, apply_votes
+
+
+class Command(BaseCommand):
+    """
+    Recalculates every candidate's Elo :attr:`~notorhot.models.Candidate.rating`
+    by replaying the voted competitions in each category, live and archived,
+    in the order they were voted on.  Competitions are streamed in chunks, so
+    memory use depends only on the number of candidates in a category.
+    
+    Votes recorded while a category is being rebuilt are overwritten, so run 
+    this when voting is quiet (or with voting disabled).
+    """
+    help = u"Rebuilds candidates' Elo ratings from competition history."
+    args = u"[category_slug category_slug ...]"
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size', 
+            default=5000, help=u"Competitions to read per query."),
+    )
+    
+    def handle(self, *category_slugs, **options):
+        categories = CandidateCategory.objects.all()
+        if category_slugs:
+            categories = categories.filter(slug__in=category_slugs)
+            
+        for category in categories:
+            ratings = dict((pk, INITIAL_RATING) for pk in 
+                category.candidates.values_list('id', flat=True))
+            num_votes = 0
+            for chunk in self.stream_votes(category, options['chunk_size']):
+                apply_votes(ratings, chunk)
+                num_votes += len(chunk)
+                
+            Candidate.objects.set_values('rating', ratings)
+                    
+            if int(options.get('verbosity', 1)) > 1:
+                self.stdout.write(u"%s: rated %d candidates from %d votes" % (
+                    category, len(ratings), num_votes))
+                    
+    def stream_votes(self, category, chunk_size):
+        """
+        Yields lists of up to ``chunk_size`` ``(winner_id, loser_id)`` pairs,
+        in voting order, merging the category's live and archived 
+        competitions on ``(date_voted, id)``.
+        """
+        streams = [self.stream_voted_rows(model, category, chunk_size) 
+            for model in (Competition, ArchivedCompetition)]
+        chunk = []
+        for (date_voted, pk, winner_id, left_id, right_id) in heapq.merge(
+                *streams):
+            chunk.append((winner_id, 
+                right_id if winner_id == left_id else left_id))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+            
+    def stream_voted_rows(self, model, category, chunk_size):
+        """
+        Yields ``(date_voted, id, winner_id, left_id, right_id)`` for each of
+        the category's competitions in ``model`` that has a winner, in 
+        voting order, reading each chunk with a keyset query on 
+        ``(date_voted, id)`` so that no query has to skip over earlier rows.
+        """
+        voted = model.objects.filter(category=category, 
+            date_voted__isnull=False, winner__isnull=False).order_by(
+            'date_voted', 'id')
+        last = None
+        
+        while True:
+            chunk = voted
+            if last is not None:
+                chunk = chunk.filter(Q(date_voted__gt=last[0]) | 
+                    Q(date_voted=last[0], id__gt=last[1]))
+            rows = list(chunk.values_list('date_voted', 'id', 'winner_id', 
+                'left_id', 'right_id')[:chunk_size])
+            if not rows:
+                return
+                
+            last = rows[-1][:2]
+            for row in rows:
+                yield row
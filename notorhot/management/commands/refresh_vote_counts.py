@@ -0,0 +1,54 @@
+import datetime
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from notorhot.models import ArchivedCompetition, Competition, DailyVoteCount
+
+
+class Command(BaseCommand):
+    """
+    Brings the per-day vote counts (see 
+    :class:`~notorhot.models.DailyVoteCount`) up to date, recounting each day
+    from ``--since`` (by default, the last day already counted, or the day 
+    of the first vote) up to today.  Run it from cron, e.g. hourly.
+    """
+    help = u"Recounts votes per category per day, from --since until today."
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--since', dest='since', default=None,
+            help=u"First day to recount, as YYYY-MM-DD."),
+    )
+    
+    def to_day(self, value):
+        if settings.USE_TZ:
+            value = timezone.localtime(value)
+        return value.date()
+    
+    def handle(self, *args, **options):
+        today = self.to_day(timezone.now())
+        
+        since = options.get('since')
+        if since:
+            try:
+                day = datetime.datetime.strptime(since, '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(u"--since must be a date as YYYY-MM-DD.")
+        else:
+            day = DailyVoteCount.objects.aggregate(Max('day'))['day__max']
+            if day is None:
+                firsts = [first for first in (model.objects.aggregate(
+                    Min('date_voted'))['date_voted__min'] for model in 
+                    (Competition, ArchivedCompetition)) if first is not None]
+                if not firsts:
+                    return
+                day = self.to_day(min(firsts))
+                
+        while day <= today:
+            votes = DailyVoteCount.objects.refresh(day)
+            if int(options.get('verbosity', 1)) > 1:
+                self.stdout.write(u"%s: %d votes" % (day, votes))
+            day += datetime.timedelta(days=1)
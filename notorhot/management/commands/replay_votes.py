@@ -0,0 +1,70 @@
+import csv
+from collections import defaultdict
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from notorhot.models import Competition
+
+
+class Command(BaseCommand):
+    """
+    Records votes from CSV dumps of ``competition_id,winning_side[,date_voted]``
+    rows, in batches, with 
+    :meth:`~notorhot.models.CompetitionGeneratingManager.record_votes_bulk`.
+    ``date_voted`` is an ISO 8601 date and time; naive values are taken to be 
+    in the current time zone.  Votes on competitions that have already been 
+    voted on are skipped, so an interrupted replay can simply be rerun.
+    """
+    help = u"Records the votes in one or more CSV files."
+    args = u"vote_file.csv [vote_file.csv ...]"
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', 
+            default=1000, help=u"Votes to record per transaction."),
+    )
+    
+    def handle(self, *filenames, **options):
+        if not filenames:
+            raise CommandError(u"Name at least one file of votes to replay.")
+            
+        batch_size = options.get('batch_size')
+        totals = defaultdict(int)
+        
+        for filename in filenames:
+            with open(filename, 'rb') as vote_file:
+                batch = []
+                for (line, row) in enumerate(csv.reader(vote_file), 1):
+                    try:
+                        batch.append(self.parse_row(row))
+                    except ValueError:
+                        raise CommandError(u"%s, line %d: invalid vote %r" % (
+                            filename, line, row))
+                    if len(batch) == batch_size:
+                        self.record(batch, totals)
+                        batch = []
+                if batch:
+                    self.record(batch, totals)
+                    
+        self.stdout.write(u", ".join(u"%s: %d" % (result, count) 
+            for (result, count) in sorted(totals.items())))
+            
+    def parse_row(self, row):
+        vote = [int(row[0]), int(row[1])]
+        if len(row) > 2 and row[2]:
+            date_voted = parse_datetime(row[2])
+            if date_voted is None:
+                raise ValueError(row[2])
+            if settings.USE_TZ and timezone.is_naive(date_voted):
+                date_voted = timezone.make_aware(date_voted, 
+                    timezone.get_current_timezone())
+            vote.append(date_voted)
+        return tuple(vote)
+            
+    def record(self, batch, totals):
+        for (competition_id, result) in \
+                Competition.objects.record_votes_bulk(batch):
+            totals[result] += 1
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Candidate.win_pct'
+        db.add_column(u'notorhot_candidate', 'win_pct',
+                      self.gf('django.db.models.fields.FloatField')(default=0.0),
+                      keep_default=False)
+
+        # Filling in win_pct for existing candidates
+        if not db.dry_run:
+            orm['notorhot.Candidate'].objects.filter(votes__gt=0).update(
+                win_pct=models.F('wins') * 1.0 / models.F('votes'))
+
+        # Adding index on 'Candidate', fields ['category', 'win_pct']
+        db.create_index(u'notorhot_candidate', ['category_id', 'win_pct'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Candidate', fields ['category', 'win_pct']
+        db.delete_index(u'notorhot_candidate', ['category_id', 'win_pct'])
+
+        # Deleting field 'Candidate.win_pct'
+        db.delete_column(u'notorhot_candidate', 'win_pct')
+
+
+    models = {
+        u'notorhot.candidate': {
+            'Meta': {'object_name': 'Candidate', 'index_together': "[('category', 'rating'), ('category', 'win_pct')]"},
+            'added': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'candidates'", 'to': u"orm['notorhot.CandidateCategory']"}),
+            'challenges': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_enabled': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'pic': ('notorhot.fields.AutoDocumentableImageField', [], {'max_length': '100'}),
+            'rating': ('django.db.models.fields.FloatField', [], {'default': '1500.0'}),
+            'slug': ('autoslug.fields.AutoSlugField', [], {'unique': 'True', 'max_length': '50', 'populate_from': "'name'", 'unique_with': '()', 'blank': 'True'}),
+            'votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0', 'blank': 'True'}),
+            'win_pct': ('django.db.models.fields.FloatField', [], {'default': '0.0'}),
+            'wins': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0', 'blank': 'True'})
+        },
+        u'notorhot.candidatecategory': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'CandidateCategory'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_public': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'slug': ('autoslug.fields.AutoSlugField', [], {'unique': 'True', 'max_length': '50', 'populate_from': "'name'", 'unique_with': '()', 'blank': 'True'})
+        },
+        u'notorhot.candidatecountershard': {
+            'Meta': {'unique_together': "[('candidate', 'shard')]", 'object_name': 'CandidateCounterShard'},
+            'candidate': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'counter_shards'", 'to': u"orm['notorhot.Candidate']"}),
+            'challenges': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'shard': ('django.db.models.fields.PositiveSmallIntegerField', [], {}),
+            'votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'wins': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'notorhot.competition': {
+            'Meta': {'object_name': 'Competition', 'index_together': "[('category', 'is_pooled')]"},
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'competitions'", 'to': u"orm['notorhot.CandidateCategory']"}),
+            'date_presented': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'date_voted': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_pooled': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'lazy_key': ('django.db.models.fields.CharField', [], {'max_length': '32', 'unique': 'True', 'null': 'True', 'blank': 'True'}),
+            'left': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'comparisons_left'", 'to': u"orm['notorhot.Candidate']"}),
+            'right': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'comparisons_right'", 'to': u"orm['notorhot.Candidate']"}),
+            'winner': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'comparisons_won'", 'null': 'True', 'to': u"orm['notorhot.Candidate']"}),
+            'winning_side': ('django.db.models.fields.PositiveSmallIntegerField', [], {'null': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['notorhot']
\ No newline at end of file
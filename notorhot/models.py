@@ -1,18 +1,74 @@
-from django.db import models
+from django.conf import settings
+from django.core import signing
+from django.db import models, transaction, connections, IntegrityError
+from django.db.models import Count, F
 from django.utils.translation import ugettext as _, ugettext_lazy as _l
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.db.models.signals import post_save, post_delete, post_syncdb
+from django.dispatch import receiver
+from django.utils.datastructures import SortedDict
+from django.utils import timezone
 
+from notorhot.caching import CandidateIndex, LeaderboardCache, \
+    get_instance_cache, get_related_instance
+from notorhot.conf import get_notorhot_setting
+from notorhot.counters import get_counter_buffer, write_counter_deltas
 from notorhot.fields import AutoDocumentableImageField
+from notorhot.indexes import create_partial_indexes, create_fallback_indexes
+from notorhot.pairing import get_pairing_strategy, record_votes
+from notorhot.ratings import INITIAL_RATING, elo_deltas, apply_votes
+from notorhot.thumbnails import get_cached_thumbnail, pregenerate_thumbnails
 
 from autoslug import AutoSlugField
-from model_utils import Choices
+from model_utils import Choices, FieldTracker
 from model_utils.managers import PassThroughManager
 
+from collections import defaultdict
+import calendar
 import datetime
+import random
+import time
+import uuid
 
 
-class PublicCategoryManager(models.Manager):
+class CandidateCategoryQuerySet(models.query.QuerySet):
+    """
+    :class:`QuerySet` that adds annotation shortcut methods for 
+    :class:`CandidateCategory` sets.
+    """
+    def with_counts(self):
+        """
+        :returns: :class:`CandidateCategory` queryset whose instances come 
+            with :attr:`~CandidateCategory.num_candidates` and 
+            :attr:`~CandidateCategory.num_voted_competitions` already counted,
+            by subqueries in the same query, rather than by two further 
+            queries per instance
+        :rtype: :class:`QuerySet`
+        """
+        qn = connections[self.db].ops.quote_name
+        category_pk = '%s.%s' % (qn(self.model._meta.db_table), 
+            qn(self.model._meta.pk.column))
+        candidate_table = qn(Candidate._meta.db_table)
+        competition_table = qn(Competition._meta.db_table)
+        
+        return self.extra(select=SortedDict([
+            ('_num_candidates', 'SELECT COUNT(*) FROM %s WHERE %s.%s = %s '
+                'AND %s.%s = %%s' % (candidate_table, candidate_table, 
+                qn('category_id'), category_pk, candidate_table, 
+                qn('is_enabled'))),
+            ('_num_voted_competitions', 'SELECT COUNT(*) FROM %s WHERE '
+                '%s.%s = %s AND %s.%s IS NOT NULL' % (competition_table, 
+                competition_table, qn('category_id'), category_pk, 
+                competition_table, qn('date_voted'))),
+        ]), select_params=(True,))
+        
+
+CandidateCategoryManager = PassThroughManager.for_queryset_class(
+    CandidateCategoryQuerySet)
+
+
+class PublicCategoryManager(CandidateCategoryManager):
     """
     Manager for :class:`CandidateCategory` that returns only instances with 
     :attr:`~CandidateCategory.is_public` ``== True``
@@ -35,7 +91,7 @@ class CandidateCategory(models.Model):
         u"this category will not be listed, and competitions for this category "
         u"will not be available."))
     
-    objects = models.Manager()
+    objects = CandidateCategoryManager()
     public = PublicCategoryManager()
     
     def __unicode__(self):
@@ -50,14 +106,34 @@ class CandidateCategory(models.Model):
         """
         return reverse('notorhot_leaders', kwargs={ 'category_slug': self.slug, })
         
-    def generate_competition(self):
+    def generate_competition(self, ids=None):
         """
+        If ``settings.NOTORHOT_SETTINGS['LAZY_COMPETITIONS']`` is set, 
+        returns an unsaved competition (see 
+        :meth:`CompetitionGeneratingManager.present_for_category`).  Otherwise,
+        if ``settings.NOTORHOT_SETTINGS['COMPETITION_POOL_DEPTH']`` is set, 
+        takes a pre-generated :class:`Competition` from this category's pool 
+        (see :meth:`CompetitionGeneratingManager.fill_pool`); if the pool is 
+        disabled or empty, generates a new one.
+        
+        :arg ids: IDs of two candidates chosen in advance (see 
+            :meth:`CompetitionGeneratingManager.select_from_category`), which
+            are used in preference to the pool
         :returns: a :class:`Competition` instance with two :class:`Candidate` 
             instances selected at random from this :class:`CandidateCategory`.
         :rtype: :class:`Competition`
         """
-        return Competition.objects.generate_from_queryset(
-            self.candidates.enabled())
+        if get_notorhot_setting('LAZY_COMPETITIONS', False):
+            return Competition.objects.present_for_category(self, ids)
+            
+        competition = None
+        if get_notorhot_setting('COMPETITION_POOL_DEPTH', 0) and ids is None:
+            competition = Competition.objects.pop_from_pool(self)
+            
+        if competition is None:
+            competition = Competition.objects.generate_for_category(self, ids)
+            
+        return competition
             
     @property
     def num_candidates(self):
@@ -66,6 +142,8 @@ class CandidateCategory(models.Model):
             this :class:`CandidateCategory`.
         :rtype: integer
         """
+        if hasattr(self, '_num_candidates'):
+            return self._num_candidates
         return self.candidates.enabled().count()
         
     def num_voted_competitions(self):
@@ -74,7 +152,10 @@ class CandidateCategory(models.Model):
             :class:`CandidateCategory` that have received votes.
         :rtype: integer
         """
-        return self.competitions.count() - self.competitions.votable().count()
+        if hasattr(self, '_num_voted_competitions'):
+            return self._num_voted_competitions
+        # reads the (category, date_voted) index
+        return self.competitions.filter(date_voted__isnull=False).count()
     num_voted_competitions = property(num_voted_competitions, doc="Competitions voted in")    
     
     class Meta:
@@ -89,12 +170,32 @@ class CandidateQuerySet(models.query.QuerySet):
     """
     def order_by_wins(self):
         """
-        :returns: :class:`Candidate` queryset sorted by calculated win 
-            percentage (wins/votes).
+        :returns: :class:`Candidate` queryset sorted by stored win 
+            percentage (wins/votes).  Filtered to one category, this is a 
+            range scan of the ``(category, win_pct)`` index.
+        :rtype: :class:`QuerySet`
+        """
+        return self.order_by('-win_pct')
+            
+    def order_by_rating(self):
+        """
+        :returns: :class:`Candidate` queryset sorted by Elo 
+            :attr:`~Candidate.rating`, highest first.  Filtered to one 
+            category, this is a range scan of the ``(category, rating)`` 
+            index.
         :rtype: :class:`QuerySet`
         """
-        return self.extra(select={ 'win_pct': '1.0 * wins / votes', }).order_by(
-            '-win_pct')
+        return self.order_by('-rating')
+            
+    def order_by_strength(self):
+        """
+        :returns: :class:`Candidate` queryset sorted by Bradley-Terry 
+            :attr:`~Candidate.strength`, highest first.  Filtered to one 
+            category, this is a range scan of the ``(category, strength)`` 
+            index.
+        :rtype: :class:`QuerySet`
+        """
+        return self.order_by('-strength')
             
     def for_category(self, category):
         """
@@ -113,9 +214,235 @@ class CandidateQuerySet(models.query.QuerySet):
         :rtype: :class:`QuerySet`
         """
         return self.filter(is_enabled=True)
+        
+    def increment_challenges(self):
+        """
+        Increments :attr:`~Candidate.challenges` on every :class:`Candidate` 
+        in the queryset with a single ``UPDATE`` statement.
+        
+        :returns: number of rows updated
+        :rtype: integer
+        """
+        return self.update(challenges=F('challenges') + 1)
 
 
-CandidateManager = PassThroughManager.for_queryset_class(CandidateQuerySet)
+class CandidateManager(PassThroughManager.for_queryset_class(CandidateQuerySet)):
+    """
+    Manager for :class:`Candidate` that passes through 
+    :class:`CandidateQuerySet` methods and adds methods for updating counters.
+    
+    If ``settings.NOTORHOT_SETTINGS['COUNTER_BUFFER']`` is set, counter 
+    updates are buffered (see :mod:`notorhot.counters`) rather than written
+    immediately.
+    """
+    def record_challenges(self, candidate_ids, amount=1):
+        """
+        Adds ``amount`` to :attr:`~Candidate.challenges` on each of the given
+        candidates, with a single ``UPDATE`` statement.
+        
+        :arg candidate_ids: primary keys of the :class:`Candidate` instances
+            presented
+        """
+        buffer = get_counter_buffer()
+        if buffer is not None:
+            buffer.add_many(dict((pk, { 'challenges': amount, }) 
+                for pk in candidate_ids))
+            return
+            
+        self.filter(pk__in=candidate_ids).update(
+            challenges=F('challenges') + amount)
+            
+    def record_challenge_counts(self, increments):
+        """
+        Adds different amounts to different candidates' 
+        :attr:`~Candidate.challenges`, with one ``UPDATE`` per distinct amount
+        rather than one per candidate.
+        
+        :arg increments: dictionary mapping candidate IDs to the number of
+            times each was presented (negative to take challenges back)
+        """
+        by_amount = defaultdict(list)
+        for (candidate_id, amount) in increments.items():
+            by_amount[amount].append(candidate_id)
+            
+        for (amount, ids) in by_amount.items():
+            # keep IN clauses within backend parameter limits
+            for start in range(0, len(ids), 500):
+                self.record_challenges(ids[start:start + 500], amount)
+        
+    def add_counter_deltas(self, deltas):
+        """
+        Adds arbitrary amounts to candidates' counters, with at most one
+        ``UPDATE`` per candidate (see 
+        :func:`~notorhot.counters.write_counter_deltas`).
+        
+        :arg deltas: dictionary mapping candidate IDs to dictionaries of
+            ``{ field_name: delta }``
+        """
+        buffer = get_counter_buffer()
+        if buffer is not None:
+            buffer.add_many(deltas)
+        else:
+            write_counter_deltas(deltas, self.all())
+        
+    def add_rating_deltas(self, deltas):
+        """
+        Adds amounts to candidates' :attr:`~Candidate.rating`, with one 
+        ``UPDATE`` per candidate.
+        
+        :arg deltas: dictionary mapping candidate IDs to rating changes
+        """
+        for (pk, delta) in deltas.items():
+            if delta:
+                self.filter(pk=pk).update(rating=F('rating') + delta)
+                
+    def set_values(self, field_name, values, chunk_size=500):
+        """
+        Stores a field's value on many candidates, with one ``UPDATE`` per 
+        ``chunk_size`` candidates, in one transaction.
+        
+        :arg values: dictionary mapping candidate IDs to the field's values
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        items = values.items()
+        
+        with transaction.atomic(using=self.db):
+            cursor = connection.cursor()
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                # one CASE expression in place of an UPDATE per candidate
+                sql = u"UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)" % (
+                    qn(opts.db_table), qn(opts.get_field(field_name).column),
+                    qn(opts.pk.column), u" ".join([u"WHEN %s THEN %s"] * 
+                    len(chunk)), qn(opts.pk.column), 
+                    u", ".join([u"%s"] * len(chunk)))
+                params = []
+                for (pk, value) in chunk:
+                    params.extend([pk, value])
+                cursor.execute(sql, params + [pk for (pk, value) in chunk])
+                
+    def set_strengths(self, strengths, chunk_size=500):
+        """
+        Stores candidates' :attr:`~Candidate.strength` (see 
+        :meth:`set_values`).
+        
+        :arg strengths: dictionary mapping candidate IDs to strengths
+        """
+        self.set_values('strength', strengths, chunk_size)
+        
+    def stream_decisive_votes(self, category, chunk_size=100000):
+        """
+        Yields ``(winner_ids, loser_ids)`` lists for up to ``chunk_size`` 
+        votes at a time, from every voted :class:`Competition` and 
+        :class:`ArchivedCompetition` in ``category`` that has a winner.  Each
+        chunk is read with a keyset query on ``id``, so memory use doesn't 
+        grow with the number of competitions.
+        """
+        for model in (Competition, ArchivedCompetition):
+            voted = model.objects.filter(category=category, 
+                winner__isnull=False).order_by('id')
+            last_pk = 0
+            while True:
+                rows = list(voted.filter(id__gt=last_pk).values_list('id', 
+                    'winner_id', 'left_id', 'right_id')[:chunk_size])
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                yield ([winner_id for (pk, winner_id, left_id, right_id) 
+                    in rows], [right_id if winner_id == left_id else left_id
+                    for (pk, winner_id, left_id, right_id) in rows])
+        
+    def fit_strengths(self, category, chunk_size=100000, prior=1.0, 
+            max_iterations=1000):
+        """
+        Estimates the Bradley-Terry :attr:`~Candidate.strength` of every 
+        candidate in ``category`` from the category's whole voting history 
+        (see :mod:`notorhot.strength`), and stores the estimates.  Votes are
+        streamed and summarized ``chunk_size`` at a time, so memory use 
+        depends only on the number of candidates and of distinct pairs that 
+        have met.  Requires NumPy.
+        
+        :arg prior: virtual wins and losses per candidate (see 
+            :func:`~notorhot.strength.fit_bradley_terry`)
+        :returns: ``(candidates, votes, iterations)``: numbers of candidates 
+            rated, of votes used, and of iterations needed
+        :rtype: tuple
+        """
+        from notorhot.strength import PairwiseCounts, fit_bradley_terry
+        
+        counts = PairwiseCounts(self.model.objects.filter(category=category
+            ).values_list('id', flat=True))
+        for (winner_ids, loser_ids) in self.stream_decisive_votes(category, 
+                chunk_size):
+            counts.add(winner_ids, loser_ids)
+            
+        (strengths, iterations) = fit_bradley_terry(counts, prior=prior, 
+            max_iterations=max_iterations)
+        self.set_strengths(dict(zip(counts.ids.tolist(), 
+            strengths.tolist())))
+        LeaderboardCache(category.pk).bump()
+        return (counts.num_candidates, counts.num_votes, iterations)
+        
+    def record_vote(self, winner_id, other_ids, rating_deltas=None):
+        """
+        Increments :attr:`~Candidate.votes` on the winning candidate and each
+        of the others, and :attr:`~Candidate.wins` on the winner only, in a 
+        single ``UPDATE`` statement.
+        
+        :arg winner_id: primary key of the winning :class:`Candidate`, or 
+            ``None`` to record a vote with no winner
+        :arg other_ids: primary keys of the other :class:`Candidate` 
+            instances voted on
+        :arg rating_deltas: optional dictionary mapping candidate IDs to 
+            changes in :attr:`~Candidate.rating`, applied in the same 
+            ``UPDATE``
+        """
+        rating_deltas = rating_deltas or {}
+        
+        buffer = get_counter_buffer()
+        if buffer is not None:
+            deltas = dict((pk, { 'votes': 1, }) for pk in other_ids)
+            if winner_id is not None:
+                deltas[winner_id] = { 'votes': 1, 'wins': 1, }
+            buffer.add_many(deltas)
+            # ratings depend on each other, so can't be buffered; sites
+            # buffering counters can turn NOTORHOT_SETTINGS['ELO_RATINGS'] off
+            self.add_rating_deltas(rating_deltas)
+            return
+            
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        ids = [pk for pk in [winner_id,] + list(other_ids) if pk is not None]
+        names = {
+            'table': qn(opts.db_table),
+            'votes': qn(opts.get_field('votes').column),
+            'wins': qn(opts.get_field('wins').column),
+            'rating': qn(opts.get_field('rating').column),
+            'win_pct': qn(opts.get_field('win_pct').column),
+            'pk': qn(opts.pk.column),
+            'ids': u", ".join([u"%s"] * len(ids)),
+        }
+        
+        # Django's ORM can't express a conditional increment, so one portable
+        # CASE expression does the job of two F()-based UPDATEs.
+        # win_pct comes first: MySQL evaluates later assignments against the
+        # already-updated columns, while other backends always use old values
+        sql = (u"UPDATE %(table)s SET %(win_pct)s = 1.0 * (%(wins)s + CASE "
+            u"WHEN %(pk)s = %%s THEN 1 ELSE 0 END) / (%(votes)s + 1), "
+            u"%(votes)s = %(votes)s + 1, "
+            u"%(wins)s = %(wins)s + CASE WHEN %(pk)s = %%s THEN 1 ELSE 0 END")
+        params = [winner_id, winner_id,]
+        if rating_deltas:
+            sql += u", %%(rating)s = %%(rating)s + CASE %%(pk)s %s ELSE 0 END" % (
+                u" ".join([u"WHEN %%s THEN %%s"] * len(rating_deltas)))
+            for (pk, delta) in rating_deltas.items():
+                params.extend([pk, delta])
+        sql += u" WHERE %(pk)s IN (%(ids)s)"
+        
+        connection.cursor().execute(sql % names, params + ids)
 
 
 class EnabledCandidateManager(CandidateManager):
@@ -133,7 +460,8 @@ class Candidate(models.Model):
     awesomest fruit, we might have a :class:`Candidate` instance for Apples 
     and one for Bananas.
     """
-    name = models.CharField(max_length=100)
+    # indexed for the competition admin's name prefix search
+    name = models.CharField(max_length=100, db_index=True)
     slug = AutoSlugField(populate_from='name', unique=True, blank=True)
     pic = AutoDocumentableImageField(upload_to='candidates')
     is_enabled = models.BooleanField(default=True)
@@ -151,45 +479,155 @@ class Candidate(models.Model):
         help_text=_l(u"Number of competitions this candidate has won"))
         
     added = models.DateTimeField(auto_now_add=True)
+    
+    rating = models.FloatField(default=INITIAL_RATING, editable=False,
+        help_text=_l(u"Elo rating, updated with each vote"))
+    # wins / votes, stored so leaderboards can be read from an index; kept in
+    # step by save() and by every counter UPDATE
+    win_pct = models.FloatField(default=0.0, editable=False)
+    strength = models.FloatField(default=0.0, editable=False,
+        help_text=_l(u"Bradley-Terry strength (log scale), as last fitted"))
 
     objects = CandidateManager()
     enabled = EnabledCandidateManager()
+    
+    # used to decide when the category's CandidateIndex must be rebuilt
+    tracker = FieldTracker(fields=['is_enabled', 'category',])
 
     def __unicode__(self):
         return self.name
         
     def increment_challenges(self):
+        """
+        Increments :attr:`~Candidate.challenges` field, in the database with an 
+        atomic ``UPDATE`` (or in the counter buffer) and on this instance.
+        """
+        Candidate.objects.record_challenges([self.pk,])
         self.challenges += 1
-        self.save()
         
     def increment_votes(self, won):
         """
         Increments :attr:`~Candidate.votes` field.  If ``won == True``, also 
-        increments :attr:`~Candidate.wins` field.
+        increments :attr:`~Candidate.wins` field.  The database is updated with
+        an atomic ``UPDATE`` (or the counter buffer is), so concurrent 
+        increments are never lost.
         
         :arg boolean won: Whether or not this was the winning candidate in 
             the vote.
         """
+        if won:
+            Candidate.objects.record_vote(self.pk, [])
+        else:
+            Candidate.objects.record_vote(None, [self.pk,])
+        
         self.votes += 1
         if won:
             self.wins += 1
-        self.save()
+        self.win_pct = self.calculate_win_pct(self.wins, self.votes)
+        
+    @staticmethod
+    def calculate_win_pct(wins, votes):
+        """
+        :returns: ``wins / votes`` as a fraction, or ``0.0`` if there are no 
+            votes
+        :rtype: float
+        """
+        if not votes:
+            return 0.0
+        return float(wins) / float(votes)
         
     @property
     def win_percentage(self):
         """
-        Calculated win rate (:attr:`~Candidate.wins`/:attr:`~Candidate.votes`)
+        Win rate (:attr:`~Candidate.wins`/:attr:`~Candidate.votes`) as a 
+        percentage, read from the stored :attr:`~Candidate.win_pct`.
+        
+        When counters are buffered, this reflects only flushed votes unless
+        the instance has been passed through 
+        :meth:`~notorhot.counters.CounterBuffer.apply_pending`.
         """
         if self.votes == 0:
             return 'No votes'
             
-        return 100 * float(self.wins)/float(self.votes)
+        return 100 * self.win_pct
+        
+    def save(self, *args, **kwargs):
+        """
+        Saves the candidate and, if a new :attr:`pic` was uploaded, has its 
+        thumbnails generated ahead of display (see 
+        :func:`~notorhot.thumbnails.pregenerate_thumbnails`).
+        """
+        self.win_pct = self.calculate_win_pct(self.wins, self.votes)
+        # an uploaded file isn't committed to storage until the field's 
+        # pre_save()
+        new_pic = bool(self.pic) and not self.pic._committed
+        super(Candidate, self).save(*args, **kwargs)
+        if new_pic:
+            pregenerate_thumbnails(self.pic)
         
     def get_absolute_url(self):
         return reverse('notorhot_candidate', kwargs={ 
             'slug': self.slug, 
-            'category_slug': self.category.slug,
+            'category_slug': get_related_instance(self, 'category').slug,
         })
+        
+    @staticmethod
+    def describe(values, category_slug, thumbnail_geometry='300x300'):
+        """
+        Describes a candidate in a form that can be serialized as JSON, from 
+        its field values alone (e.g. a row from ``values('id', 'name', 
+        'slug', 'pic')``), so no instance has to be built.  The thumbnail is 
+        only included if it has already been generated.
+        
+        :arg values: dictionary with keys ``'id'``, ``'name'``, ``'slug'`` 
+            and ``'pic'`` (the image's name or file)
+        :arg category_slug: slug of the candidate's category
+        :returns: dictionary with keys ``'id'``, ``'name'``, ``'url'`` and 
+            ``'thumbnail'`` (a URL, or ``None``)
+        :rtype: dictionary
+        """
+        thumbnail = None
+        if values['pic']:
+            thumbnail = get_cached_thumbnail(values['pic'], thumbnail_geometry,
+                crop='center')
+        return {
+            'id': values['id'],
+            'name': values['name'],
+            'url': reverse('notorhot_candidate', kwargs={ 
+                'slug': values['slug'], 
+                'category_slug': category_slug,
+            }),
+            'thumbnail': thumbnail.url if thumbnail is not None else None,
+        }
+        
+    class Meta:
+        index_together = [
+            ('category', 'rating'),
+            ('category', 'win_pct'),
+            ('category', 'strength'),
+        ]
+        
+        
+class CandidateCounterShard(models.Model):
+    """
+    Partial counts for a :class:`Candidate`, used when 
+    ``settings.NOTORHOT_SETTINGS['COUNTER_BUFFER'] == 'shards'`` (see 
+    :class:`~notorhot.counters.ShardedCounterBuffer`).  Increments go to one 
+    of several shard rows at random rather than to the candidate's own row, 
+    and are periodically folded back into the candidate.
+    """
+    candidate = models.ForeignKey(Candidate, related_name='counter_shards')
+    shard = models.PositiveSmallIntegerField()
+    
+    challenges = models.PositiveIntegerField(default=0)
+    votes = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = [('candidate', 'shard'),]
+        
+    def __unicode__(self):
+        return u"%s #%s" % (self.candidate_id, self.shard)
     
 
 class CompetitionQuerySet(models.query.QuerySet):
@@ -198,7 +636,35 @@ class CompetitionQuerySet(models.query.QuerySet):
     :class:`Competition` instances.
     """
     def votable(self):
-        return self.filter(date_voted__isnull=True)
+        """
+        :returns: :class:`Competition` queryset filtered to include only 
+            instances that have been presented and not yet voted on
+        :rtype: :class:`QuerySet`
+        """
+        return self.filter(date_voted__isnull=True, is_pooled=False)
+        
+    def expired(self, cutoff=None):
+        """
+        :arg cutoff: datetime before which competitions presented count as 
+            expired; defaults to :meth:`Competition.get_expiry_cutoff`
+        :returns: :class:`Competition` queryset filtered to include only 
+            instances that were presented before ``cutoff`` and never voted on;
+            empty if no cutoff is given and no TTL is configured
+        :rtype: :class:`QuerySet`
+        """
+        if cutoff is None:
+            cutoff = self.model.get_expiry_cutoff()
+            if cutoff is None:
+                return self.none()
+        return self.votable().filter(date_presented__lt=cutoff)
+        
+    def pooled(self):
+        """
+        :returns: :class:`Competition` queryset filtered to include only 
+            pre-generated instances waiting in a pool to be presented
+        :rtype: :class:`QuerySet`
+        """
+        return self.filter(is_pooled=True)
 
 
 CompetitionManager = PassThroughManager.for_queryset_class(CompetitionQuerySet)
@@ -222,7 +688,8 @@ class CompetitionGeneratingManager(CompetitionManager):
             the specified "left" and "right" :class:`Candidate` instances.
         :rtype: :class:`Competition`
         """
-        if left.category != right.category:
+        # compare IDs so neither category has to be fetched
+        if left.category_id != right.category_id:
             raise self.NonMatchingCategory()
         
         return self.create(**{
@@ -243,25 +710,522 @@ class CompetitionGeneratingManager(CompetitionManager):
             instances selected at random from ``queryset``
         :rtype: :class:`Competition`         
         """
-        # Make sure our queryset only contains Candidates from a single Category
-        # Because .values(), .order_by(), and .distinct() can interfere with one
-        # another, and we can't guarantee that no ordering is applied, we can't
-        # do this in the ORM and thus must instead handle it in Python.  Yuck.
-        category_ids = queryset.values_list('category__id', flat=True)
-        category_ids = set(category_ids)
-        if len(category_ids) > 1:
-            raise self.NonMatchingCategory()            
+        with transaction.atomic():
+            # Make sure our queryset only contains Candidates from a single 
+            # Category.  Aggregation discards any ordering on the queryset, so 
+            # the database can count distinct categories without returning a 
+            # row per candidate.
+            num_categories = queryset.aggregate(num_categories=Count(
+                'category', distinct=True))['num_categories']
+            if num_categories > 1:
+                raise self.NonMatchingCategory()            
+
+            # randomize queryset order, then select first two objects
+            first_2 = queryset.order_by('?')[:2]
+            
+            # Not enough candidates available total
+            if len(first_2) < 2:
+                raise Candidate.DoesNotExist
 
-        # randomize queryset order, then select first two objects
-        first_2 = queryset.order_by('?')[:2]
+            return self.generate_from_candidates(first_2[0], first_2[1])
+        
+    def select_from_category(self, category, ids=None):
+        """
+        Selects two enabled :class:`Candidate` instances at random from 
+        ``category``; or, if ``ids`` are given, those two candidates, as long
+        as both are still enabled and in ``category``.  If a pairing strategy
+        is configured (see :func:`~notorhot.pairing.get_pairing_strategy`), 
+        it chooses the candidates instead of random selection.
         
-        # Not enough candidates available total
-        if len(first_2) < 2:
+        Unlike :meth:`generate_from_queryset`, this does not sort the 
+        category's candidates: IDs are drawn from a cached 
+        :class:`~notorhot.caching.CandidateIndex`, and only the two selected 
+        rows are fetched.  The index is rebuilt if it is missing, or if it 
+        turns out to be stale.
+        
+        :arg category: :class:`CandidateCategory` from which to select
+        :arg ids: IDs of two different candidates chosen in advance (e.g. 
+            so that their images could be preloaded), or ``None``
+        :raises: :exc:`Candidate.DoesNotExist` if the category has fewer than
+            two enabled candidates
+        :returns: two different :class:`Candidate` instances
+        :rtype: tuple
+        """
+        index = CandidateIndex(category.pk)
+        queryset = Candidate.enabled.for_category(category)
+        
+        strategy = None
+        if ids is None:
+            strategy = get_pairing_strategy()
+            if strategy is not None:
+                ids = strategy.choose(category)
+        
+        if ids is not None and len(set(ids)) == 2:
+            candidates = queryset.in_bulk(ids)
+            if len(candidates) == 2:
+                return (candidates[ids[0]], candidates[ids[1]])
+            if strategy is not None:
+                strategy.invalidate(category.pk)
+                
+        # At most one rebuild: a second miss means the data really is missing
+        for attempt in range(2):
+            ids = index.sample(2)
+            if ids is None:
+                ids = index.build_and_sample(queryset.values_list('id', 
+                    flat=True).iterator(), 2)
+            
+            if len(ids) < 2:
+                raise Candidate.DoesNotExist
+                
+            candidates = queryset.in_bulk(ids)
+            if len(candidates) == 2:
+                return (candidates[ids[0]], candidates[ids[1]])
+            
+            # a selected candidate was disabled, moved or deleted without the 
+            # index being invalidated (e.g. via QuerySet.update())
+            index.invalidate()
+            
+        raise Candidate.DoesNotExist
+        
+    def generate_for_category(self, category, ids=None):
+        """
+        Selects two enabled :class:`Candidate` instances at random from 
+        ``category`` (see :meth:`select_from_category`), and creates a new 
+        :class:`Competition` between them.
+        
+        :arg category: :class:`CandidateCategory` from which to select
+        :arg ids: IDs of two candidates chosen in advance, or ``None``
+        :raises: :exc:`Candidate.DoesNotExist` if the category has fewer than
+            two enabled candidates
+        :returns: new :class:`Competition` between two :class:`Candidate` 
+            instances selected at random from ``category``
+        :rtype: :class:`Competition`         
+        """
+        with transaction.atomic():
+            (left, right) = self.select_from_category(category, ids)
+            return self.generate_from_candidates(left, right)
+            
+    def present_for_category(self, category, ids=None):
+        """
+        Like :meth:`generate_for_category`, but does not save the new 
+        :class:`Competition`.  Instead, the returned instance carries a signed
+        :attr:`~Competition.token` from which :meth:`from_token` can rebuild 
+        it if and when it is voted on.  Only the candidates' 
+        :attr:`~Candidate.challenges` counts are written, with one ``UPDATE``.
+        
+        :arg category: :class:`CandidateCategory` from which to select
+        :arg ids: IDs of two candidates chosen in advance, or ``None``
+        :raises: :exc:`Candidate.DoesNotExist` if the category has fewer than
+            two enabled candidates
+        :returns: new, unsaved :class:`Competition` between two 
+            :class:`Candidate` instances selected at random from ``category``
+        :rtype: :class:`Competition`         
+        """
+        (left, right) = self.select_from_category(category, ids)
+        Candidate.objects.record_challenges((left.pk, right.pk))
+        left.challenges += 1
+        right.challenges += 1
+        
+        return self.model(left=left, right=right, category=category, 
+            date_presented=self.model.timestamp_to_datetime(int(time.time())),
+            lazy_key=uuid.uuid4().hex)
+            
+    def present_values_for_category(self, category, count, 
+            thumbnail_geometry='300x300'):
+        """
+        Presents up to ``count`` new competitions in ``category`` at once, as
+        plain dictionaries that can be serialized as JSON (e.g. for a client 
+        that buffers competitions ahead of the user).
+        
+        Candidate IDs are drawn from the category's cached 
+        :class:`~notorhot.caching.CandidateIndex` in one go, so no candidate 
+        appears twice in the batch if the category is big enough, and the 
+        candidates are fetched with a single ``values()`` query; no 
+        :class:`Candidate` instances are built.  If 
+        ``settings.NOTORHOT_SETTINGS['LAZY_COMPETITIONS']`` is set, the 
+        competitions are not saved, and each carries a token (see 
+        :meth:`present_for_category`); otherwise they are inserted with one 
+        ``bulk_create()``, and their IDs read back by their 
+        :attr:`~Competition.lazy_key`.  Either way, candidates' 
+        :attr:`~Candidate.challenges` are counted with one ``UPDATE`` per 
+        distinct increment.
+        
+        :arg category: :class:`CandidateCategory` from which to select
+        :arg integer count: number of competitions to present
+        :raises: :exc:`Candidate.DoesNotExist` if the category has fewer than
+            two enabled candidates
+        :returns: list of dictionaries with keys ``'id'`` (``None`` for 
+            unsaved competitions), ``'token'`` (``None`` for saved ones), 
+            ``'left'`` and ``'right'``, the candidates being described as by
+            :meth:`Candidate.describe`.  The list may be shorter than 
+            ``count`` if the index turns out to be stale.
+        :rtype: list
+        """
+        index = CandidateIndex(category.pk)
+        queryset = Candidate.enabled.for_category(category)
+        
+        # At most one rebuild: a second miss means the data really is missing
+        for attempt in range(2):
+            ids = index.sample(2 * count)
+            if ids is None:
+                ids = index.build_and_sample(queryset.values_list('id', 
+                    flat=True).iterator(), 2 * count)
+                
+            if len(ids) < 2:
+                raise Candidate.DoesNotExist
+                
+            if len(ids) == 2 * count:
+                pairs = zip(ids[0::2], ids[1::2])
+            else:
+                # too few candidates to keep every pair apart
+                pairs = [random.sample(ids, 2) for i in range(count)]
+                
+            rows = dict((row['id'], row) for row in queryset.filter(
+                pk__in=ids).values('id', 'name', 'slug', 'pic'))
+            if len(rows) < len(ids):
+                # a selected candidate was disabled, moved or deleted without 
+                # the index being invalidated
+                index.invalidate()
+                pairs = [(left_id, right_id) for (left_id, right_id) in pairs 
+                    if left_id in rows and right_id in rows]
+            if pairs:
+                break
+        else:
             raise Candidate.DoesNotExist
-
-        return self.generate_from_candidates(first_2[0], first_2[1])
+            
+        increments = defaultdict(int)
+        for (left_id, right_id) in pairs:
+            increments[left_id] += 1
+            increments[right_id] += 1
+            
+        presented = self.model.timestamp_to_datetime(int(time.time()))
+        competitions = [self.model(left_id=left_id, right_id=right_id, 
+            category_id=category.pk, date_presented=presented, 
+            lazy_key=uuid.uuid4().hex) for (left_id, right_id) in pairs]
+            
+        with transaction.atomic():
+            if not get_notorhot_setting('LAZY_COMPETITIONS', False):
+                self.bulk_create(competitions)
+                saved = dict(self.filter(lazy_key__in=[competition.lazy_key 
+                    for competition in competitions]).values_list('lazy_key', 
+                    'id'))
+                for competition in competitions:
+                    competition.id = saved[competition.lazy_key]
+            Candidate.objects.record_challenge_counts(increments)
+            
+        described = dict((pk, Candidate.describe(row, category.slug, 
+            thumbnail_geometry)) for (pk, row) in rows.items() 
+            if pk in increments)
+        return [{
+            'id': competition.pk,
+            'token': competition.token,
+            'left': described[competition.left_id],
+            'right': described[competition.right_id],
+        } for competition in competitions]
+            
+    def from_token(self, token, now=None):
+        """
+        Rebuilds an unsaved :class:`Competition` from a token issued by 
+        :meth:`present_for_category`.  The competition is saved when 
+        :meth:`~Competition.record_vote` is called on it.
+        
+        Tokens expire after ``settings.NOTORHOT_SETTINGS['LAZY_COMPETITION_MAX_AGE']``
+        seconds (default: one day), or after 
+        ``settings.NOTORHOT_SETTINGS['COMPETITION_TTL']`` seconds if that is 
+        shorter.
         
+        :arg string token: value of a :attr:`Competition.token`
+        :arg now: time at which the token's expiry is judged (e.g. when a 
+            queued vote was cast); defaults to now
+        :raises: :exc:`Competition.InvalidToken` if the token has been 
+            tampered with or has expired, or a candidate no longer exists
+        :rtype: :class:`Competition`
+        """
+        max_age = get_notorhot_setting('LAZY_COMPETITION_MAX_AGE', 60 * 60 * 24)
+        ttl = get_notorhot_setting('COMPETITION_TTL', None)
+        if ttl:
+            max_age = min(max_age, ttl)
+        if now is not None:
+            # signing measures a token's age up to the present
+            max_age += (timezone.now() - now).total_seconds()
+        try:
+            (left_id, right_id, category_id, presented, lazy_key) = \
+                signing.loads(token, salt=self.model.TOKEN_SALT, max_age=max_age)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise self.model.InvalidToken()
+            
+        candidates = Candidate.objects.in_bulk([left_id, right_id])
+        if len(candidates) < 2:
+            raise self.model.InvalidToken()
+            
+        return self.model(left=candidates[left_id], right=candidates[right_id],
+            category_id=category_id, 
+            date_presented=self.model.timestamp_to_datetime(presented),
+            lazy_key=lazy_key)
     
+    def fill_pool(self, category, depth):
+        """
+        Tops up ``category``'s pool of pre-generated competitions so that it 
+        holds ``depth`` competitions between enabled candidates.  Pooled 
+        competitions whose candidates have since been disabled are discarded,
+        and the challenges they were counted for are taken back.
+        
+        New competitions are inserted with a single ``bulk_create()``, and 
+        candidates' :attr:`~Candidate.challenges` are incremented at this 
+        point (with one ``UPDATE`` per distinct increment) rather than when 
+        the competition is presented.
+        
+        This is intended to run outside the request cycle; see the 
+        ``fill_competition_pools`` management command.
+        
+        :arg category: :class:`CandidateCategory` whose pool should be filled
+        :arg integer depth: number of competitions the pool should hold
+        :returns: number of competitions added to the pool
+        :rtype: integer
+        """
+        pool = self.pooled().filter(category=category)
+        with transaction.atomic():
+            stale = list(pool.filter(models.Q(left__is_enabled=False) | 
+                models.Q(right__is_enabled=False)).select_for_update(
+                ).values_list('id', 'left_id', 'right_id'))
+            decrements = defaultdict(int)
+            for start in range(0, len(stale), 500):
+                chunk = stale[start:start + 500]
+                self.filter(pk__in=[pk for (pk, left_id, right_id) in chunk],
+                    is_pooled=True).delete()
+                for (pk, left_id, right_id) in chunk:
+                    decrements[left_id] -= 1
+                    decrements[right_id] -= 1
+            Candidate.objects.record_challenge_counts(decrements)
+            
+        needed = depth - pool.count()
+        if needed <= 0:
+            return 0
+            
+        candidate_ids = list(Candidate.enabled.for_category(category
+            ).values_list('id', flat=True))
+        if len(candidate_ids) < 2:
+            return 0
+            
+        competitions = []
+        increments = defaultdict(int)
+        for i in range(needed):
+            (left_id, right_id) = random.sample(candidate_ids, 2)
+            competitions.append(self.model(left_id=left_id, right_id=right_id,
+                category_id=category.pk, is_pooled=True))
+            increments[left_id] += 1
+            increments[right_id] += 1
+            
+        with transaction.atomic():
+            self.bulk_create(competitions)
+            Candidate.objects.record_challenge_counts(increments)
+                    
+        return needed
+        
+    def pop_from_pool(self, category):
+        """
+        Takes a pre-generated competition out of ``category``'s pool, marking
+        it as presented now.
+        
+        A competition is claimed with a conditional ``UPDATE``, so concurrent
+        requests never receive the same one; a small window of candidates is 
+        read and tried in random order to keep concurrent requests from all 
+        contending for the same row.
+        
+        :arg category: :class:`CandidateCategory` whose pool should be used
+        :returns: a :class:`Competition` instance, or ``None`` if the pool is 
+            empty
+        :rtype: :class:`Competition`
+        """
+        window = list(self.pooled().filter(category=category, 
+            left__is_enabled=True, right__is_enabled=True).select_related(
+            'left', 'right')[:self.POOL_CLAIM_WINDOW])
+        random.shuffle(window)
+        
+        now = timezone.now()
+        for competition in window:
+            claimed = self.filter(pk=competition.pk, is_pooled=True).update(
+                is_pooled=False, date_presented=now)
+            if claimed:
+                competition.is_pooled = False
+                competition.date_presented = now
+                return competition
+                
+        return None
+        
+    POOL_CLAIM_WINDOW = 5
+    
+    def record_votes_bulk(self, votes, queryset=None):
+        """
+        Records votes on many :class:`Competition` instances at once, e.g. 
+        votes queued by an offline client, or a dump of historical votes being
+        replayed.
+        
+        The whole batch is fetched with one :meth:`in_bulk` query.  Valid 
+        votes are then claimed with one conditional ``UPDATE ... WHERE 
+        date_voted IS NULL`` per winning side (and date voted), and the 
+        candidates' counters are updated with their summed deltas (see 
+        :meth:`CandidateManager.add_counter_deltas`), all in one transaction.
+        Votes cast more than ``settings.NOTORHOT_SETTINGS['COMPETITION_TTL']``
+        seconds after their competition was presented are rejected as 
+        expired.
+        
+        :arg votes: iterable of ``(competition_id, winning_side)`` or 
+            ``(competition_id, winning_side, date_voted)`` tuples; 
+            ``date_voted`` defaults to now
+        :arg queryset: :class:`Competition` queryset to which votes are 
+            restricted (e.g. competitions in public categories); competitions 
+            outside it are reported as not found
+        :returns: list of ``(competition_id, result)`` tuples in the same 
+            order as ``votes``, where ``result`` is one of 
+            :attr:`Competition.VOTE_RESULTS`
+        :rtype: list
+        """
+        RESULTS = self.model.VOTE_RESULTS
+        now = timezone.now()
+        votes = [(vote[0], vote[1], vote[2] if len(vote) > 2 else now) 
+            for vote in votes]
+        if queryset is None:
+            queryset = self.all()
+        queryset = queryset.filter(is_pooled=False).only('id', 'category', 
+            'left', 'right', 'date_presented', 'date_voted')
+            
+        competitions = {}
+        ids = list(set(vote[0] for vote in votes))
+        # keep IN clauses within backend parameter limits
+        for start in range(0, len(ids), 500):
+            competitions.update(queryset.in_bulk(ids[start:start + 500]))
+        
+        results = []
+        claims = defaultdict(list)
+        for (competition_id, winner, date_voted) in votes:
+            competition = competitions.get(competition_id)
+            if competition is None:
+                results.append(RESULTS.NOT_FOUND)
+            elif winner not in self.model.SIDES:
+                results.append(RESULTS.INVALID)
+            elif competition.date_voted is not None:
+                results.append(RESULTS.ALREADY_VOTED)
+            elif competition.is_expired(date_voted):
+                results.append(RESULTS.EXPIRED)
+            else:
+                # later duplicates in the batch find this one's vote
+                competition.date_voted = date_voted
+                claims[(winner, date_voted)].append(competition_id)
+                results.append(RESULTS.OK)
+        
+        with transaction.atomic():
+            lost = set()
+            for ((winner, date_voted), claim_ids) in claims.items():
+                winner_field = 'left' if winner == self.model.SIDES.LEFT \
+                    else 'right'
+                for start in range(0, len(claim_ids), 500):
+                    chunk = claim_ids[start:start + 500]
+                    claimed = self.filter(pk__in=chunk, 
+                        date_voted__isnull=True, is_pooled=False).update(
+                        winning_side=winner, winner=F(winner_field), 
+                        date_voted=date_voted)
+                    if claimed < len(chunk):
+                        # some were voted on since we read them; find which
+                        # ones are ours by what we just wrote
+                        ours = set(self.filter(pk__in=chunk, 
+                            winning_side=winner, date_voted=date_voted
+                            ).values_list('id', flat=True))
+                        lost.update(set(chunk) - ours)
+                        
+            deltas = defaultdict(lambda: defaultdict(int))
+            pairs = []
+            pairs_by_category = defaultdict(list)
+            for (index, (competition_id, winner, date_voted)) in \
+                    enumerate(votes):
+                if results[index] != RESULTS.OK:
+                    continue
+                if competition_id in lost:
+                    results[index] = RESULTS.ALREADY_VOTED
+                    continue
+                    
+                competition = competitions[competition_id]
+                deltas[competition.left_id]['votes'] += 1
+                deltas[competition.right_id]['votes'] += 1
+                if winner == self.model.SIDES.LEFT:
+                    deltas[competition.left_id]['wins'] += 1
+                    pair = (competition.left_id, competition.right_id)
+                else:
+                    deltas[competition.right_id]['wins'] += 1
+                    pair = (competition.right_id, competition.left_id)
+                pairs.append(pair)
+                pairs_by_category[competition.category_id].append(pair)
+                    
+            Candidate.objects.add_counter_deltas(deltas)
+            
+            if get_notorhot_setting('ELO_RATINGS', True):
+                # Elo ratings depend on the order of votes, so are applied one
+                # by one in memory, then written as one net change per 
+                # candidate
+                candidate_ids = list(deltas.keys())
+                old_ratings = {}
+                for start in range(0, len(candidate_ids), 500):
+                    old_ratings.update(Candidate.objects.select_for_update(
+                        ).filter(pk__in=candidate_ids[start:start + 500]
+                        ).values_list('id', 'rating'))
+                new_ratings = apply_votes(dict(old_ratings), pairs)
+                Candidate.objects.add_rating_deltas(dict((pk, 
+                    new_ratings[pk] - old_ratings[pk]) for pk in old_ratings))
+            
+        for (category_id, category_pairs) in pairs_by_category.items():
+            LeaderboardCache(category_id).bump()
+            record_votes(category_id, category_pairs)
+            
+        return [(vote[0], result) for (vote, result) in zip(votes, results)]
+        
+    def delete_expired_batch(self, cutoff, batch_size=1000):
+        """
+        Deletes up to ``batch_size`` of the oldest competitions that were 
+        presented before ``cutoff`` and never voted on.  Candidates' counters
+        are left as they are.
+        
+        Each call is a short transaction of its own, so calling it repeatedly
+        clears a backlog of expired competitions without holding locks for 
+        long, and can be stopped and restarted at any point.
+        
+        :returns: number of competitions deleted; 0 when none are left
+        :rtype: integer
+        """
+        ids = list(self.expired(cutoff).order_by('pk').values_list('pk', 
+            flat=True)[:batch_size])
+        if ids:
+            # re-checked in case a vote arrived since the IDs were read
+            self.filter(pk__in=ids, date_voted__isnull=True).delete()
+        return len(ids)
+        
+    def archive_voted_batch(self, cutoff, batch_size=1000):
+        """
+        Moves up to ``batch_size`` of the oldest competitions voted on before 
+        ``cutoff`` into the :class:`ArchivedCompetition` table, in one 
+        transaction.  Candidates' counters are left as they are.
+        
+        :returns: number of competitions archived; 0 when none are left
+        :rtype: integer
+        """
+        fields = ('id', 'category_id', 'left_id', 'right_id', 'winner_id', 
+            'winning_side', 'date_presented', 'date_voted')
+            
+        with transaction.atomic():
+            rows = list(self.filter(date_voted__lt=cutoff).order_by('pk'
+                ).values(*fields)[:batch_size])
+            if not rows:
+                return 0
+                
+            ids = [row['id'] for row in rows]
+            # rows copied by an earlier, interrupted run are not copied again
+            archived = set(ArchivedCompetition.objects.filter(pk__in=ids
+                ).values_list('id', flat=True))
+            ArchivedCompetition.objects.bulk_create([ArchivedCompetition(
+                **row) for row in rows if row['id'] not in archived])
+            self.filter(pk__in=ids).delete()
+            
+        return len(rows)
+        
     class NonMatchingCategory(ValueError):
         """
         :class:`ValueError` subclass raised when an attempt is made to generate 
@@ -291,9 +1255,27 @@ class Competition(models.Model):
         (1, 'LEFT', _l(u"Left")),
         (2, 'RIGHT', _l(u"Right")),
     )
+    
+    # outcomes reported by CompetitionGeneratingManager.record_votes_bulk()
+    VOTE_RESULTS = Choices(
+        ('ok', 'OK', _l(u"OK")),
+        ('already_voted', 'ALREADY_VOTED', _l(u"Already voted")),
+        ('not_found', 'NOT_FOUND', _l(u"Not found")),
+        ('invalid', 'INVALID', _l(u"Invalid")),
+        ('expired', 'EXPIRED', _l(u"Expired")),
+    )
 
-    date_presented = models.DateTimeField(auto_now_add=True)
-    date_voted = models.DateTimeField(null=True, blank=True)
+    # not auto_now_add, so that lazily-saved competitions keep the time they 
+    # were actually presented
+    date_presented = models.DateTimeField(default=timezone.now, editable=False)
+    # pre-generated, waiting to be presented; see 
+    # CompetitionGeneratingManager.fill_pool()
+    is_pooled = models.BooleanField(default=False)
+    # set on competitions presented without being saved; see 
+    # CompetitionGeneratingManager.present_for_category()
+    lazy_key = models.CharField(max_length=32, unique=True, null=True, 
+        blank=True, editable=False)
+    date_voted = models.DateTimeField(null=True, blank=True, db_index=True)
     
     left = models.ForeignKey(Candidate, related_name='comparisons_left', 
         help_text=_l(u"Candidate to present on the left-hand side of the comparison"))
@@ -313,70 +1295,236 @@ class Competition(models.Model):
         
     objects = CompetitionGeneratingManager()
     votable = VotableCompetitionManager()
+    
+    TOKEN_SALT = 'notorhot.competition'
         
     def __unicode__(self):
         return "%s vs. %s" % (self.left, self.right)
         
+    @property
+    def token(self):
+        """
+        Signed token identifying an unsaved competition returned by 
+        :meth:`CompetitionGeneratingManager.present_for_category`, encoding 
+        both candidates, the category and the time it was presented.  
+        ``None`` for saved competitions.
+        """
+        if self.pk or not self.lazy_key:
+            return None
+            
+        presented = self.date_presented
+        if timezone.is_naive(presented):
+            presented = timezone.make_aware(presented, 
+                timezone.get_default_timezone())
+        
+        return signing.dumps([self.left_id, self.right_id, self.category_id, 
+            calendar.timegm(presented.utctimetuple()), self.lazy_key], 
+            salt=self.TOKEN_SALT)
+            
+    @staticmethod
+    def get_expiry_cutoff(now=None):
+        """
+        :arg now: time at which expiry is judged; defaults to the current time
+        :returns: datetime before which competitions must have been presented 
+            to have expired, as set by 
+            ``settings.NOTORHOT_SETTINGS['COMPETITION_TTL']`` (in seconds), or
+            ``None`` if competitions don't expire
+        """
+        ttl = get_notorhot_setting('COMPETITION_TTL', None)
+        if not ttl:
+            return None
+        return (now or timezone.now()) - datetime.timedelta(seconds=ttl)
+        
+    def is_expired(self, at=None):
+        """
+        :arg at: time at which expiry is judged (e.g. the time a vote was 
+            cast); defaults to the current time
+        :returns: whether the competition was presented too long ago to be 
+            voted on
+        :rtype: boolean
+        """
+        cutoff = self.get_expiry_cutoff(at)
+        return cutoff is not None and self.date_presented < cutoff
+        
+    @staticmethod
+    def timestamp_to_datetime(timestamp):
+        """
+        Converts a UTC UNIX timestamp (as stored in a :attr:`token`) to a 
+        datetime, aware or naive as ``settings.USE_TZ`` requires.
+        """
+        value = datetime.datetime.utcfromtimestamp(timestamp).replace(
+            tzinfo=timezone.utc)
+        if not settings.USE_TZ:
+            value = timezone.make_naive(value, timezone.get_default_timezone())
+        return value
+        
     def clean(self):
         """
         Validates that the winner is one of the :class:`Candidate` instances 
         belonging to this :class:`Competition` and that the competition's 
         category matches both of its candidates' categories.
         """
-        if self.winner and self.winner.id not in (self.left.id, self.right.id):
+        if self.winner_id and self.winner_id not in (self.left_id, self.right_id):
             raise ValidationError(_(u"Winner must be one of the candidates "
                 u"offered on left or right."))
         
-        try:
-            category = self.category
-        except CandidateCategory.DoesNotExist:
-            category = None
+        category_id = self.category_id
         
-        if ((self.left.category != self.right.category) or 
-                (category and (self.left.category != category))):
+        if ((self.left.category_id != self.right.category_id) or 
+                (category_id and (self.left.category_id != category_id))):
             raise ValidationError(_(u"Both candidates for competition must "
                 u"belong to same category as competition."))
                 
     def save(self, *args, **kwargs):
         """
         Upon :class:`Competition` instance creation, increments challenge count
-        on both its candidates; if category is blank, sets a value.
+        on both its candidates (in a single ``UPDATE``, in the same transaction 
+        as the insert); if category is blank, sets a value.
+        
+        Lazily-presented competitions (those with a :attr:`lazy_key`) had 
+        their challenges counted when they were presented, so are not counted
+        again.
         """
-        if not self.id:
-            self.left.increment_challenges()
-            self.right.increment_challenges()
+        if self.category_id is None:
+            self.category_id = self.left.category_id
             
-        try:
-            self.category
-        except CandidateCategory.DoesNotExist:
-            self.category = self.left.category
+        if self.id or self.lazy_key:
+            super(Competition, self).save(*args, **kwargs)
+            return
             
-        super(Competition, self).save(*args, **kwargs)
+        # no savepoint: when generated via the manager, we're already inside
+        # the generating transaction
+        with transaction.atomic(savepoint=False):
+            super(Competition, self).save(*args, **kwargs)
+            Candidate.objects.record_challenges((self.left_id, 
+                self.right_id))
+                
+        # keep the in-memory candidates in step with the database
+        self.left.challenges += 1
+        self.right.challenges += 1
             
                 
-    def record_vote(self, winner):
+    def get_summary(self, thumbnail_geometry='300x300'):
+        """
+        Describes the competition and its result in a form that can be 
+        serialized as JSON (e.g. to show the previous vote without looking 
+        the competition up again).  Thumbnails are only included if they have
+        already been generated.
+        
+        :returns: dictionary with keys ``'id'``, ``'winning_side'``, 
+            ``'left'``, ``'right'`` and ``'winner'``; each candidate (or 
+            ``None`` for ``'winner'`` if there is none) is described by a 
+            dictionary with keys ``'id'``, ``'name'``, ``'url'`` and 
+            ``'thumbnail'`` (a URL, or ``None``)
+        :rtype: dictionary
+        """
+        category_slug = get_related_instance(self, 'category').slug
+        def describe(candidate):
+            return Candidate.describe({ 'id': candidate.pk, 
+                'name': candidate.name, 'slug': candidate.slug, 
+                'pic': candidate.pic, }, category_slug, thumbnail_geometry)
+            
+        left = describe(self.left)
+        right = describe(self.right)
+        winner = { self.SIDES.LEFT: left, self.SIDES.RIGHT: right, 
+            }.get(self.winning_side)
+        return {
+            'id': self.pk,
+            'winning_side': self.winning_side,
+            'left': left,
+            'right': right,
+            'winner': winner,
+        }
+        
+    def record_vote(self, winner, date_voted=None):
         """
         Records the winning candidate on the :class:`Competition`.  Also updates 
         statistics on both :class:`Candidate` records.
         
+        The vote is claimed with a conditional ``UPDATE ... WHERE date_voted 
+        IS NULL`` (which also skips pooled competitions that haven't been 
+        presented), and both candidates' counters are then updated with a 
+        single ``UPDATE``, all in one transaction; so concurrent votes on the 
+        same competition (e.g. a double-click) are counted exactly once.  Unless
+        ``settings.NOTORHOT_SETTINGS['ELO_RATINGS']`` is ``False``, both 
+        candidates' rows are locked to read their Elo ratings, which are 
+        updated in the same ``UPDATE``.
+        
+        An unsaved, lazily-presented competition is saved along with its vote;
+        if its :attr:`lazy_key` has already been saved (i.e. its token has 
+        already been used to vote), :exc:`Competition.AlreadyVoted` is raised.
+        
+        :arg date_voted: when the vote was cast (e.g. when it was queued); 
+            defaults to now
         :raises: :exc:`Competition.AlreadyVoted`
         """
         if self.date_voted is not None:
             raise self.AlreadyVoted()
         
-        self.winning_side = winner
-        
         if winner == self.SIDES.LEFT:
-            self.winner = self.left
+            (winner_id, loser_id) = (self.left_id, self.right_id)
         elif winner == self.SIDES.RIGHT:
-            self.winner = self.right
-            
-        self.left.increment_votes((winner == self.SIDES.LEFT))
-        self.right.increment_votes((winner == self.SIDES.RIGHT))
+            (winner_id, loser_id) = (self.right_id, self.left_id)
+        else:
+            (winner_id, loser_id) = (None, None)
             
-        self.date_voted = datetime.datetime.now()
+        date_voted = date_voted or timezone.now()
         
-        self.save()
+        with transaction.atomic():
+            if self.pk is None:
+                self.winning_side = winner
+                self.winner_id = winner_id
+                self.date_voted = date_voted
+                try:
+                    with transaction.atomic():
+                        self.save()
+                except IntegrityError:
+                    self.date_voted = None
+                    raise self.AlreadyVoted()
+            else:
+                claimed = Competition.objects.filter(pk=self.pk, 
+                    date_voted__isnull=True, is_pooled=False).update(
+                    winning_side=winner,
+                    winner=winner_id, date_voted=date_voted)
+                if not claimed:
+                    raise self.AlreadyVoted()
+                    
+                self.winning_side = winner
+                self.winner_id = winner_id
+                self.date_voted = date_voted
+                
+            rating_deltas = {}
+            if winner_id is None or not get_notorhot_setting('ELO_RATINGS', 
+                    True):
+                Candidate.objects.record_vote(winner_id, 
+                    [pk for pk in (self.left_id, self.right_id) 
+                    if pk != winner_id])
+            else:
+                # lock both rows so concurrent votes rate from fresh values
+                ratings = dict(Candidate.objects.select_for_update().filter(
+                    pk__in=(winner_id, loser_id)).values_list('id', 'rating'))
+                rating_deltas = dict(zip((winner_id, loser_id), elo_deltas(
+                    ratings[winner_id], ratings[loser_id])))
+                Candidate.objects.record_vote(winner_id, [loser_id,], 
+                    rating_deltas)
+                
+        LeaderboardCache(self.category_id).bump()
+        if winner_id is not None:
+            record_votes(self.category_id, [(winner_id, loser_id)])
+        
+        # keep any loaded candidate instances in step with the database
+        for (field_name, candidate_id) in (('left', self.left_id), 
+                ('right', self.right_id)):
+            candidate = getattr(self, self._meta.get_field(
+                field_name).get_cache_name(), None)
+            if candidate is not None:
+                candidate.votes += 1
+                candidate.rating += rating_deltas.get(candidate_id, 0)
+                if candidate_id == winner_id:
+                    candidate.wins += 1
+                    self.winner = candidate
+                candidate.win_pct = candidate.calculate_win_pct(
+                    candidate.wins, candidate.votes)
         
     class AlreadyVoted(RuntimeError):
         """
@@ -385,3 +1533,290 @@ class Competition(models.Model):
         """
         pass
         
+    class InvalidToken(ValueError):
+        """
+        :class:`ValueError` subclass raised when a lazily-presented 
+        competition's token is forged, expired or otherwise unusable.
+        """
+        pass
+        
+    class Meta:
+        index_together = [
+            ('category', 'is_pooled'),
+            ('category', 'date_voted'),
+        ]
+        
+
+
+class ArchivedCompetition(models.Model):
+    """
+    A voted :class:`Competition` moved out of the competition table by the 
+    ``purge_competitions`` management command, keeping its original ID.  
+    References to candidates and categories are not enforced by the 
+    database, so archived rows outlive deleted candidates.
+    """
+    id = models.IntegerField(primary_key=True)
+    date_presented = models.DateTimeField()
+    date_voted = models.DateTimeField(db_index=True)
+    
+    left = models.ForeignKey(Candidate, related_name='+', 
+        db_constraint=False, on_delete=models.DO_NOTHING)
+    right = models.ForeignKey(Candidate, related_name='+', 
+        db_constraint=False, on_delete=models.DO_NOTHING)
+    category = models.ForeignKey(CandidateCategory, related_name='+', 
+        db_constraint=False, on_delete=models.DO_NOTHING)
+    winner = models.ForeignKey(Candidate, related_name='+', null=True, 
+        blank=True, db_constraint=False, on_delete=models.DO_NOTHING)
+    winning_side = models.PositiveSmallIntegerField(null=True, blank=True, 
+        choices=Competition.SIDES)
+        
+    def __unicode__(self):
+        return u"%s vs. %s" % (self.left_id, self.right_id)
+        
+        
+class DailyVoteCountManager(models.Manager):
+    def get_day_bounds(self, day):
+        """
+        :returns: ``(start, end)`` datetimes of ``day`` in the current time 
+            zone, aware or naive as ``settings.USE_TZ`` requires
+        :rtype: tuple
+        """
+        bounds = [datetime.datetime.combine(day + datetime.timedelta(days=i), 
+            datetime.time.min) for i in (0, 1)]
+        if settings.USE_TZ:
+            bounds = [timezone.make_aware(value, timezone.get_current_timezone())
+                for value in bounds]
+        return tuple(bounds)
+        
+    def refresh(self, day):
+        """
+        Recounts the votes cast on ``day`` (in the current time zone) in each 
+        category, on both live and archived competitions, replacing any counts
+        already stored for that day.  Each count reads one day's range of the 
+        ``date_voted`` indexes.
+        
+        :returns: total number of votes cast on ``day``
+        :rtype: integer
+        """
+        (start, end) = self.get_day_bounds(day)
+        counts = defaultdict(int)
+        for model in (Competition, ArchivedCompetition):
+            for (category_id, votes) in model.objects.filter(
+                    date_voted__gte=start, date_voted__lt=end).order_by(
+                    ).values_list('category').annotate(Count('id')):
+                counts[category_id] += votes
+                
+        with transaction.atomic():
+            self.filter(day=day).delete()
+            self.bulk_create([self.model(day=day, category_id=category_id, 
+                votes=votes) for (category_id, votes) in counts.items()])
+                
+        return sum(counts.values())
+        
+        
+class DailyVoteCount(models.Model):
+    """
+    Number of votes cast in a :class:`CandidateCategory` on one day, 
+    maintained by the ``refresh_vote_counts`` management command so that 
+    reports (such as the competition admin's date drilldown) needn't scan 
+    the competition table.
+    """
+    day = models.DateField()
+    category = models.ForeignKey(CandidateCategory, 
+        related_name='daily_vote_counts')
+    votes = models.PositiveIntegerField(default=0)
+    
+    objects = DailyVoteCountManager()
+    
+    def __unicode__(self):
+        return u"%s: %s" % (self.day, self.category_id)
+        
+    class Meta:
+        unique_together = [
+            ('day', 'category'),
+        ]
+        
+        
+class QueuedVoteManager(models.Manager):
+    def enqueue(self, competition, winning_side):
+        """
+        Appends a vote on ``competition`` to the queue, with a single 
+        ``INSERT``.  Unsaved, lazily-presented competitions are queued by 
+        their :attr:`~Competition.token`.
+        
+        :rtype: :class:`QueuedVote`
+        """
+        if competition.pk:
+            return self.create(competition_id=competition.pk, 
+                winning_side=winning_side)
+        return self.create(token=competition.token, 
+            winning_side=winning_side)
+            
+    def is_full(self, high_water=None):
+        """
+        :arg high_water: number of queued votes at which the queue is full; 
+            defaults to ``settings.NOTORHOT_SETTINGS['VOTE_QUEUE_HIGH_WATER']``
+            (default 10000)
+        :returns: whether the queue holds at least ``high_water`` votes, 
+            estimated from the span of IDs between its oldest and newest 
+            votes, so that no rows are counted; IDs skipped by rolled-back 
+            inserts only make it err on the side of full.
+        :rtype: boolean
+        """
+        if high_water is None:
+            high_water = get_notorhot_setting('VOTE_QUEUE_HIGH_WATER', 10000)
+        ids = self.values_list('id', flat=True)
+        # two index lookups, where MIN() and MAX() together may scan
+        oldest = list(ids.order_by('id')[:1])
+        newest = list(ids.order_by('-id')[:1])
+        if not oldest or not newest:
+            return False
+        return newest[0] - oldest[0] + 1 >= high_water
+        
+    def drain_batch(self, batch_size=500):
+        """
+        Records up to ``batch_size`` of the oldest queued votes and removes 
+        them from the queue, in one transaction: if recording fails, the 
+        votes stay queued.  Votes on saved competitions are recorded together
+        by :meth:`CompetitionGeneratingManager.record_votes_bulk`, and votes 
+        on lazily-presented competitions one by one, by 
+        :meth:`Competition.record_vote`.  Either way, expiry is judged by, and 
+        the vote dated, the time each vote was queued.
+        
+        :returns: dictionary mapping each of :attr:`Competition.VOTE_RESULTS` 
+            that occurred to the number of votes with that result
+        :rtype: dictionary
+        """
+        RESULTS = Competition.VOTE_RESULTS
+        counts = defaultdict(int)
+        
+        with transaction.atomic():
+            queued = list(self.select_for_update().order_by('id').values_list(
+                'id', 'competition_id', 'token', 'winning_side', 
+                'date_voted')[:batch_size])
+            if not queued:
+                return {}
+                
+            votes = [(competition_id, winner, date_voted) for (pk, 
+                competition_id, token, winner, date_voted) in queued 
+                if competition_id is not None]
+            if votes:
+                for (competition_id, result) in \
+                        Competition.objects.record_votes_bulk(votes):
+                    counts[result] += 1
+                
+            for (pk, competition_id, token, winner, date_voted) in queued:
+                if competition_id is not None:
+                    continue
+                try:
+                    Competition.objects.from_token(token, now=date_voted
+                        ).record_vote(winner, date_voted)
+                except Competition.InvalidToken:
+                    counts[RESULTS.NOT_FOUND] += 1
+                except Competition.AlreadyVoted:
+                    counts[RESULTS.ALREADY_VOTED] += 1
+                else:
+                    counts[RESULTS.OK] += 1
+                    
+            self.filter(id__in=[row[0] for row in queued]).delete()
+            
+        return dict(counts)
+        
+        
+class QueuedVote(models.Model):
+    """
+    A vote accepted by :class:`~notorhot.views.VoteView` but not yet 
+    recorded, when ``settings.NOTORHOT_SETTINGS['VOTE_QUEUE']`` is set.  The
+    ``drain_vote_queue`` management command records queued votes in batches
+    (see :meth:`QueuedVoteManager.drain_batch`).  The reference to the 
+    competition isn't enforced by the database, so queueing a vote costs 
+    only the ``INSERT``.
+    """
+    competition = models.ForeignKey(Competition, related_name='+', null=True,
+        blank=True, db_constraint=False, db_index=False, 
+        on_delete=models.DO_NOTHING)
+    # for lazily-presented competitions
+    token = models.TextField(blank=True)
+    winning_side = models.PositiveSmallIntegerField(choices=Competition.SIDES)
+    date_voted = models.DateTimeField(default=timezone.now)
+    
+    objects = QueuedVoteManager()
+    
+    def __unicode__(self):
+        return u"%s: %s" % (self.competition_id or self.token, 
+            self.get_winning_side_display())
+        
+
+@receiver(post_save, sender=Candidate)
+def invalidate_candidate_index_on_save(sender, instance, created, **kwargs):
+    """
+    Discards the cached :class:`~notorhot.caching.CandidateIndex` for a 
+    :class:`Candidate` instance's category (and its previous category, if 
+    that changed) when the candidate is added, enabled, disabled, or moved.
+    """
+    tracker = instance.tracker
+    if created or tracker.has_changed('is_enabled') or \
+            tracker.has_changed('category'):
+        CandidateIndex(instance.category_id).invalidate()
+        
+        previous_category_id = tracker.previous('category')
+        if previous_category_id not in (None, instance.category_id):
+            CandidateIndex(previous_category_id).invalidate()
+            
+
+@receiver(post_delete, sender=Candidate)
+def invalidate_candidate_index_on_delete(sender, instance, **kwargs):
+    """
+    Discards the cached :class:`~notorhot.caching.CandidateIndex` for a 
+    deleted :class:`Candidate` instance's category.
+    """
+    CandidateIndex(instance.category_id).invalidate()
+
+
+@receiver(post_save, sender=Candidate)
+def bump_leaderboards_on_save(sender, instance, **kwargs):
+    """
+    Marks cached leaderboards (see :class:`~notorhot.caching.LeaderboardCache`)
+    for a :class:`Candidate` instance's category (and its previous category, 
+    if that changed) as out of date whenever the candidate is saved.
+    """
+    LeaderboardCache(instance.category_id).bump()
+    
+    previous_category_id = instance.tracker.previous('category')
+    if previous_category_id not in (None, instance.category_id):
+        LeaderboardCache(previous_category_id).bump()
+        
+
+@receiver(post_delete, sender=Candidate)
+def bump_leaderboards_on_delete(sender, instance, **kwargs):
+    """
+    Marks cached leaderboards for a deleted :class:`Candidate` instance's 
+    category as out of date.
+    """
+    LeaderboardCache(instance.category_id).bump()
+
+
+@receiver(post_save, sender=CandidateCategory)
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=CandidateCategory)
+@receiver(post_delete, sender=Candidate)
+def invalidate_instance_cache(sender, instance, **kwargs):
+    """
+    Discards cached copies (see :class:`~notorhot.caching.InstanceCache`) of
+    a :class:`CandidateCategory` or :class:`Candidate` instance when it is 
+    saved or deleted.
+    """
+    get_instance_cache(sender).invalidate(instance)
+
+
+@receiver(post_syncdb)
+def create_partial_indexes_on_syncdb(sender, created_models, db=None, 
+        **kwargs):
+    """
+    Adds the partial indexes that ``syncdb`` can't create, or the plain 
+    indexes standing in for them (see :mod:`notorhot.indexes`), when it 
+    creates the :class:`Competition` table.
+    """
+    if Competition in created_models:
+        create_partial_indexes(connections[db or 'default'])
+        create_fallback_indexes(connections[db or 'default'])
@@ -0,0 +1,303 @@
+"""
+Pairing strategies, which choose the two candidates for each new competition
+in place of uniform random selection (see
+:meth:`~notorhot.models.CompetitionGeneratingManager.select_from_category`).
+"""
+import bisect
+import heapq
+import random
+import threading
+import time
+
+from django.utils.module_loading import import_by_path
+
+from notorhot.conf import get_notorhot_setting
+from notorhot.ratings import elo_deltas
+
+
+_strategies = {}
+
+def get_pairing_strategy():
+    """
+    Retrieves the pairing strategy configured by
+    ``settings.NOTORHOT_SETTINGS['PAIRING_STRATEGY']``: ``"adaptive"`` for an
+    :class:`AdaptivePairing`, or the dotted path of a
+    :class:`PairingStrategy` subclass.  Strategies are created once per
+    process and then reused.
+
+    :returns: the configured strategy, or ``None`` if candidates are paired
+        uniformly at random (the default)
+    """
+    kind = get_notorhot_setting('PAIRING_STRATEGY', None)
+    if not kind:
+        return None
+    if kind not in _strategies:
+        strategy_class = STRATEGY_CLASSES.get(kind)
+        if strategy_class is None:
+            strategy_class = import_by_path(kind)
+        _strategies[kind] = strategy_class()
+    return _strategies[kind]
+
+
+def record_votes(category_id, votes):
+    """
+    Tells the configured pairing strategy, if any, about votes that have
+    just been recorded.
+
+    :arg votes: list of ``(winner_id, loser_id)`` pairs
+    """
+    strategy = get_pairing_strategy()
+    if strategy is not None and votes:
+        strategy.record_votes(category_id, votes)
+
+
+class PairingStrategy(object):
+    """
+    Base class for pairing strategies.  Subclasses must implement
+    :meth:`choose`.
+    """
+    def choose(self, category):
+        """
+        :arg category: :class:`~notorhot.models.CandidateCategory` of the new
+            competition
+        :returns: ``(left_id, right_id)``: the IDs of two different enabled
+            candidates in ``category``, or ``None`` to fall back to random
+            selection
+        """
+        raise NotImplementedError
+
+    def record_votes(self, category_id, votes):
+        """
+        Called after votes are recorded in this process.  Does nothing by
+        default.
+
+        :arg votes: list of ``(winner_id, loser_id)`` pairs
+        """
+        pass
+
+    def invalidate(self, category_id):
+        """
+        Called when a chosen candidate turns out to be disabled, moved or
+        deleted.  Does nothing by default.
+        """
+        pass
+
+
+class CategoryQueue(object):
+    """
+    In-memory state of one category's enabled candidates for
+    :class:`AdaptivePairing`: each candidate's challenges and rating, kept in
+
+    * a heap of ``(challenges, tie_breaker, id)`` entries, from which the
+      least-challenged candidate is taken in ``O(log n)``; entries
+      superseded by a later challenge are skipped when they surface
+    * a list of ``(rating, id)`` sorted by rating, in which candidates of
+      similar rating are found by bisection
+
+    Callers hold :attr:`lock` while using or changing the queue.
+
+    :param rows: ``(id, challenges, rating)`` of each enabled candidate (see
+        :attr:`AdaptivePairing.uses_ratings`)
+    """
+    def __init__(self, rows):
+        self.lock = threading.Lock()
+        self.loaded = time.time()
+        self.challenges = {}
+        self.ratings = {}
+        self.by_rating = []
+        for (pk, challenges, rating) in rows:
+            self.challenges[pk] = challenges
+            self.ratings[pk] = rating
+            self.by_rating.append((rating, pk))
+        self.by_rating.sort()
+        self.rebuild_heap()
+
+    def __len__(self):
+        return len(self.challenges)
+
+    def rebuild_heap(self):
+        self.heap = [(challenges, random.random(), pk) for (pk, challenges)
+            in self.challenges.iteritems()]
+        heapq.heapify(self.heap)
+
+    def least_challenged(self):
+        """
+        :returns: the ID of a candidate with the fewest challenges (chosen at
+            random among ties)
+        """
+        while True:
+            (challenges, tie_breaker, pk) = self.heap[0]
+            if self.challenges[pk] == challenges:
+                return pk
+            heapq.heappop(self.heap)
+
+    def add_challenge(self, pk):
+        self.challenges[pk] += 1
+        heapq.heappush(self.heap, (self.challenges[pk], random.random(), pk))
+        # superseded entries are only discarded when they reach the top
+        if len(self.heap) > 4 * len(self.challenges):
+            self.rebuild_heap()
+
+    def random_candidate(self):
+        return self.by_rating[random.randrange(len(self.by_rating))][1]
+
+    def nearest(self, pk, neighbours):
+        """
+        :returns: IDs of up to ``neighbours`` candidates rated just above
+            ``pk``'s candidate and as many just below
+        """
+        index = bisect.bisect_left(self.by_rating, (self.ratings[pk], pk))
+        return [other for (rating, other) in self.by_rating[max(0, index -
+            neighbours):index + neighbours + 1] if other != pk]
+
+    def set_rating(self, pk, rating):
+        index = bisect.bisect_left(self.by_rating, (self.ratings[pk], pk))
+        del self.by_rating[index]
+        self.ratings[pk] = rating
+        bisect.insort(self.by_rating, (rating, pk))
+
+
+class AdaptivePairing(PairingStrategy):
+    """
+    Spends votes where they tell the most about the ranking.  The first
+    candidate is the one with the fewest challenges, so that new and rarely
+    shown candidates are placed quickly; the second is, of its ``neighbours``
+    nearest rivals in Elo rating on either side, the one with the fewest
+    challenges, since a vote between candidates of similar strength is the
+    least predictable.  With probability ``exploration``, the second is
+    drawn at random instead, so that distant parts of the ranking stay
+    connected.  If ``settings.NOTORHOT_SETTINGS['ELO_RATINGS']`` is 
+    ``False``, stored ratings don't follow the votes, so rivals are found by
+    win percentage instead.
+
+    Each process keeps a :class:`CategoryQueue` per category in memory, so
+    choosing a pair costs no queries.  Challenges are counted as pairs are
+    chosen, and ratings follow the votes recorded in this process; the
+    whole queue is reloaded from the database every ``refresh`` seconds to
+    take in other processes' votes and changes to the category.  A reload
+    holds no lock: until it finishes, the category's old queue stays in 
+    use.  At most ``max_candidates`` candidates, the least challenged, are 
+    loaded per category.
+
+    The parameters default to ``settings.NOTORHOT_SETTINGS``'
+    ``'ADAPTIVE_PAIRING_NEIGHBOURS'`` (default 10),
+    ``'ADAPTIVE_PAIRING_EXPLORATION'`` (default 0.1),
+    ``'ADAPTIVE_PAIRING_REFRESH'`` (default 60) and
+    ``'ADAPTIVE_PAIRING_MAX_CANDIDATES'`` (default 10000).
+    """
+    def __init__(self, neighbours=None, exploration=None, refresh=None, 
+            max_candidates=None):
+        if neighbours is None:
+            neighbours = get_notorhot_setting('ADAPTIVE_PAIRING_NEIGHBOURS', 10)
+        if exploration is None:
+            exploration = get_notorhot_setting('ADAPTIVE_PAIRING_EXPLORATION',
+                0.1)
+        if refresh is None:
+            refresh = get_notorhot_setting('ADAPTIVE_PAIRING_REFRESH', 60)
+        if max_candidates is None:
+            max_candidates = get_notorhot_setting(
+                'ADAPTIVE_PAIRING_MAX_CANDIDATES', 10000)
+        if neighbours < 1:
+            raise ValueError(u"Adaptive pairing needs at least one neighbour "
+                u"on either side.")
+        self.neighbours = neighbours
+        self.exploration = exploration
+        self.refresh = refresh
+        self.max_candidates = max_candidates
+        self.queues = {}
+        # guards queues and loading; each queue has its own lock besides
+        self.lock = threading.Lock()
+        self.loading = set()
+
+    @property
+    def uses_ratings(self):
+        """
+        Whether candidates are compared by Elo rating, which is only stored 
+        as votes come in if ``settings.NOTORHOT_SETTINGS['ELO_RATINGS']`` 
+        isn't ``False``; otherwise they're compared by win percentage.
+        """
+        return get_notorhot_setting('ELO_RATINGS', True)
+
+    def load(self, category_id):
+        """
+        :returns: a new :class:`CategoryQueue` for the category's enabled
+            candidates (at most :attr:`max_candidates`, the least 
+            challenged), read with one query
+        """
+        from notorhot.models import Candidate
+        return CategoryQueue(Candidate.enabled.filter(category=category_id
+            ).order_by('challenges').values_list('id', 'challenges', 
+            'rating' if self.uses_ratings else 'win_pct'
+            )[:self.max_candidates].iterator())
+
+    def get_queue(self, category_id):
+        """
+        :returns: the category's queue, loaded first if it is missing or 
+            older than :attr:`refresh` seconds.  While one thread reloads a
+            stale queue, others keep using it.
+        """
+        queue = self.queues.get(category_id)
+        if queue is not None and time.time() - queue.loaded <= self.refresh:
+            return queue
+            
+        with self.lock:
+            reloading = category_id in self.loading
+            self.loading.add(category_id)
+        if reloading and queue is not None:
+            return queue
+            
+        try:
+            queue = self.load(category_id)
+        finally:
+            with self.lock:
+                self.loading.discard(category_id)
+        with self.lock:
+            self.queues[category_id] = queue
+        return queue
+
+    def choose(self, category):
+        queue = self.get_queue(category.pk)
+        with queue.lock:
+            if len(queue) < 2:
+                return None
+
+            first = queue.least_challenged()
+            second = first
+            if random.random() < self.exploration:
+                while second == first:
+                    second = queue.random_candidate()
+            else:
+                second = min(queue.nearest(first, self.neighbours),
+                    key=lambda pk: (queue.challenges[pk], random.random()))
+
+            queue.add_challenge(first)
+            queue.add_challenge(second)
+
+        pair = [first, second]
+        random.shuffle(pair)
+        return tuple(pair)
+
+    def record_votes(self, category_id, votes):
+        queue = self.queues.get(category_id)
+        if queue is None or not self.uses_ratings:
+            return
+        with queue.lock:
+            for (winner_id, loser_id) in votes:
+                if winner_id not in queue.ratings or \
+                        loser_id not in queue.ratings:
+                    continue
+                (winner_delta, loser_delta) = elo_deltas(
+                    queue.ratings[winner_id], queue.ratings[loser_id])
+                queue.set_rating(winner_id, queue.ratings[winner_id] +
+                    winner_delta)
+                queue.set_rating(loser_id, queue.ratings[loser_id] +
+                    loser_delta)
+
+    def invalidate(self, category_id):
+        with self.lock:
+            self.queues.pop(category_id, None)
+
+
+STRATEGY_CLASSES = {
+    'adaptive': AdaptivePairing,
+}
@@ -0,0 +1,47 @@
+from notorhot.conf import get_notorhot_setting
+
+
+INITIAL_RATING = 1500.0
+
+
+def expected_score(rating, opponent_rating):
+    """
+    :returns: probability, under the Elo model, that a candidate rated
+        ``rating`` beats one rated ``opponent_rating``
+    :rtype: float
+    """
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+
+def elo_deltas(winner_rating, loser_rating, k_factor=None):
+    """
+    Calculates the Elo rating changes for a single vote.
+
+    :arg k_factor: maximum rating change per vote; defaults to
+        ``settings.NOTORHOT_SETTINGS['ELO_K_FACTOR']`` (default 32)
+    :returns: ``(winner_delta, loser_delta)``; the two sum to zero
+    :rtype: tuple
+    """
+    if k_factor is None:
+        k_factor = get_notorhot_setting('ELO_K_FACTOR', 32)
+    delta = k_factor * (1.0 - expected_score(winner_rating, loser_rating))
+    return (delta, -delta)
+
+
+def apply_votes(ratings, votes, k_factor=None):
+    """
+    Applies a sequence of votes to a dictionary of ratings, in order.
+
+    :arg ratings: dictionary mapping candidate IDs to ratings; updated in
+        place.  Candidates missing from it start at :data:`INITIAL_RATING`.
+    :arg votes: iterable of ``(winner_id, loser_id)`` pairs
+    :returns: ``ratings``
+    :rtype: dictionary
+    """
+    for (winner_id, loser_id) in votes:
+        (winner_delta, loser_delta) = elo_deltas(
+            ratings.setdefault(winner_id, INITIAL_RATING),
+            ratings.setdefault(loser_id, INITIAL_RATING), k_factor)
+        ratings[winner_id] += winner_delta
+        ratings[loser_id] += loser_delta
+    return ratings
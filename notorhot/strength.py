@@ -0,0 +1,152 @@
+"""
+Bradley-Terry strength estimates, fitted with NumPy.
+
+Under the Bradley-Terry model, each candidate ``i`` has a strength ``p_i``
+and beats candidate ``j`` with probability ``p_i / (p_i + p_j)``.  Unlike
+win percentage, the estimate takes into account whom each candidate was up
+against.  Strengths are reported on a log scale centred on zero, so
+candidate ``i`` beats ``j`` with probability
+``1 / (1 + exp(strength_j - strength_i))``.
+
+NumPy is required by this module only.
+"""
+import numpy
+
+
+class PairwiseCounts(object):
+    """
+    Accumulates the votes between a fixed set of candidates into a compact
+    summary: each candidate's number of wins, and the number of votes
+    between each pair of candidates that have met.  Memory use depends on
+    the number of candidates and of distinct pairs, not on the number of
+    votes, so votes can be added in chunks from a stream of any length.
+
+    :param candidate_ids: IDs of all the candidates votes may involve
+    """
+    def __init__(self, candidate_ids):
+        self.ids = numpy.unique(numpy.asarray(list(candidate_ids),
+            dtype=numpy.int64))
+        self.wins = numpy.zeros(len(self.ids), dtype=numpy.int64)
+        # pairs are keyed as lower_index * num_candidates + higher_index
+        self.pair_keys = numpy.zeros(0, dtype=numpy.int64)
+        self.pair_counts = numpy.zeros(0, dtype=numpy.int64)
+        self.num_votes = 0
+
+    @property
+    def num_candidates(self):
+        return len(self.ids)
+
+    def get_indexes(self, ids):
+        """
+        :returns: positions of ``ids`` in :attr:`ids`, or ``-1`` for IDs of
+            unknown candidates
+        :rtype: :class:`numpy.ndarray`
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        indexes = numpy.searchsorted(self.ids, ids)
+        indexes[indexes == len(self.ids)] = 0
+        if len(self.ids):
+            indexes[self.ids[indexes] != ids] = -1
+        else:
+            indexes[:] = -1
+        return indexes
+
+    def add(self, winner_ids, loser_ids):
+        """
+        Adds a chunk of votes.  Votes involving unknown candidates are
+        ignored.
+
+        :arg winner_ids: sequence of the winners' IDs
+        :arg loser_ids: sequence of the losers' IDs, in the same order
+        :returns: number of votes added
+        :rtype: integer
+        """
+        winners = self.get_indexes(winner_ids)
+        losers = self.get_indexes(loser_ids)
+        known = (winners >= 0) & (losers >= 0) & (winners != losers)
+        (winners, losers) = (winners[known], losers[known])
+        if not len(winners):
+            return 0
+
+        self.wins += numpy.bincount(winners, minlength=self.num_candidates)
+
+        keys = (numpy.minimum(winners, losers) * self.num_candidates +
+            numpy.maximum(winners, losers))
+        # only the chunk is sorted; it's then merged into the running totals,
+        # which are kept sorted, in linear time
+        (keys, counts) = numpy.unique(keys, return_counts=True)
+        positions = numpy.searchsorted(self.pair_keys, keys)
+        found = positions < len(self.pair_keys)
+        found[found] = self.pair_keys[positions[found]] == keys[found]
+        self.pair_counts[positions[found]] += counts[found]
+        new = ~found
+        if new.any():
+            self.pair_keys = numpy.insert(self.pair_keys, positions[new],
+                keys[new])
+            self.pair_counts = numpy.insert(self.pair_counts, positions[new],
+                counts[new])
+
+        self.num_votes += len(winners)
+        return len(winners)
+
+    def get_pairs(self):
+        """
+        :returns: ``(first, second, count)`` arrays: the indexes of the
+            candidates in each pair that have met, and the number of votes
+            between them
+        """
+        return (self.pair_keys // self.num_candidates,
+            self.pair_keys % self.num_candidates, self.pair_counts)
+
+
+def fit_bradley_terry(counts, prior=1.0, max_iterations=1000,
+        tolerance=1e-9):
+    """
+    Fits Bradley-Terry strengths to accumulated votes with Hunter's
+    minorization-maximization (MM) iterations, each of which is a few
+    vectorized passes over the pairs that have met.
+
+    To keep estimates finite for candidates that have never won (or never
+    lost), and to tie together candidates that have never met, each
+    candidate is credited with ``prior`` wins and ``prior`` losses against a
+    virtual opponent of average strength.
+
+    :arg counts: :class:`PairwiseCounts`
+    :arg prior: number of virtual wins and losses per candidate; must be
+        positive if any candidate may have no wins
+    :arg max_iterations: maximum number of MM iterations
+    :arg tolerance: iteration stops once no log-strength changes by more
+        than this
+    :returns: ``(strengths, iterations)``, where ``strengths`` holds each
+        candidate's log-strength, in the order of ``counts.ids``, shifted so
+        that their mean is zero
+    """
+    num = counts.num_candidates
+    if not num:
+        return (numpy.zeros(0), 0)
+
+    (first, second, pair_counts) = counts.get_pairs()
+    pair_counts = pair_counts.astype(numpy.float64)
+    wins = counts.wins.astype(numpy.float64) + prior
+    strengths = numpy.ones(num)
+    log_strengths = numpy.zeros(num)
+
+    iterations = 0
+    for iterations in xrange(1, max_iterations + 1):
+        per_pair = pair_counts / (strengths[first] + strengths[second])
+        denominators = (numpy.bincount(first, per_pair, minlength=num) +
+            numpy.bincount(second, per_pair, minlength=num) +
+            2.0 * prior / (strengths + 1.0))
+        strengths = wins / denominators
+        # only ratios of strengths matter; rescaling to a geometric mean of 
+        # one keeps the virtual opponent average, and stops the iterations 
+        # from slowly drifting in scale
+        strengths /= numpy.exp(numpy.log(strengths).mean())
+
+        new_log_strengths = numpy.log(strengths)
+        change = numpy.abs(new_log_strengths - log_strengths).max()
+        log_strengths = new_log_strengths
+        if change < tolerance:
+            break
+
+    return (log_strengths - log_strengths.mean(), iterations)
@@ -1,8 +1,37 @@
 from notorhot._tests.models import NotorHotCategoryTestCase, \
-    NotorHotCandidateTestCase, NotorHotCompetitionTestCase
+    CompetitionGenerationQueryTestCase, CompetitionPoolTestCase, \
+    LazyCompetitionTestCase, CompetitionVoteRecordingTestCase, \
+    ConcurrentVoteTestCase, BulkVoteTestCase, CompetitionExpiryTestCase, \
+    NotorHotCandidateTestCase, NotorHotCompetitionTestCase, \
+    CompetitionIndexTestCase, PresentValuesTestCase, QueuedVoteTestCase, \
+    CompetitionIndexesTestCase
     
 from notorhot._tests.forms import NotorHotVoteFormTestCase
 
+from notorhot._tests.caching import CandidateIndexTestCase, \
+    LeaderboardCacheTestCase, InstanceCacheTestCase
+
+from notorhot._tests.counters import LocalCounterBufferTestCase, \
+    CacheCounterBufferTestCase, ShardedCounterBufferTestCase
+
+from notorhot._tests.commands import FillCompetitionPoolsTestCase, \
+    ReplayVotesTestCase, RebuildRatingsTestCase, PurgeCompetitionsTestCase, \
+    RefreshVoteCountsTestCase, PrewarmThumbnailsTestCase, \
+    FitStrengthsCommandTestCase, ExportCommandTestCase, DrainVoteQueueTestCase
+
+from notorhot._tests.thumbnails import ThumbnailPregenerationTestCase
+
+from notorhot._tests.strength import BradleyTerryTestCase, \
+    FitStrengthsTestCase
+
+from notorhot._tests.export import ExportTestCase
+
+from notorhot._tests.pairing import CategoryQueueTestCase, \
+    AdaptivePairingTestCase
+
+from notorhot._tests.admin import CompetitionAdminTestCase, \
+    CategoryAdminTestCase, CandidateAdminTestCase
+
 from notorhot._tests.views import CompetitionViewTestCase, VoteViewTestCase, \
     CandidateViewTestCase, LeaderboardViewTestCase, CategoryListViewTestCase
 
@@ -14,5 +43,7 @@ from notorhot._tests.utils import NeverCacheMixinTestCase, \
 from notorhot._tests.integration import CompetitionViewTestCase as CompTestCast, \
     VoteViewTestCase as VoteTestCase, CandidateViewTestCase as CandTestCase, \
     LeaderboardViewTestCase as LeadTestCase, \
-    CategoryListViewTestCase as CatTestCase, AbsoluteURLTestCase
+    CategoryListViewTestCase as CatTestCase, AbsoluteURLTestCase, \
+    BatchVoteViewTestCase, CompetitionAPIViewTestCase, VoteAPIViewTestCase, \
+    ExportViewTestCase
 
@@ -0,0 +1,145 @@
+import logging
+import Queue
+import threading
+
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import settings, defaults as default_settings
+from sorl.thumbnail.images import ImageFile
+
+from notorhot.conf import get_notorhot_setting
+
+
+logger = logging.getLogger(__name__)
+
+# (geometry, options) of every thumbnail the bundled templates and admin show:
+# competition_candidate.html and Competition.get_summary(), 
+# candidate_main.html, and CandidateAdmin
+DEFAULT_THUMBNAIL_GEOMETRIES = (
+    ('300x300', { 'crop': 'center', }),
+    ('300x600', {}),
+    ('60x60', { 'crop': 'center', }),
+)
+
+
+def get_thumbnail_geometries():
+    """
+    :returns: the ``(geometry, options)`` pairs of the thumbnails to 
+        pre-generate, from ``settings.NOTORHOT_SETTINGS['THUMBNAIL_GEOMETRIES']``
+        (defaults to :data:`DEFAULT_THUMBNAIL_GEOMETRIES`); extend this if 
+        your templates show other sizes
+    """
+    return get_notorhot_setting('THUMBNAIL_GEOMETRIES', 
+        DEFAULT_THUMBNAIL_GEOMETRIES)
+
+
+def get_cached_thumbnail(file_, geometry_string, **options):
+    """
+    Looks up a thumbnail as :func:`sorl.thumbnail.get_thumbnail` would, but 
+    only in sorl's key-value store: the source image is never opened, and a 
+    thumbnail that hasn't been generated yet is not generated.
+    
+    :returns: the thumbnail, or ``None`` if it hasn't been generated
+    :rtype: :class:`sorl.thumbnail.images.ImageFile`
+    """
+    backend = default.backend
+    for (key, value) in backend.default_options.iteritems():
+        options.setdefault(key, value)
+    for (key, attr) in backend.extra_options:
+        value = getattr(settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+            
+    name = backend._get_thumbnail_filename(ImageFile(file_), geometry_string, 
+        options)
+    return default.kvstore.get(ImageFile(name, default.storage))
+
+
+def has_thumbnails(file_):
+    """
+    :returns: whether every configured thumbnail (see 
+        :func:`get_thumbnail_geometries`) of ``file_`` has been generated; 
+        checked in the key-value store only
+    :rtype: boolean
+    """
+    return all(get_cached_thumbnail(file_, geometry, **options) is not None 
+        for (geometry, options) in get_thumbnail_geometries())
+
+
+def generate_thumbnails(file_):
+    """
+    Generates every configured thumbnail of ``file_`` that hasn't already 
+    been generated.
+    
+    :arg file_: image file (e.g. a :class:`~notorhot.models.Candidate`'s 
+        ``pic``), or the name of one in the default storage
+    :returns: number of thumbnails
+    :rtype: integer
+    """
+    geometries = get_thumbnail_geometries()
+    for (geometry, options) in geometries:
+        get_thumbnail(file_, geometry, **options)
+    return len(geometries)
+
+
+class ThumbnailWorker(object):
+    """
+    Generates thumbnails (see :func:`generate_thumbnails`) in a daemon thread
+    of the current process, one image at a time, so the request that saved 
+    an image doesn't wait for them.  Images still queued when the process 
+    exits are skipped; the ``prewarm_thumbnails`` management command catches
+    up on them.
+    """
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        
+    def add(self, file_):
+        """
+        Queues ``file_``'s thumbnails for generation.
+        
+        :arg file_: image file, or the name of one in the default storage
+        """
+        # the file's name and storage only; not the model instance it's on
+        self.queue.put(ImageFile(file_))
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, 
+                    name='notorhot-thumbnails')
+                self.thread.daemon = True
+                self.thread.start()
+                
+    def run(self):
+        while True:
+            image = self.queue.get()
+            try:
+                generate_thumbnails(image)
+            except Exception:
+                logger.exception(u"Thumbnails of %s could not be generated", 
+                    image.name)
+            finally:
+                self.queue.task_done()
+                
+                
+_worker = ThumbnailWorker()
+
+def pregenerate_thumbnails(file_):
+    """
+    Generates ``file_``'s thumbnails as configured by 
+    ``settings.NOTORHOT_SETTINGS['THUMBNAIL_PREGENERATION']``: ``"thread"``
+    to queue them for a :class:`ThumbnailWorker`, ``"sync"`` to generate 
+    them immediately.  Does nothing by default, leaving thumbnails to be 
+    generated when first displayed.
+    
+    :returns: whether thumbnails were generated or queued
+    :rtype: boolean
+    """
+    mode = get_notorhot_setting('THUMBNAIL_PREGENERATION', None)
+    if not file_ or not mode:
+        return False
+        
+    if mode == 'sync':
+        generate_thumbnails(file_)
+    else:
+        _worker.add(file_)
+    return True
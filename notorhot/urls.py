@@ -1,12 +1,21 @@
 from django.conf.urls import patterns, include, url
 
 from notorhot.views import CompetitionView, VoteView, LeaderboardView, \
-    CandidateView, CategoryListView
+    CandidateView, CategoryListView, TokenVoteView, BatchVoteView, ExportView, \
+    CompetitionAPIView, VoteAPIView
 
 urlpatterns = patterns('notorhot.views',    
     url(r'^$', CategoryListView.as_view(), name='notorhot_categories'),
     url(r'^(?P<slug>[\w-]+)/$', CompetitionView.as_view(), name='notorhot_competition'),
     url(r'^vote/(?P<pk>\d+)/$', VoteView.as_view(), name='notorhot_vote'),
+    url(r'^vote/token/$', TokenVoteView.as_view(), name='notorhot_token_vote'),
+    url(r'^vote/batch/$', BatchVoteView.as_view(), name='notorhot_batch_vote'),
+    url(r'^api/(?P<category_slug>[\w-]+)/competitions/$', 
+        CompetitionAPIView.as_view(), name='notorhot_api_competitions'),
+    url(r'^api/(?P<category_slug>[\w-]+)/vote/$', VoteAPIView.as_view(), 
+        name='notorhot_api_vote'),
+    url(r'^export/(?P<kind>competitions|candidates)\.(?P<format>csv|jsonl)$', 
+        ExportView.as_view(), name='notorhot_export'),
     url(r'^candidate/(?P<category_slug>[\w-]+)/(?P<slug>[\w-]+)/$', CandidateView.as_view(), 
         name='notorhot_candidate'),
     url(r'^(?P<category_slug>[\w-]+)/leaders/$', LeaderboardView.as_view(), name='notorhot_leaders'),
@@ -4,6 +4,7 @@ from django.utils.functional import lazy_property
 from django.views.decorators.cache import never_cache
 from django.views.generic.detail import SingleObjectMixin
 
+from notorhot.caching import get_instance_cache
 from notorhot.models import CandidateCategory
 
 
@@ -60,7 +61,8 @@ class CategoryMixin(object):
         """
         Retrieves a :class:`~notorhot.models.CandidateCategory` instance based 
         on the view keyword argument with the name indicated in the 
-        ``slug_name`` parameter to this method.
+        ``slug_name`` parameter to this method, through the category 
+        :class:`~notorhot.caching.InstanceCache`.
         
         :param string slug_name: name of the view keyword argument containing 
             the category slug
@@ -70,7 +72,8 @@ class CategoryMixin(object):
         cat_slug = self.kwargs.get(slug_name)
         if cat_slug:
             try:
-                cat = CandidateCategory.objects.get(slug=cat_slug)
+                cat = get_instance_cache(CandidateCategory).get_by_slug(
+                    cat_slug)
             except CandidateCategory.DoesNotExist:
                 pass
         
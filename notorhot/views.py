@@ -1,18 +1,42 @@
+import json
+
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseRedirect, Http404
-from django.views.generic.base import TemplateView
+from django.http import HttpResponse, HttpResponseRedirect, \
+    HttpResponseBadRequest, Http404, StreamingHttpResponse
+from django.views.generic.base import TemplateView, View
 from django.views.generic.edit import FormView
 from django.views.generic.detail import DetailView, BaseDetailView, \
     SingleObjectTemplateResponseMixin
 from django.views.decorators.cache import never_cache
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.decorators import method_decorator
+from django.core.signing import BadSignature
 from django.core.urlresolvers import reverse_lazy
 
-from notorhot.models import Competition, Candidate, CandidateCategory
+from notorhot.caching import LeaderboardCache, get_instance_cache, \
+    get_related_instance
+from notorhot.conf import get_notorhot_setting
+from notorhot.counters import get_counter_buffer
+from notorhot.export import EXPORT_KINDS, EXPORT_FORMATS, iter_export, \
+    parse_day
+from notorhot.models import Competition, Candidate, CandidateCategory, \
+    QueuedVote
+from notorhot.thumbnails import get_cached_thumbnail
 from notorhot.forms import VoteForm
 from notorhot.utils import NeverCacheMixin, WorkingSingleObjectMixin, \
     CategoryMixin, ResetContentTemplateResponse
 
 
+# cookie used for previous vote data in place of the session; see 
+# CompetitionView.get_previous_vote()
+PREVIOUS_VOTE_COOKIE = 'notorhot_previous_vote'
+PREVIOUS_VOTE_SALT = 'notorhot.previous_vote'
+# likewise for the candidates chosen in advance for the next competition; see
+# CompetitionView.get_next_pair()
+NEXT_PAIR_COOKIE = 'notorhot_next_pair'
+NEXT_PAIR_SALT = 'notorhot.next_pair'
+
+
 class CompetitionView(NeverCacheMixin, WorkingSingleObjectMixin, CategoryMixin, 
         TemplateView):
     """
@@ -22,6 +46,29 @@ class CompetitionView(NeverCacheMixin, WorkingSingleObjectMixin, CategoryMixin,
     insufficient_data_template_name = 'notorhot/insufficient_data.html'
     http_method_names = ['get',]
     queryset = CandidateCategory.public.all()
+    # previous vote known in advance, e.g. when rendered by VoteView
+    previous_vote = None
+    # candidates chosen for the following competition, if preloading
+    next_pair = None
+    preload_thumbnail_geometry = '300x300'
+    
+    def get_object(self, queryset=None):
+        """
+        Looks the category up through its 
+        :class:`~notorhot.caching.InstanceCache`, unless a ``queryset`` is 
+        given.
+        """
+        if queryset is not None:
+            return super(CompetitionView, self).get_object(queryset)
+            
+        try:
+            cat = get_instance_cache(CandidateCategory).get_by_slug(
+                self.kwargs.get(self.slug_url_kwarg))
+        except CandidateCategory.DoesNotExist:
+            raise Http404
+        if not cat.is_public:
+            raise Http404
+        return cat
     
     def get_category(self):
         return self.object
@@ -30,25 +77,105 @@ class CompetitionView(NeverCacheMixin, WorkingSingleObjectMixin, CategoryMixin,
         """
         If available, retrieves information saved in the session about the 
         last :class:`~notorhot.models.Competition` the user voted on.
+        
+        If ``settings.NOTORHOT_SETTINGS['PREVIOUS_VOTE_STORAGE']`` is 
+        ``'cookie'``, returns instead the summary of that competition (see 
+        :meth:`~notorhot.models.Competition.get_summary`) saved in a signed 
+        cookie by :class:`VoteView`, without touching the session or the 
+        database.
+        
+        If :attr:`previous_vote` was set when the view was created, returns 
+        that instead.
         """
+        if self.previous_vote is not None:
+            return self.previous_vote
+            
+        if get_notorhot_setting('PREVIOUS_VOTE_STORAGE', 'session') == 'cookie':
+            try:
+                return json.loads(self.request.get_signed_cookie(
+                    PREVIOUS_VOTE_COOKIE, salt=PREVIOUS_VOTE_SALT))
+            except (KeyError, BadSignature, ValueError):
+                return None
+                
         previous = None
         previous_pk = self.request.session.get('last_vote_pk')
         
         if previous_pk is not None:
             try:
-                previous = Competition.objects.get(pk=previous_pk)
+                previous = Competition.objects.select_related('left', 'right', 
+                    'winner').get(pk=previous_pk)
             except Competition.DoesNotExist:
                 pass
+                
+        side = self.request.session.get('last_vote_side')
+        if previous is not None and previous.winner_id is None and side:
+            # the vote was queued, and hasn't been recorded yet
+            previous.winning_side = side
+            previous.winner = previous.left \
+                if side == Competition.SIDES.LEFT else previous.right
         
         return previous
         
+    def preloads_next_competition(self):
+        return get_notorhot_setting('PRELOAD_NEXT_COMPETITION', False)
+        
+    def uses_cookies(self):
+        return get_notorhot_setting('PREVIOUS_VOTE_STORAGE', 
+            'session') == 'cookie'
+        
+    def get_next_pair(self):
+        """
+        Retrieves the IDs of the candidates that the previous page chose in 
+        advance for this competition, from the session or (if 
+        ``settings.NOTORHOT_SETTINGS['PREVIOUS_VOTE_STORAGE']`` is 
+        ``'cookie'``) a signed cookie.
+        
+        :returns: list of two IDs, or ``None`` if none were chosen for this 
+            category
+        """
+        if self.uses_cookies():
+            try:
+                value = json.loads(self.request.get_signed_cookie(
+                    NEXT_PAIR_COOKIE, salt=NEXT_PAIR_SALT))
+            except (KeyError, BadSignature, ValueError):
+                return None
+        else:
+            value = self.request.session.get('next_pair')
+            
+        if not isinstance(value, list) or len(value) != 3 or \
+                value[0] != self.object.pk:
+            return None
+        return value[1:]
+        
+    def get_next_thumbnails(self, candidates):
+        """
+        :returns: URLs of ``candidates``' thumbnails, as displayed in the 
+            competition template, that have already been generated
+        """
+        urls = []
+        for candidate in candidates:
+            if candidate.pic:
+                thumbnail = get_cached_thumbnail(candidate.pic, 
+                    self.preload_thumbnail_geometry, crop='center')
+                if thumbnail is not None:
+                    urls.append(thumbnail.url)
+        return urls
+        
     def generate_competition(self):
+        if self.preloads_next_competition():
+            return self.object.generate_competition(self.get_next_pair())
         return self.object.generate_competition()
     
     def get_context_data(self, *args, **kwargs):
         """
         Adds new :class:`~notorhot.models.Competition` instance and (if 
         appropriate) previous vote data to context.
+        
+        If ``settings.NOTORHOT_SETTINGS['PRELOAD_NEXT_COMPETITION']`` is set, 
+        the competition uses the candidates chosen in advance by the previous
+        page, if any; the candidates for the following one are chosen now,
+        and the URLs of their thumbnails added to the context as 
+        ``next_thumbnails`` so they can be prefetched.
         """
         context = super(CompetitionView, self).get_context_data(*args, **kwargs)
         
@@ -62,8 +189,33 @@ class CompetitionView(NeverCacheMixin, WorkingSingleObjectMixin, CategoryMixin,
         context.update({
             'competition': competition,
             'previous_vote': self.get_previous_vote(),
-        })        
+        })
+        
+        if self.preloads_next_competition():
+            candidates = Competition.objects.select_from_category(self.object)
+            self.next_pair = [self.object.pk] + [candidate.pk 
+                for candidate in candidates]
+            if not self.uses_cookies():
+                self.request.session['next_pair'] = self.next_pair
+            context['next_thumbnails'] = self.get_next_thumbnails(candidates)
+            
         return context
+        
+    def render_to_response(self, context, **response_kwargs):
+        """
+        Adds ``Link: rel=prefetch`` headers for the next competition's 
+        thumbnails, and stores its candidates in a signed cookie if 
+        appropriate.
+        """
+        response = super(CompetitionView, self).render_to_response(context, 
+            **response_kwargs)
+        if context.get('next_thumbnails'):
+            response['Link'] = ', '.join('<%s>; rel=prefetch' % url 
+                for url in context['next_thumbnails'])
+        if self.next_pair is not None and self.uses_cookies():
+            response.set_signed_cookie(NEXT_PAIR_COOKIE, 
+                json.dumps(self.next_pair), salt=NEXT_PAIR_SALT, httponly=True)
+        return response
 
 # This might be simpler as an UpdateView, except that the form isn't a ModelForm.
 # Oh well.
@@ -71,12 +223,63 @@ class VoteView(NeverCacheMixin, WorkingSingleObjectMixin, FormView):
     """
     Processes a vote on a :class:`~notorhot.models.Competition` and adds the 
     :class:`~notorhot.models.Competition` instance's ID to the session as 
-    previous vote data (``reqest.session['last_vote_pk']``).
+    previous vote data (``reqest.session['last_vote_pk']``, with the winning 
+    side in ``request.session['last_vote_side']``); or, if 
+    ``settings.NOTORHOT_SETTINGS['PREVIOUS_VOTE_STORAGE']`` is ``'cookie'``,
+    saves a summary of the competition in a signed cookie instead.
+    
+    If ``settings.NOTORHOT_SETTINGS['VOTE_RESPONSE']`` is ``'render'``, a 
+    successful vote is instead answered with the next competition, rendered 
+    in the response to the ``POST`` along with the previous vote, rather 
+    than with a redirect; nothing is stored for the previous vote.  The 
+    competition's ID (or token) serves as a one-time token: resubmitting it 
+    (e.g. by refreshing the page) records nothing and renders another new 
+    competition.
     """
     template_name = 'notorhot/invalid_vote.html'
     http_method_names = ['post',]
     form_class = VoteForm
-    queryset = Competition.votable.all()
+    # category is needed both to check publicity and for the success URL; 
+    # candidates for counter updates and previous vote data
+    queryset = Competition.votable.select_related('category', 'left', 'right')
+    # seconds a client is asked to wait when the vote queue is full
+    overload_retry_after = 5
+    
+    def renders_next_competition(self):
+        return get_notorhot_setting('VOTE_RESPONSE', 'redirect') == 'render'
+        
+    def get_queryset(self):
+        """
+        When rendering the next competition, finds competitions that have 
+        already been voted on too, so that a resubmitted vote isn't a 404; 
+        pooled competitions, which haven't been presented, are still excluded.
+        """
+        if self.renders_next_competition():
+            return Competition.objects.filter(is_pooled=False).select_related(
+                'category', 'left', 'right')
+        return super(VoteView, self).get_queryset()
+        
+    def post(self, request, *args, **kwargs):
+        if self.object.date_voted is not None and \
+                self.renders_next_competition():
+            if not get_related_instance(self.object, 'category').is_public:
+                raise Http404
+            # the one-time token has been used; most likely the page it 
+            # rendered was refreshed
+            return self.render_next_competition(None)
+        return super(VoteView, self).post(request, *args, **kwargs)
+        
+    def render_next_competition(self, previous_vote):
+        """
+        Renders a new competition in the competition's category, as 
+        :class:`CompetitionView` would, with ``previous_vote`` in place of 
+        the stored previous vote.
+        """
+        category = get_related_instance(self.object, 'category')
+        view = CompetitionView(request=self.request, args=(), 
+            kwargs={ 'slug': category.slug, }, previous_vote=previous_vote)
+        view.object = category
+        return view.get(self.request)
         
     def form_valid(self, form):
         """
@@ -91,21 +294,71 @@ class VoteView(NeverCacheMixin, WorkingSingleObjectMixin, FormView):
             :class:`~notorhot.views.VoteView`, overriding this method, and 
             hooking up the subclass to the urlconf (see :doc:`Extending NotorHot 
             documentation <../extending>`).
+            
+        If ``settings.NOTORHOT_SETTINGS['VOTE_QUEUE']`` is set, the vote is 
+        queued (see :meth:`queue_vote`) rather than recorded, unless the 
+        queue is full (see 
+        :meth:`~notorhot.models.QueuedVoteManager.is_full`).  A vote that 
+        arrives while it is full is recorded as usual; or, if 
+        ``settings.NOTORHOT_SETTINGS['VOTE_QUEUE_OVERFLOW']`` is ``'reject'``,
+        refused with a 503 (Service Unavailable) response.
         """
+        queue = get_notorhot_setting('VOTE_QUEUE', False)
+        if queue and QueuedVote.objects.is_full():
+            if get_notorhot_setting('VOTE_QUEUE_OVERFLOW', 'sync') == 'reject':
+                response = self.render_to_response(self.get_context_data(
+                    form=form), status=503)
+                response['Retry-After'] = str(self.overload_retry_after)
+                return response
+            queue = False
+            
         try:
-            form.save()
+            if queue:
+                self.queue_vote(form)
+            else:
+                form.save()
         except Competition.AlreadyVoted:
             # if the competition's already been voted in, there's a pretty 
             # good chance this was just because the user double-clicked the 
             # submit button or something.  The most user-friendly thing to do
             # here is to swallow the error and just give them a new 
             # Competition anyway.
-            pass
-        else:
-            # save in session for display on next competition
-            self.request.session['last_vote_pk'] = self.object.pk
+            if self.renders_next_competition():
+                return self.render_next_competition(None)
+            return super(VoteView, self).form_valid(form)
+            
+        cookie = get_notorhot_setting('PREVIOUS_VOTE_STORAGE', 
+            'session') == 'cookie'
+        if self.renders_next_competition():
+            return self.render_next_competition(self.object.get_summary() 
+                if cookie else self.object)
+            
+        if cookie:
+            response = super(VoteView, self).form_valid(form)
+            response.set_signed_cookie(PREVIOUS_VOTE_COOKIE, 
+                json.dumps(self.object.get_summary()), salt=PREVIOUS_VOTE_SALT,
+                httponly=True)
+            return response
+            
+        # save in session for display on next competition; the side too, in
+        # case the vote was only queued
+        self.request.session['last_vote_pk'] = self.object.pk
+        self.request.session['last_vote_side'] = self.object.winning_side
         return super(VoteView, self).form_valid(form)
     
+    def queue_vote(self, form):
+        """
+        Appends the vote to the :class:`~notorhot.models.QueuedVote` queue, 
+        to be recorded later by the ``drain_vote_queue`` management command.
+        The competition is updated in memory (only) as if the vote had been 
+        recorded, so that previous vote data shows the result.
+        """
+        winner = form.cleaned_data['winner']
+        QueuedVote.objects.enqueue(self.object, winner)
+        self.object.winning_side = winner
+        self.object.winner = self.object.left \
+            if winner == Competition.SIDES.LEFT else self.object.right
+    
     def form_invalid(self, form):
         """
         Since we'll 404 if the competition has already been voted on, the only
@@ -122,7 +375,10 @@ class VoteView(NeverCacheMixin, WorkingSingleObjectMixin, FormView):
         Adds :class:`~notorhot.models.Competition` instance to keyword arguments
         used to initialize :class:`~notorhot.forms.VoteForm`.
         """
-        if not self.object.category.is_public:
+        if not get_related_instance(self.object, 'category').is_public:
+            raise Http404
+        # expired competitions are treated as if already purged
+        if self.object.is_expired():
             raise Http404
             
         kwargs = super(VoteView, self).get_form_kwargs()
@@ -130,7 +386,237 @@ class VoteView(NeverCacheMixin, WorkingSingleObjectMixin, FormView):
         return kwargs
         
     def get_success_url(self):
-        return self.object.category.get_absolute_url()
+        return get_related_instance(self.object, 'category').get_absolute_url()
+        
+
+class TokenVoteView(VoteView):
+    """
+    Processes a vote on a lazily-presented (unsaved) 
+    :class:`~notorhot.models.Competition`, identified by the signed token 
+    POSTed as ``token`` rather than by primary key.  The competition is saved 
+    along with the vote.  Used when 
+    ``settings.NOTORHOT_SETTINGS['LAZY_COMPETITIONS']`` is enabled.
+    """
+    def get_object(self, queryset=None):
+        try:
+            return Competition.objects.from_token(
+                self.request.POST.get('token', ''))
+        except Competition.InvalidToken:
+            raise Http404
+        
+
+class BatchVoteView(NeverCacheMixin, View):
+    """
+    Records a batch of votes (e.g. votes queued by an offline client) in one 
+    request, via 
+    :meth:`~notorhot.models.CompetitionGeneratingManager.record_votes_bulk`.
+    
+    The request body must be a JSON list of ``[competition_id, 
+    winning_side]`` pairs.  The response is a JSON object whose ``results``
+    list gives, for each pair in order, the competition ID and one of the 
+    :attr:`~notorhot.models.Competition.VOTE_RESULTS` values.  Competitions in
+    non-public categories are reported as not found.  Nothing is written to 
+    the session.
+    """
+    http_method_names = ['post',]
+    max_batch_size = 100
+    
+    def post(self, request, *args, **kwargs):
+        try:
+            votes = [(int(competition_id), int(winner)) for 
+                (competition_id, winner) in json.loads(request.body)]
+        except (ValueError, TypeError):
+            return HttpResponseBadRequest(
+                u"Expected a JSON list of [competition_id, winning_side] pairs")
+        if len(votes) > self.max_batch_size:
+            return HttpResponseBadRequest(u"No more than %d votes per batch" % 
+                self.max_batch_size)
+            
+        results = Competition.objects.record_votes_bulk(votes, 
+            Competition.objects.filter(category__is_public=True))
+            
+        return HttpResponse(json.dumps({ 'results': [{ 
+            'competition': competition_id, 
+            'result': result, 
+        } for (competition_id, result) in results], }), 
+            content_type='application/json')
+        
+
+class BaseCompetitionAPIView(NeverCacheMixin, CategoryMixin, View):
+    """
+    Base class for the JSON API views, which work on the public 
+    :class:`~notorhot.models.CandidateCategory` named by the 
+    ``category_slug`` keyword argument, and respond with competitions 
+    presented by 
+    :meth:`~notorhot.models.CompetitionGeneratingManager.present_values_for_category`.
+    """
+    default_count = 1
+    max_count = 20
+    
+    def get_category(self):
+        cat = self._get_category()
+        if cat is None or not cat.is_public:
+            raise Http404
+        return cat
+        
+    def get_count(self, value):
+        """
+        :returns: number of competitions requested, ``default_count`` if 
+            ``value`` is empty, or ``None`` if it is not between 1 and 
+            ``max_count``
+        """
+        if value in (None, ''):
+            return self.default_count
+        try:
+            count = int(value)
+        except (ValueError, TypeError):
+            return None
+        if not 1 <= count <= self.max_count:
+            return None
+        return count
+        
+    def present_competitions(self, count):
+        try:
+            return Competition.objects.present_values_for_category(
+                self.category, count)
+        except Candidate.DoesNotExist:
+            # not enough candidates; the client should try again later
+            return []
+            
+    def render_json(self, data):
+        return HttpResponse(json.dumps(data), content_type='application/json')
+        
+    def count_error(self):
+        return HttpResponseBadRequest(u"count must be between 1 and %d" % 
+            self.max_count)
+            
+
+class CompetitionAPIView(BaseCompetitionAPIView):
+    """
+    Presents ``count`` (from the query string; default 5) new competitions in
+    one request, so a client can buffer them ahead of the user.  The 
+    response is a JSON object whose ``competitions`` list is as returned by
+    :meth:`~notorhot.models.CompetitionGeneratingManager.present_values_for_category`
+    (empty if the category has too few candidates).
+    """
+    http_method_names = ['get',]
+    default_count = 5
+    
+    def get(self, request, *args, **kwargs):
+        count = self.get_count(request.GET.get('count'))
+        if count is None:
+            return self.count_error()
+        return self.render_json({ 
+            'competitions': self.present_competitions(count), 
+        })
+        
+
+class VoteAPIView(BaseCompetitionAPIView):
+    """
+    Records a vote and presents the next competition(s) in the same 
+    response.  Nothing is written to the session.
+    
+    The request body must be a JSON object with ``winning_side`` and either 
+    ``competition`` (an ID) or ``token`` (for an unsaved competition), and 
+    may give ``count``, the number of competitions to present (default 1).
+    The response is a JSON object with ``result``, one of the 
+    :attr:`~notorhot.models.Competition.VOTE_RESULTS` values, and 
+    ``competitions``, as for :class:`CompetitionAPIView`.  Competitions 
+    outside the category are reported as not found.
+    """
+    http_method_names = ['post',]
+    
+    def record_vote(self, data):
+        RESULTS = Competition.VOTE_RESULTS
+        winner = data.get('winning_side')
+        
+        if data.get('token'):
+            try:
+                competition = Competition.objects.from_token(data['token'])
+            except Competition.InvalidToken:
+                return RESULTS.NOT_FOUND
+            if competition.category_id != self.category.pk:
+                return RESULTS.NOT_FOUND
+            if winner not in Competition.SIDES:
+                return RESULTS.INVALID
+            try:
+                competition.record_vote(winner)
+            except Competition.AlreadyVoted:
+                return RESULTS.ALREADY_VOTED
+            return RESULTS.OK
+            
+        try:
+            competition_id = int(data.get('competition'))
+        except (ValueError, TypeError):
+            return RESULTS.INVALID
+        return Competition.objects.record_votes_bulk(
+            [(competition_id, winner)], 
+            Competition.objects.filter(category=self.category))[0][1]
+    
+    def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return HttpResponseBadRequest(u"Expected a JSON object")
+        count = self.get_count(data.get('count'))
+        if count is None:
+            return self.count_error()
+            
+        return self.render_json({
+            'result': self.record_vote(data),
+            'competitions': self.present_competitions(count),
+        })
+        
+
+class ExportView(NeverCacheMixin, View):
+    """
+    Streams voted competitions or candidate statistics as a CSV or JSON Lines
+    download (see :mod:`notorhot.export`), to staff users only.  The kind 
+    and format come from the ``kind`` and ``format`` keyword arguments; the 
+    query string may give ``category`` (a slug; may be repeated), ``since`` 
+    and ``until`` (``YYYY-MM-DD``), and ``gzip=1``.
+    """
+    http_method_names = ['get',]
+    content_types = {
+        'csv': 'text/csv; charset=utf-8',
+        'jsonl': 'application/x-ndjson; charset=utf-8',
+    }
+    
+    @method_decorator(staff_member_required)
+    def dispatch(self, *args, **kwargs):
+        return super(ExportView, self).dispatch(*args, **kwargs)
+    
+    def get(self, request, kind, format):
+        if kind not in EXPORT_KINDS or format not in EXPORT_FORMATS:
+            raise Http404
+        try:
+            (since, until) = (parse_day(request.GET.get('since')), 
+                parse_day(request.GET.get('until')))
+        except ValueError:
+            return HttpResponseBadRequest(u"since and until must be dates as "
+                u"YYYY-MM-DD")
+                
+        categories = None
+        slugs = request.GET.getlist('category')
+        if slugs:
+            categories = list(CandidateCategory.objects.filter(
+                slug__in=slugs))
+            if len(categories) != len(set(slugs)):
+                raise Http404
+        
+        gzip = request.GET.get('gzip') == '1'
+        response = StreamingHttpResponse(iter_export(kind, format, categories,
+            since, until, gzip=gzip), content_type=self.content_types[format])
+        
+        filename = '%s.%s' % (kind, format)
+        if gzip:
+            filename += '.gz'
+            response['Content-Type'] = 'application/gzip'
+        response['Content-Disposition'] = 'attachment; filename="%s"' % \
+            filename
+        return response
         
 
 class CandidateView(SingleObjectTemplateResponseMixin, CategoryMixin, 
@@ -143,8 +629,26 @@ class CandidateView(SingleObjectTemplateResponseMixin, CategoryMixin,
     queryset = Candidate.enabled.all()
     context_object_name = 'candidate'
     
+    def get_object(self, queryset=None):
+        """
+        Looks the candidate up through its 
+        :class:`~notorhot.caching.InstanceCache`, unless a ``queryset`` is 
+        given.
+        """
+        if queryset is not None:
+            return super(CandidateView, self).get_object(queryset)
+            
+        try:
+            candidate = get_instance_cache(Candidate).get_by_slug(
+                self.kwargs.get(self.slug_url_kwarg))
+        except Candidate.DoesNotExist:
+            raise Http404
+        if not candidate.is_enabled:
+            raise Http404
+        return candidate
+    
     def get_category(self):
-        cat = self.object.category
+        cat = get_related_instance(self.object, 'category')
         if not cat.is_public:
             raise Http404
         return cat
@@ -158,6 +662,10 @@ class LeaderboardView(CategoryMixin, TemplateView):
     template_name = 'notorhot/leaders.html'
     http_method_names = ['get',]
     leaderboard_length = 10
+    # 'wins' (win percentage), 'rating' (Elo rating) or 'strength' 
+    # (Bradley-Terry strength); defaults to 
+    # settings.NOTORHOT_SETTINGS['LEADERBOARD_RANKING']
+    ranking = None
     
     def get_category(self):
         cat = self._get_category()
@@ -165,15 +673,62 @@ class LeaderboardView(CategoryMixin, TemplateView):
             raise Http404
         return cat    
     
+    def get_ranking(self):
+        return self.ranking or get_notorhot_setting('LEADERBOARD_RANKING', 
+            'wins')
+    
+    def get_leaderboard_cache(self):
+        return LeaderboardCache(self.category.pk)
+    
     def get_leaders(self):
-        return Candidate.enabled.for_category(self.category).order_by_wins(
-            )[:self.leaderboard_length]
+        """
+        Retrieves the leaders through the category's 
+        :class:`~notorhot.caching.LeaderboardCache`, if leaderboard caching is
+        configured.
+        """
+        cache = self.get_leaderboard_cache()
+        if not cache.is_enabled:
+            return self.compute_leaders()
+        
+        # Candidate instances can't be pickled (their FieldTracker patches 
+        # save()), so field values are cached and the instances rebuilt
+        fields = [f.attname for f in Candidate._meta.concrete_fields]
+        rows = cache.get('%s:%s' % (self.get_ranking(), 
+            self.leaderboard_length), lambda: [dict((name, getattr(leader, 
+            name)) for name in fields) for leader in self.compute_leaders()])
+        
+        category = self.category
+        leaders = []
+        for row in rows:
+            leader = Candidate(**row)
+            leader.category = category
+            leaders.append(leader)
+        return leaders
+    
+    def compute_leaders(self):
+        candidates = Candidate.enabled.for_category(self.category)
+        ranking = self.get_ranking()
+        if ranking == 'rating':
+            candidates = candidates.order_by_rating()
+        elif ranking == 'strength':
+            candidates = candidates.order_by_strength()
+        else:
+            candidates = candidates.order_by_wins()
+        leaders = list(candidates[:self.leaderboard_length])
+        
+        buffer = get_counter_buffer()
+        if buffer is not None:
+            leaders = buffer.apply_pending(leaders)
+        return leaders
     
     def get_context_data(self, *args, **kwargs):
         context = super(LeaderboardView, self).get_context_data()
         
         context.update({
-            'leaders': self.get_leaders()
+            'leaders': self.get_leaders(),
+            'ranking': self.get_ranking(),
+            # for use as a {% cache %} fragment key; None if not caching
+            'leaderboard_version': self.get_leaderboard_cache().get_version(),
         })
         
         return context
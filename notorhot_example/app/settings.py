@@ -64,6 +64,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # a file rather than in memory, so tests' threads can share it
+        'TEST_NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
     }
 }
 
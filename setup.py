@@ -40,4 +40,7 @@ setup(
         'mixer',
         'mock'
     ],
+    extras_require={
+        'strength': ['numpy'],
+    },
 )
\ No newline at end of file